@@ -0,0 +1,231 @@
+"""Model bake-off for the daily sales value forecast.
+
+Trains the candidate models from dynamic.ipynb (linear regression, random forest
+and XGBoost) on the same lagged feature set and reports, for each one:
+test/train MSE, fit wall time, predict latency, peak memory and model size.
+
+Each candidate is fitted in its own worker process so the fits run concurrently
+and the memory numbers of one model don't leak into another. Results are
+appended to a CSV file so speed and accuracy can be tracked across runs.
+
+Example:
+    python bakeoff.py --data sales_train.csv --models linear random_forest xgboost \
+        --n-jobs 2 --xgb-tree-method hist --workers 3 --out bakeoff_results.csv
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import pickle
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MODELS = ["linear", "random_forest", "xgboost"]
+
+RESULT_FIELDS = [
+    "run_at", "model", "params", "n_train", "n_test",
+    "mse_train", "mse_test", "fit_s", "predict_s", "predict_row_ms",
+    "peak_traced_mb", "peak_rss_mb", "model_bytes",
+]
+
+
+def load_sales(path):
+    """Load and clean the raw daily sales file, same filters as the notebook."""
+    df = pd.read_csv(path)
+    df['date'] = pd.to_datetime(df['date'], format='%d.%m.%Y')
+    df = df[df['item_price'] < 100000]
+    df = df[df['item_cnt_day'] < 1001]
+    df = df[df['item_price'] <= df['item_price'].quantile(0.95)]
+    df = df[df['item_cnt_day'] >= 0]
+    df = df.assign(value=df['item_price'] * df['item_cnt_day'])
+    return df
+
+
+def build_features(df, seq_len=30, test_size=0.2):
+    """Build the lag + date block + rolling mean + day-of-week feature set.
+
+    Returns:
+        X_train, X_test, y_train, y_test and the fitted value scaler, which is
+        needed to report MSE on the original (unscaled) values.
+    """
+    value_by_day = df.groupby(['date', 'date_block_num'])['value'].sum().reset_index()
+    value_by_day = value_by_day.sort_values('date').reset_index(drop=True)
+    value_by_day['dayofweek'] = value_by_day['date'].dt.dayofweek
+    value_by_day['rolling_mean_7'] = value_by_day['value'].rolling(7).mean()
+
+    scaler_value = MinMaxScaler()
+    value_by_day['value_scaled'] = scaler_value.fit_transform(value_by_day[['value']])
+    value_by_day['block_scaled'] = MinMaxScaler().fit_transform(value_by_day[['date_block_num']])
+    value_by_day['roll7_scaled'] = MinMaxScaler().fit_transform(value_by_day[['rolling_mean_7']])
+
+    lags = {f'lag_{lag}': value_by_day['value_scaled'].shift(lag) for lag in range(1, seq_len + 1)}
+    value_by_day = pd.concat([value_by_day, pd.DataFrame(lags)], axis=1)
+    value_by_day = value_by_day.dropna().reset_index(drop=True)
+
+    encoder = OneHotEncoder(sparse_output=False, drop='first')
+    dow_encoded = encoder.fit_transform(value_by_day[['dayofweek']])
+
+    feature_cols = list(lags) + ['block_scaled', 'roll7_scaled']
+    X = np.hstack([value_by_day[feature_cols].values, dow_encoded]).astype(np.float32)
+    y = value_by_day['value_scaled'].values
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, shuffle=False, test_size=test_size)
+    return X_train, X_test, y_train, y_test, scaler_value
+
+
+def build_model(name, n_jobs=None, xgb_tree_method=None):
+    """Create an unfitted model with the notebook's hyperparameters."""
+    if name == "linear":
+        return LinearRegression(n_jobs=n_jobs)
+    if name == "random_forest":
+        return RandomForestRegressor(n_estimators=100, max_depth=8, random_state=42, n_jobs=n_jobs)
+    if name == "xgboost":
+        # Imported here so the other candidates still run without xgboost installed
+        from xgboost import XGBRegressor
+        params = dict(n_estimators=100, max_depth=6, learning_rate=0.1, subsample=0.8,
+                      colsample_bytree=0.8, random_state=42, n_jobs=n_jobs)
+        if xgb_tree_method:
+            params['tree_method'] = xgb_tree_method
+        return XGBRegressor(**params)
+    raise ValueError(f"Unknown model '{name}'. Must be one of: {', '.join(MODELS)}")
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux but bytes on macOS
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def run_candidate(name, X_train, X_test, y_train, y_test, scaler_value,
+                  n_jobs=None, xgb_tree_method=None, latency_repeats=50):
+    """Fit and evaluate one model. Runs inside a worker process."""
+    model = build_model(name, n_jobs=n_jobs, xgb_tree_method=xgb_tree_method)
+
+    # tracemalloc sees NumPy/sklearn buffers; native allocations (e.g. XGBoost)
+    # only show up in the process RSS peak, so both are reported
+    tracemalloc.start()
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_s = time.perf_counter() - start
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    y_pred_test = model.predict(X_test)
+    predict_s = time.perf_counter() - start
+
+    # Single-row latency is what a live pricing request pays
+    row = X_test[:1]
+    timings = []
+    for _ in range(latency_repeats):
+        start = time.perf_counter()
+        model.predict(row)
+        timings.append(time.perf_counter() - start)
+
+    y_pred_train = model.predict(X_train)
+    unscale = lambda v: scaler_value.inverse_transform(np.asarray(v).reshape(-1, 1)).flatten()
+
+    return {
+        "model": name,
+        "params": json.dumps({"n_jobs": n_jobs, "tree_method": xgb_tree_method if name == "xgboost" else None}),
+        "n_train": len(X_train),
+        "n_test": len(X_test),
+        "mse_train": mean_squared_error(unscale(y_train), unscale(y_pred_train)),
+        "mse_test": mean_squared_error(unscale(y_test), unscale(y_pred_test)),
+        "fit_s": fit_s,
+        "predict_s": predict_s,
+        "predict_row_ms": float(np.median(timings)) * 1000,
+        "peak_traced_mb": peak_traced / (1024 * 1024),
+        "peak_rss_mb": _peak_rss_mb(),
+        "model_bytes": len(pickle.dumps(model)),
+    }
+
+
+def run_bakeoff(X_train, X_test, y_train, y_test, scaler_value, models=MODELS,
+                workers=None, n_jobs=None, xgb_tree_method=None):
+    """Fit all candidates concurrently and return their results rows."""
+    results = []
+    # One fresh process per fit keeps the RSS peak attributable to a single model
+    with ProcessPoolExecutor(max_workers=workers or len(models), max_tasks_per_child=1) as pool:
+        futures = {
+            pool.submit(run_candidate, name, X_train, X_test, y_train, y_test, scaler_value,
+                        n_jobs=n_jobs, xgb_tree_method=xgb_tree_method): name
+            for name in models
+        }
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"❌ {futures[future]} failed: {e}")
+
+    run_at = datetime.datetime.now().isoformat(timespec='seconds')
+    for row in results:
+        row["run_at"] = run_at
+    return sorted(results, key=lambda r: r["mse_test"])
+
+
+def write_results(results, path):
+    """Append results to a CSV file, writing the header for a new file."""
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(results)
+
+
+def print_results(results):
+    print(f"{'model':<15}{'mse_test':>16}{'fit_s':>10}{'predict_s':>11}{'row_ms':>9}"
+          f"{'traced_mb':>11}{'rss_mb':>9}{'size_kb':>10}")
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else "-"
+        print(f"{r['model']:<15}{r['mse_test']:>16.2f}{r['fit_s']:>10.3f}{r['predict_s']:>11.4f}"
+              f"{r['predict_row_ms']:>9.3f}{r['peak_traced_mb']:>11.1f}{rss:>9}"
+              f"{r['model_bytes'] / 1024:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare demand forecasting models on speed and accuracy.")
+    parser.add_argument("--data", default="sales_train.csv", help="Raw daily sales CSV")
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS)
+    parser.add_argument("--seq-len", type=int, default=30, help="Number of lag features")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Concurrent fits (default: one per model)")
+    parser.add_argument("--n-jobs", type=int, default=None,
+                        help="Threads per model for engines that support it")
+    parser.add_argument("--xgb-tree-method", choices=["auto", "exact", "approx", "hist"], default=None,
+                        help="XGBoost tree construction algorithm")
+    parser.add_argument("--out", default="bakeoff_results.csv", help="CSV file results are appended to")
+    args = parser.parse_args()
+
+    df = load_sales(args.data)
+    X_train, X_test, y_train, y_test, scaler_value = build_features(df, args.seq_len, args.test_size)
+    print(f"Training on {len(X_train)} days, testing on {len(X_test)} days, {X_train.shape[1]} features\n")
+
+    results = run_bakeoff(X_train, X_test, y_train, y_test, scaler_value, models=args.models,
+                          workers=args.workers, n_jobs=args.n_jobs, xgb_tree_method=args.xgb_tree_method)
+    print_results(results)
+    write_results(results, args.out)
+    print(f"\nResults appended to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,258 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, func, and_
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
+from sqlalchemy.orm import Session, selectinload, joinedload, attributes
+from sqlalchemy import create_engine, func, and_, tuple_, update, insert, select, literal, bindparam
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.orm import sessionmaker
-from typing import List, Optional
-import pandas as pd
+from typing import Dict, List, Optional
 import json
+import csv
+import io
+import os
 import datetime
 import asyncio
+import threading
+import time
+import itertools
+import collections
+import logging
 from contextlib import asynccontextmanager
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # Import our models and prediction engine
-from database_models import Base, Product, ProfitGroup, Sale, SaleItem, Customer, PricingRule, StoreStatus
-from sales_prediction_model import SalesPredictionModel
+from database_models import (Base, Product, ProfitGroup, Sale, SaleItem, Customer, PricingRule, StoreStatus, SalesRollup,
+                             Store, StoreProduct, PriceHistory, DemandStats, ReplenishmentPlan, OutboxEvent,
+                             BroadcastMessage, DEFAULT_STORE_ID, product_group_association, add_missing_columns,
+                             add_autoincrement)
+from sales_rollup import record_sale_item, rebuild_sales_rollup
+import elasticity
+from schemas import ProductOut, SaleOut, SaleDetailOut, StatusReading, RuleSimulationRequest
+from catalog_cache import CatalogCache
+import ws_protocol
+from leaderboard import Leaderboard
+import outbox
+import pubsub
+import price_history
+import change_counters
+from status_ingest import (STATUS_RULE_TYPES, RetentionPolicy, StatusCoalescer, status_rule_active,
+                           flipped_products, downsample)
+from pricing_schedule import TIME_RULE_TYPES, rule_active, local_time, plan_next_transition
+import metrics
+from profiler import SlowRequestProfiler
+from catalog_import import FORMATS as IMPORT_FORMATS, iter_lines, import_catalog
+
+logger = logging.getLogger("pos.api")
+
+# Use orjson for responses when it is installed
+try:
+    import orjson
+    DefaultResponse = ORJSONResponse
+except ImportError:
+    DefaultResponse = JSONResponse
 
 # Database setup
-DATABASE_URL = "sqlite:///./pos_system.db"
+DATABASE_URL = os.environ.get("POS_DATABASE_URL", "sqlite:///./pos_system.db")
 engine = create_engine(DATABASE_URL)
+metrics.track_sql(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+def setup_database():
+    """Create missing tables, columns and indexes, and seed the default store; run at startup."""
+    # Create database tables
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    add_autoincrement(engine, OutboxEvent)
+    add_autoincrement(engine, BroadcastMessage)
+    
+    # create_all skips indexes on tables that already exist, so add any new ones
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    
+    # Existing single-store databases become the default store
+    with SessionLocal() as db:
+        if db.get(Store, DEFAULT_STORE_ID) is None:
+            db.add(Store(id=DEFAULT_STORE_ID, name="Main store", timezone=os.environ.get("POS_TIMEZONE", "UTC")))
+            db.commit()
+        # Start the price history from the prices in effect now
+        if db.query(PriceHistory.epoch).first() is None:
+            price_history.snapshot(db)
+            db.commit()
+        # Databases from before the rollup get it built from their raw sales
+        # (this also builds the demand statistics)
+        if db.query(SalesRollup.product_id).first() is None and db.query(SaleItem.id).first() is not None:
+            rebuild_sales_rollup(db)
+        # Databases from before the demand statistics start them from the rollup
+        if db.query(DemandStats.product_id).first() is None and db.query(SalesRollup.product_id).first() is not None:
+            elasticity.rebuild_demand_stats(db)
+            db.commit()
 
-# Initialize prediction model
-prediction_model = SalesPredictionModel()
+# Prediction model. pandas and scikit-learn take seconds to import, so they are
+# loaded on first use, or in the background after startup unless
+# POS_PREDICTION_WARMUP=0; POS traffic never waits for them.
+prediction_model = None
+prediction_model_lock = threading.Lock()
 model_trained = False
+PREDICTION_WARMUP = os.environ.get("POS_PREDICTION_WARMUP", "1") != "0"
+
+def get_prediction_model():
+    global prediction_model
+    if prediction_model is None:
+        with prediction_model_lock:
+            if prediction_model is None:
+                with MODEL_SECONDS.time(operation="load"):
+                    from sales_prediction_model import SalesPredictionModel
+                    prediction_model = SalesPredictionModel()
+    return prediction_model
+
+# Sales summaries of closed (past) date ranges, keyed by (start_day, end_day,
+# closed sales counter); a checkout on a sale from before today bumps the counter
+summary_cache = {}
+CLOSED_SALES_COUNTER = "closed_sales"
+SUMMARY_CACHE_SIZE = 1024
+
+# In-memory product catalog, kept current by write-through on every commit
+catalog = CatalogCache()
+catalog.attach(SessionLocal)
+
+# Every current price change is appended to the price history on flush
+price_history.attach(SessionLocal)
+CATALOG_REFRESH_SECONDS = 2.0
+
+# Rolling-window top products, fed by each checkout
+leaderboard = Leaderboard(window_hours=24, capacity=100, k=10)
+LEADERBOARD_PUSH_SECONDS = 1.0
+LEADERBOARD_RECONCILE_SECONDS = 300.0
+
+# The replenishment plan is recomputed on a schedule and served from its table;
+# the first run waits for startup to settle
+REPLENISHMENT_PLAN_SECONDS = 3600.0
+REPLENISHMENT_START_DELAY = 60.0
+
+# Broadcast events are written to the outbox with their change and delivered
+# by a background dispatcher; commits wake it, the poll is only a fallback
+OUTBOX_POLL_SECONDS = 1.0
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_RETENTION = datetime.timedelta(days=1)
+OUTBOX_PRUNE_SECONDS = 3600.0
+outbox_wakeup: Optional[asyncio.Event] = None
+background_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Time-based pricing rules are applied by a scheduler that sleeps until the
+# next rule boundary; rule and timezone changes wake it to replan. The cap
+# bounds how long it misses changes made by other workers.
+PRICING_SCHEDULE_MAX_SLEEP = 300.0
+pricing_rules_changed: Optional[asyncio.Event] = None
+
+# Sensor readings are coalesced per store and applied once per debounce window;
+# raw rows are downsampled into minute, then hour aggregates as they age
+STATUS_DEBOUNCE_SECONDS = 1.0
+STATUS_DOWNSAMPLE_SECONDS = 600.0
+STATUS_RETENTION = RetentionPolicy(
+    raw=datetime.timedelta(hours=float(os.environ.get("POS_STATUS_RAW_RETENTION_HOURS", 24))),
+    minute=datetime.timedelta(days=float(os.environ.get("POS_STATUS_MINUTE_RETENTION_DAYS", 30))),
+    hour=(datetime.timedelta(days=float(os.environ["POS_STATUS_HOUR_RETENTION_DAYS"]))
+          if os.environ.get("POS_STATUS_HOUR_RETENTION_DAYS") else None)
+)
+status_readings = StatusCoalescer()
+
+# Carries dispatched events to the WebSocket connections of every worker
+# process; see pubsub for the POS_PUBSUB options
+broadcaster = pubsub.create_backend(os.environ.get("POS_PUBSUB", "memory"), SessionLocal)
 
 # WebSocket connection manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, batch_window: float = 0.05):
+        # Each connection maps to the wire format it negotiated (see ws_protocol)
+        self.active_connections: Dict[WebSocket, str] = {}
+        self.batch_window = batch_window
+        self.pending_events: List[dict] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        # Connections still catching up on missed events buffer live ones here
+        self.replaying: Dict[WebSocket, List[dict]] = {}
+        # Store a connection subscribed to; None receives every store's events
+        self.stores: Dict[WebSocket, Optional[int]] = {}
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, fmt: str = "json", store_id: Optional[int] = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections[websocket] = fmt
+        self.stores[websocket] = store_id
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.active_connections.pop(websocket, None)
+        self.replaying.pop(websocket, None)
+        self.stores.pop(websocket, None)
+
+    @staticmethod
+    def for_store(events: List[dict], store_id: Optional[int]):
+        """Keep the events a subscriber to `store_id` should see; events without a store go to everyone."""
+        if store_id is None:
+            return events
+        return [e for e in events if e.get("store_id", store_id) == store_id]
+
+    async def broadcast(self, event: dict):
+        """Queue an event; events within one batch window go out together."""
+        self.pending_events.append(event)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_after_window())
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.batch_window)
+        events, self.pending_events = self.pending_events, []
+        self.flush_task = None
+        await self.send_events(events)
+
+    async def send_events(self, events: List[dict]):
+        """Send a batch of events to every connection right away."""
+        # Encode once per format and store rather than once per connection
+        frames_by_key = {}
+        for connection, fmt in list(self.active_connections.items()):
+            if connection in self.replaying:
+                self.replaying[connection].extend(events)
+                continue
+            key = (fmt, self.stores.get(connection))
+            if key not in frames_by_key:
+                visible = self.for_store(events, key[1])
+                frames_by_key[key] = ws_protocol.encode_frames(visible, fmt) if visible else []
+            await self.send_frames(connection, frames_by_key[key])
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def send_frames(self, connection: WebSocket, frames):
+        try:
+            for frame in frames:
+                if isinstance(frame, bytes):
+                    await connection.send_bytes(frame)
+                else:
+                    await connection.send_text(frame)
+        except Exception:
+            self.disconnect(connection)
+
+    async def replay(self, websocket: WebSocket, since: int):
+        """Send outbox events after `since` to one connection, then switch it to live events.
+
+        Live events arriving meanwhile are buffered and sent after the replay,
+        skipping any the replay already covered, so the connection sees every
+        event in sequence order.
+        """
+        fmt = self.active_connections[websocket]
+        store_id = self.stores.get(websocket)
+        self.replaying[websocket] = []
+        while True:
+            events = await asyncio.to_thread(load_outbox_events, since, OUTBOX_BATCH_SIZE)
+            if not events:
+                break
+            since = events[-1]["seq"]
+            visible = self.for_store(events, store_id)
+            if visible:
+                await self.send_frames(websocket, ws_protocol.encode_frames(visible, fmt))
+        
+        while self.replaying.get(websocket):
+            buffered = [e for e in self.for_store(self.replaying[websocket], store_id) if e.get("seq", since + 1) > since]
+            self.replaying[websocket] = []
+            if buffered:
+                await self.send_frames(websocket, ws_protocol.encode_frames(buffered, fmt))
+        self.replaying.pop(websocket, None)
 
 
 # Dependency to get DB session
@@ -52,8 +264,357 @@ def get_db():
         db.close()
 
 
+def refresh_catalog():
+    db = SessionLocal()
+    try:
+        return catalog.refresh_if_stale(db)
+    finally:
+        db.close()
+
+async def refresh_catalog_periodically():
+    """Pick up catalog changes made by other worker processes."""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+        try:
+            await asyncio.to_thread(refresh_catalog)
+        except Exception:
+            logger.exception("Catalog refresh failed; serving the cached catalog until the next try")
+
+def reconcile_leaderboard():
+    db = SessionLocal()
+    try:
+        leaderboard.reconcile(db)
+    finally:
+        db.close()
+
+async def reconcile_leaderboard_periodically():
+    """Correct the streaming estimates against exact totals from the sales rollup."""
+    while True:
+        await asyncio.sleep(LEADERBOARD_RECONCILE_SECONDS)
+        try:
+            await asyncio.to_thread(reconcile_leaderboard)
+        except Exception:
+            # The estimates keep streaming; the next run corrects them
+            logger.exception("Leaderboard reconciliation failed")
+
+def run_replenishment_plan():
+    from replenishment import plan_replenishment  # Needs NumPy, which startup doesn't load
+    db = SessionLocal()
+    try:
+        with MODEL_SECONDS.time(operation="replenishment"):
+            return plan_replenishment(db, get_prediction_model() if model_trained else None)
+    finally:
+        db.close()
+
+async def plan_replenishment_periodically():
+    """Recompute stockout dates and reorder quantities for the whole catalog."""
+    await asyncio.sleep(REPLENISHMENT_START_DELAY)
+    while True:
+        try:
+            await asyncio.to_thread(run_replenishment_plan)
+        except Exception:
+            # The previous plan stays until the next run
+            logger.exception("Replenishment planning failed")
+        await asyncio.sleep(REPLENISHMENT_PLAN_SECONDS)
+
+def notify_outbox():
+    """Wake the outbox dispatcher after committing events; safe to call from any thread."""
+    if background_loop is not None:
+        background_loop.call_soon_threadsafe(outbox_wakeup.set)
+
+def notify_pricing_schedule():
+    """Make the pricing scheduler replan after rules or store timezones change."""
+    if background_loop is not None:
+        background_loop.call_soon_threadsafe(pricing_rules_changed.set)
+
+def plan_pricing_transition():
+    db = SessionLocal()
+    try:
+        rules = db.query(PricingRule.product_id, PricingRule.rule_type, PricingRule.condition)\
+            .filter(PricingRule.is_active == True, PricingRule.rule_type.in_(TIME_RULE_TYPES)).all()
+        stores = db.query(Store.id, Store.timezone).all()
+    finally:
+        db.close()
+    return plan_next_transition(rules, stores, datetime.datetime.now(datetime.timezone.utc))
+
+def time_rule_targets():
+    """Get every (store_id, product_id) with an active time-based rule."""
+    db = SessionLocal()
+    try:
+        product_ids = [row.product_id for row in db.query(PricingRule.product_id).distinct()
+                       .filter(PricingRule.is_active == True, PricingRule.rule_type.in_(TIME_RULE_TYPES))]
+        store_ids = [row.id for row in db.query(Store.id)]
+    finally:
+        db.close()
+    return sorted((store_id, product_id) for store_id in store_ids for product_id in product_ids)
+
+def apply_pricing_transition(instant, targets):
+    """Reprice the (store_id, product_id) pairs whose time-based rules flip at `instant`."""
+    db = SessionLocal()
+    try:
+        changed_by_store = {}
+        for store_id, products in itertools.groupby(targets, key=lambda target: target[0]):
+            product_ids = [product_id for _, product_id in products]
+            changed = reprice_store(db, store_id, product_ids, now=instant, only_changed=True)
+            if changed:
+                changed_by_store[store_id] = changed
+        for store_id, changed in changed_by_store.items():
+            outbox.enqueue_event(db, "prices", {
+                "event": "price_update",
+                "store_id": store_id,
+                "products": changed
+            })
+        db.commit()
+    finally:
+        db.close()
+    if changed_by_store:
+        notify_outbox()
+
+async def run_pricing_schedule():
+    """Apply time-based pricing rules as they start and stop, repricing only the affected products."""
+    # Boundaries may have passed while the server was down
+    await apply_pricing_transition_with_retry(datetime.datetime.now(datetime.timezone.utc),
+                                              await asyncio.to_thread(time_rule_targets))
+    while True:
+        pricing_rules_changed.clear()
+        try:
+            instant, targets = await asyncio.to_thread(plan_pricing_transition)
+        except Exception:
+            logger.exception("Planning the next pricing transition failed; retrying later")
+            instant, targets = None, []
+        timeout = PRICING_SCHEDULE_MAX_SLEEP
+        if instant is not None:
+            timeout = min(timeout, (instant - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        try:
+            await asyncio.wait_for(pricing_rules_changed.wait(), max(timeout, 0))
+            continue  # Rules changed; plan again
+        except asyncio.TimeoutError:
+            pass
+        if instant is not None and instant <= datetime.datetime.now(datetime.timezone.utc):
+            await apply_pricing_transition_with_retry(instant, targets)
+
+async def apply_pricing_transition_with_retry(instant, targets):
+    # The next plan starts after this boundary, so a busy database must not skip
+    # it, and no failure may end the schedule
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            await asyncio.to_thread(apply_pricing_transition, instant, targets)
+            return
+        except (OperationalError, StaleDataError):
+            await asyncio.sleep(0.1 * 2 ** attempt)
+        except Exception:
+            logger.exception("Pricing transition at %s failed", instant)
+            return
+    logger.error("Gave up on pricing transition at %s after %d attempts; prices stay as they were until "
+                 "the next change", instant, CHECKOUT_RETRIES)
+
+def apply_store_status(db, store_id, vacancy_rate=None, line_length=None, timestamp=None):
+    """Record a new status for a store and reprice the products whose status rules it flips.
+    
+    Fields left as None keep the store's previous value. Stages everything,
+    including the price update event, for the caller to commit.
+    """
+    previous = latest_store_status(db, store_id)
+    old = (previous.vacancy_rate, previous.line_length) if previous else (0.0, 0)
+    status = StoreStatus(
+        store_id=store_id,
+        vacancy_rate=vacancy_rate if vacancy_rate is not None else old[0],
+        line_length=line_length if line_length is not None else old[1],
+        timestamp=timestamp or datetime.datetime.utcnow()
+    )
+    db.add(status)
+    db.flush()
+    
+    rules = db.query(PricingRule.product_id, PricingRule.rule_type, PricingRule.condition)\
+        .filter(PricingRule.is_active == True, PricingRule.rule_type.in_(STATUS_RULE_TYPES)).all()
+    flipped = flipped_products(rules, old, (status.vacancy_rate, status.line_length))
+    if flipped:
+        changed = reprice_store(db, store_id, sorted(flipped), only_changed=True)
+        if changed:
+            outbox.enqueue_event(db, "prices", {
+                "event": "price_update",
+                "store_id": store_id,
+                "products": changed
+            })
+    return status
+
+def apply_status_readings():
+    """Write the readings coalesced since the last flush, one short transaction per store."""
+    for store_id, reading in status_readings.drain().items():
+        db = SessionLocal()
+        try:
+            apply_store_status(db, store_id, reading["vacancy_rate"], reading["line_length"], reading["timestamp"])
+            db.commit()
+        except (OperationalError, StaleDataError) as e:
+            # Busy or concurrently changed; the next flush tries again
+            db.rollback()
+            status_readings.restore(store_id, reading)
+            logger.warning("Store %s status not applied, retrying on the next flush: %s", store_id, e)
+        except Exception:
+            # Dropped rather than retried forever; later readings still apply
+            db.rollback()
+            logger.exception("Store %s status reading dropped", store_id)
+        finally:
+            db.close()
+    notify_outbox()
+
+async def flush_status_readings_periodically():
+    while True:
+        await asyncio.sleep(STATUS_DEBOUNCE_SECONDS)
+        if status_readings.pending:
+            await asyncio.to_thread(apply_status_readings)
+
+def downsample_store_status():
+    db = SessionLocal()
+    try:
+        return downsample(db, STATUS_RETENTION)
+    finally:
+        db.close()
+
+async def downsample_store_status_periodically():
+    while True:
+        await asyncio.sleep(STATUS_DOWNSAMPLE_SECONDS)
+        try:
+            await asyncio.to_thread(downsample_store_status)
+        except Exception:
+            # Rows past retention wait for the next run
+            logger.exception("Store status downsampling failed")
+
+def load_outbox_events(since, limit):
+    db = SessionLocal()
+    try:
+        return [outbox.to_message(row) for row in outbox.events_since(db, since, limit)]
+    finally:
+        db.close()
+
+def count_pending_outbox():
+    db = SessionLocal()
+    try:
+        return outbox.pending_count(db)
+    finally:
+        db.close()
+
+def claim_outbox_events():
+    db = SessionLocal()
+    try:
+        return [(row.channel, outbox.to_message(row)) for row in outbox.claim_pending(db, OUTBOX_BATCH_SIZE)]
+    finally:
+        db.close()
+
+def release_outbox_events(ids):
+    db = SessionLocal()
+    try:
+        outbox.release(db, ids)
+    finally:
+        db.close()
+
+def mark_outbox_dispatched(ids):
+    db = SessionLocal()
+    try:
+        outbox.mark_dispatched(db, ids)
+    finally:
+        db.close()
+
+def prune_outbox():
+    db = SessionLocal()
+    try:
+        return outbox.prune(db, OUTBOX_RETENTION)
+    finally:
+        db.close()
+
+async def dispatch_outbox():
+    """Publish outbox events in sequence order, marking them only once published (at-least-once)."""
+    while True:
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), OUTBOX_POLL_SECONDS)
+            # Let a burst of commits land so they go out as one batch
+            await asyncio.sleep(manager.batch_window)
+        except asyncio.TimeoutError:
+            pass
+        outbox_wakeup.clear()
+        try:
+            while True:
+                claimed = await asyncio.to_thread(claim_outbox_events)
+                if not claimed:
+                    break
+                ids = [event["seq"] for _, event in claimed]
+                try:
+                    # One message per run of same-channel events keeps every channel in order
+                    for channel, run in itertools.groupby(claimed, key=lambda item: item[0]):
+                        await broadcaster.publish(channel, [event for _, event in run])
+                except Exception:
+                    # Backend unavailable; retry the batch on the next round
+                    logger.exception("Publishing %d outbox events failed; retrying next round", len(ids))
+                    await asyncio.to_thread(release_outbox_events, ids)
+                    break
+                await asyncio.to_thread(mark_outbox_dispatched, ids)
+        except OperationalError:
+            # Database busy; the events stay pending for the next round
+            pass
+        except Exception:
+            # Claimed events go back to pending when their lease runs out
+            logger.exception("Outbox dispatch failed; retrying next round")
+
+async def deliver_broadcast(channel: str, events: List[dict]):
+    await manager.send_events(events)
+
+async def prune_outbox_periodically():
+    while True:
+        await asyncio.sleep(OUTBOX_PRUNE_SECONDS)
+        try:
+            await asyncio.to_thread(prune_outbox)
+        except Exception:
+            logger.exception("Outbox pruning failed")
+
+async def push_leaderboard_changes():
+    """Broadcast the top products whenever their order changes.
+
+    The leaderboard is per process, so this goes to local connections only
+    rather than through the pub/sub backend.
+    """
+    while True:
+        await asyncio.sleep(LEADERBOARD_PUSH_SECONDS)
+        if leaderboard.changed_since_push():
+            await manager.broadcast({"event": "top_products", **leaderboard_payload()})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(setup_database)
+    db = SessionLocal()
+    try:
+        catalog.load(db)
+        leaderboard.reconcile(db)
+    finally:
+        db.close()
+    leaderboard.changed_since_push()  # Only push changes after startup
+    global outbox_wakeup, pricing_rules_changed, background_loop
+    outbox_wakeup = asyncio.Event()
+    outbox_wakeup.set()  # Deliver anything left pending by a previous run
+    pricing_rules_changed = asyncio.Event()
+    background_loop = asyncio.get_running_loop()
+    tasks = [
+        asyncio.create_task(run_pricing_schedule()),
+        asyncio.create_task(flush_status_readings_periodically()),
+        asyncio.create_task(downsample_store_status_periodically()),
+        asyncio.create_task(dispatch_outbox()),
+        asyncio.create_task(broadcaster.run(deliver_broadcast)),
+        asyncio.create_task(prune_outbox_periodically()),
+        asyncio.create_task(refresh_catalog_periodically()),
+        asyncio.create_task(reconcile_leaderboard_periodically()),
+        asyncio.create_task(push_leaderboard_changes()),
+        asyncio.create_task(plan_replenishment_periodically())
+    ]
+    if PREDICTION_WARMUP:
+        tasks.append(asyncio.create_task(asyncio.to_thread(get_prediction_model)))
+    yield
+    background_loop = None
+    for task in tasks:
+        task.cancel()
+
+
 # Initialize FastAPI app
-app = FastAPI(title="Small Business POS API with Dynamic Pricing")
+app = FastAPI(title="Small Business POS API with Dynamic Pricing", default_response_class=DefaultResponse,
+              lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -64,9 +625,41 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Time requests and their SQL for /metrics; POS_PROFILE_SLOW_MS also samples slow ones
+slow_request_profiler = SlowRequestProfiler.from_environment()
+app.add_middleware(metrics.MetricsMiddleware, profiler=slow_request_profiler)
+
 # Create connection manager
 manager = ConnectionManager()
 
+# Hot-path metrics; gauges are read when /metrics is scraped
+REPRICE_SECONDS = metrics.Histogram("pos_reprice_seconds", "Time to recalculate a batch of prices", ["kind"])
+REPRICED_PRODUCTS = metrics.Counter("pos_repriced_products_total", "Prices recalculated", ["kind"])
+MODEL_SECONDS = metrics.Histogram("pos_model_seconds", "Sales prediction model timings", ["operation"])
+metrics.Gauge("pos_websocket_connections", "Open WebSocket connections", ["format"],
+              function=lambda: {(fmt,): count for fmt, count in
+                                collections.Counter(manager.active_connections.values()).items()})
+metrics.Gauge("pos_websocket_replaying_connections", "WebSocket connections still replaying missed events",
+              function=lambda: len(manager.replaying))
+metrics.Gauge("pos_websocket_replay_buffered_events", "Live events buffered behind replays",
+              function=lambda: sum(len(events) for events in list(manager.replaying.values())))
+metrics.Gauge("pos_websocket_pending_events", "Events waiting for the broadcast batch window",
+              function=lambda: len(manager.pending_events))
+metrics.Gauge("pos_broadcast_queue_depth", "Messages waiting in the in-process pub/sub queue",
+              function=lambda: broadcaster.queue.qsize() if hasattr(broadcaster, "queue") else 0)
+metrics.Gauge("pos_status_readings_pending", "Stores with coalesced status readings waiting to be applied",
+              function=lambda: len(status_readings.pending))
+metrics.Gauge("pos_outbox_pending_events", "Outbox events not yet dispatched", function=lambda: count_pending_outbox())
+
+# Checkout retries when SQLite reports the database locked by another writer
+CHECKOUT_RETRIES = 5
+
+
+@app.exception_handler(StaleDataError)
+async def stale_data_handler(request: Request, exc: StaleDataError):
+    # A versioned row changed under this request; the client can retry
+    return JSONResponse(status_code=409, content={"detail": "Record was modified concurrently, please retry"})
+
 
 # API endpoints
 @app.get("/")
@@ -76,7 +669,8 @@ def read_root():
 # Product endpoints
 @app.post("/products/")
 def create_product(name: str, sku: str, cost_price: float, base_price: float, 
-                   stock_quantity: int, description: Optional[str] = None, db: Session = Depends(get_db)):
+                   stock_quantity: int, description: Optional[str] = None,
+                   lead_time_days: int = Query(3, ge=0, le=365), db: Session = Depends(get_db)):
     """Create a new product."""
     db_product = Product(
         name=name,
@@ -85,31 +679,138 @@ def create_product(name: str, sku: str, cost_price: float, base_price: float,
         cost_price=cost_price,
         base_price=base_price,
         current_price=base_price,  # Initially set to base price
-        stock_quantity=stock_quantity
+        stock_quantity=stock_quantity,
+        lead_time_days=lead_time_days
     )
     db.add(db_product)
+    db.flush()
+    
+    # Other stores carry the product too, starting with no stock
+    db.execute(insert(StoreProduct).from_select(
+        ["store_id", "product_id", "stock_quantity", "current_price"],
+        select(Store.id, literal(db_product.id), literal(0), literal(base_price)).where(Store.id != DEFAULT_STORE_ID)
+    ))
+    price_history.snapshot(db, product_id=db_product.id)
     db.commit()
     db.refresh(db_product)
     return db_product
 
-@app.get("/products/")
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all products."""
-    products = db.query(Product).offset(skip).limit(limit).all()
-    return products
+@app.post("/products/import")
+async def import_products(request: Request, format: str = "csv"):
+    """Create or update products by sku from a CSV or NDJSON request body.
+    
+    Columns (CSV, with a header row) or keys (NDJSON) are sku, name, cost_price,
+    base_price and optionally description and stock_quantity. The body is
+    streamed and imported in chunks, then the imported products are repriced
+    at every store in one transaction. Rows that fail validation are skipped
+    and reported by line number.
+    """
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    loop = asyncio.get_running_loop()
+    stream = request.stream().__aiter__()
+    
+    async def next_chunk():
+        return await stream.__anext__()
+    
+    def body_chunks():
+        # The import thread pulls the body from the event loop as it goes
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(next_chunk(), loop).result()
+            except StopAsyncIteration:
+                return
+    
+    summary = await asyncio.to_thread(run_catalog_import, body_chunks(), format)
+    notify_outbox()
+    return summary
 
-@app.get("/products/{product_id}")
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    """Get a specific product by ID."""
-    product = db.query(Product).filter(Product.id == product_id).first()
+def run_catalog_import(chunks, fmt):
+    db = SessionLocal()
+    try:
+        result = import_catalog(db, iter_lines(chunks), fmt)
+        repriced = reprice_imported(db, result.product_ids, result.new_product_ids)
+        # The import wrote with bulk SQL, which the cache hooks don't see
+        catalog.stage_reload(db)
+        db.commit()
+    finally:
+        db.close()
+    return {**result.summary(), "repriced": repriced}
+
+@app.get("/products/", response_model=List[ProductOut])
+def read_products(request: Request, response: Response, skip: int = 0, limit: int = 100,
+                  store_id: int = DEFAULT_STORE_ID, db: Session = Depends(get_db)):
+    """Get all products (served from the in-memory catalog), with one store's stock and prices."""
+    if store_id != DEFAULT_STORE_ID:
+        get_store(db, store_id)
+        return with_store_stock(db, store_id, catalog.list(skip, limit))
+    
+    etag = f'W/"catalog-{catalog.version}"'
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["X-Catalog-Version"] = str(catalog.version)
+    return catalog.list(skip, limit)
+
+@app.get("/products/changes")
+def product_changes(since: int = 0):
+    """Get products changed and deleted after a catalog version, for delta sync.
+    
+    When "reset" is true the client's version is too old to diff against and
+    "products" is the full catalog.
+    """
+    version = catalog.version
+    reset, products, deleted = catalog.changes_since(since)
+    return {
+        "version": version,
+        "reset": reset,
+        "products": [ProductOut.model_validate(p).model_dump() for p in products],
+        "deleted": deleted
+    }
+
+@app.get("/products/{product_id}/price-history")
+def read_price_history(product_id: int, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                       store_id: int = DEFAULT_STORE_ID, db: Session = Depends(get_db)):
+    """Get the price changes of a product at a store, including the price in effect at start_date."""
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1) if end_date else None
+    changes = price_history.price_changes(db, [product_id], store_id, start, end)
+    return {
+        "product_id": product_id,
+        "store_id": store_id,
+        "changes": [
+            {"timestamp": price_history.from_epoch(epoch), "price": cents / 100}
+            for _, epoch, cents in changes
+        ]
+    }
+
+@app.get("/products/{product_id}/price-as-of")
+def read_price_as_of(product_id: int, at: datetime.datetime, store_id: int = DEFAULT_STORE_ID,
+                     db: Session = Depends(get_db)):
+    """Get the price of a product at a store at a point in time (naive times are UTC)."""
+    price = price_history.price_as_of(db, product_id, at, store_id)
+    if price is None:
+        raise HTTPException(status_code=404, detail="No price recorded for this product at that time")
+    return {"product_id": product_id, "store_id": store_id, "at": at, "price": price}
+
+@app.get("/products/{product_id}", response_model=ProductOut)
+def read_product(product_id: int, response: Response, store_id: int = DEFAULT_STORE_ID,
+                 db: Session = Depends(get_db)):
+    """Get a specific product by ID (served from the in-memory catalog)."""
+    product = catalog.get(product_id)
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    if store_id != DEFAULT_STORE_ID:
+        get_store(db, store_id)
+        return with_store_stock(db, store_id, [product])[0]
+    response.headers["X-Catalog-Version"] = str(catalog.version)
     return product
 
 @app.put("/products/{product_id}")
 def update_product(product_id: int, name: Optional[str] = None, cost_price: Optional[float] = None,
                   base_price: Optional[float] = None, stock_quantity: Optional[int] = None,
-                  description: Optional[str] = None, db: Session = Depends(get_db)):
+                  description: Optional[str] = None, lead_time_days: Optional[int] = Query(None, ge=0, le=365),
+                  db: Session = Depends(get_db)):
     """Update a product."""
     product = db.query(Product).filter(Product.id == product_id).first()
     if product is None:
@@ -121,12 +822,14 @@ def update_product(product_id: int, name: Optional[str] = None, cost_price: Opti
         product.cost_price = cost_price
     if base_price is not None:
         product.base_price = base_price
-        # Also update current price if base price changes
-        product.current_price = calculate_dynamic_price(db, product)
+        # Also update current prices if base price changes
+        reprice_product(db, product)
     if stock_quantity is not None:
         product.stock_quantity = stock_quantity
     if description:
         product.description = description
+    if lead_time_days is not None:
+        product.lead_time_days = lead_time_days
     
     db.commit()
     db.refresh(product)
@@ -139,6 +842,7 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    db.query(StoreProduct).filter(StoreProduct.product_id == product_id).delete(synchronize_session=False)
     db.delete(product)
     db.commit()
     return {"message": "Product deleted successfully"}
@@ -196,12 +900,81 @@ def remove_product_from_group(group_id: int, product_id: int, db: Session = Depe
     
     return {"message": f"Product {product.name} removed from group {group.name}"}
 
+# Store endpoints
+@app.post("/stores/")
+def create_store(name: str, timezone: str = "UTC", db: Session = Depends(get_db)):
+    """Create a store, carrying every product with no stock at its base price."""
+    store = Store(name=name, timezone=parse_timezone(timezone))
+    db.add(store)
+    db.flush()
+    db.execute(insert(StoreProduct).from_select(
+        ["store_id", "product_id", "stock_quantity", "current_price"],
+        select(literal(store.id), Product.id, literal(0), Product.base_price)
+    ))
+    price_history.snapshot(db, store_id=store.id)
+    reprice_store(db, store.id)
+    db.commit()
+    db.refresh(store)
+    notify_pricing_schedule()
+    return store
+
+@app.get("/stores/")
+def read_stores(db: Session = Depends(get_db)):
+    """Get all stores."""
+    return db.query(Store).order_by(Store.id).all()
+
+@app.put("/stores/{store_id}")
+async def update_store(store_id: int, name: Optional[str] = None, timezone: Optional[str] = None,
+                       db: Session = Depends(get_db)):
+    """Rename a store or change its timezone."""
+    store = get_store(db, store_id)
+    if name:
+        store.name = name
+    if timezone is not None and timezone != store.timezone:
+        store.timezone = parse_timezone(timezone)
+        db.flush()
+        # Time-based rules now fall at different instants
+        outbox.enqueue_event(db, "prices", {
+            "event": "price_update",
+            "store_id": store_id,
+            "products": reprice_store(db, store_id, only_changed=True)
+        })
+    db.commit()
+    db.refresh(store)
+    notify_outbox()
+    notify_pricing_schedule()
+    return store
+
+@app.put("/stores/{store_id}/products/{product_id}")
+def update_store_stock(store_id: int, product_id: int, stock_quantity: int, db: Session = Depends(get_db)):
+    """Set a product's stock at one store."""
+    get_store(db, store_id)
+    if store_id == DEFAULT_STORE_ID:
+        row = db.query(Product).filter(Product.id == product_id).first()
+    else:
+        row = db.query(StoreProduct).filter(StoreProduct.store_id == store_id,
+                                            StoreProduct.product_id == product_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    row.stock_quantity = stock_quantity
+    db.commit()
+    return {
+        "store_id": store_id,
+        "product_id": product_id,
+        "stock_quantity": row.stock_quantity,
+        "current_price": row.current_price
+    }
+
 # Sale endpoints
 @app.post("/sales/")
-async def create_sale(customer_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def create_sale(customer_id: Optional[int] = None, store_id: int = DEFAULT_STORE_ID,
+                      db: Session = Depends(get_db)):
     """Create a new sale."""
+    get_store(db, store_id)
     new_sale = Sale(
         customer_id=customer_id,
+        store_id=store_id,
         total_amount=0.0  # Will be updated when items are added
     )
     db.add(new_sale)
@@ -211,6 +984,7 @@ async def create_sale(customer_id: Optional[int] = None, db: Session = Depends(g
     return {
         "id": new_sale.id,
         "customer_id": new_sale.customer_id,
+        "store_id": new_sale.store_id,
         "total_amount": new_sale.total_amount,
         "timestamp": new_sale.timestamp,
         "items": []  # Always include "items"
@@ -218,63 +992,105 @@ async def create_sale(customer_id: Optional[int] = None, db: Session = Depends(g
 
 @app.post("/sales/{sale_id}/add-item")
 async def add_item_to_sale(sale_id: int, product_id: int, quantity: int, db: Session = Depends(get_db)):
-    """Add an item to a sale."""
-    sale = db.query(Sale).filter(Sale.id == sale_id).first()
-    if sale is None:
+    """Add an item to a sale, taking stock from the sale's store."""
+    store_id = db.query(Sale.store_id).filter(Sale.id == sale_id).scalar()
+    if store_id is None:
         raise HTTPException(status_code=404, detail="Sale not found")
     
-    product = db.query(Product).filter(Product.id == product_id).first()
-    if product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    if product.stock_quantity < quantity:
-        raise HTTPException(status_code=400, detail="Not enough stock available")
-    
-    # Use dynamic pricing
-    price_at_sale = product.current_price
-    
-    # Create sale item
-    sale_item = SaleItem(
-        sale_id=sale_id,
-        product_id=product_id,
-        quantity=quantity,
-        price_at_sale=price_at_sale
-    )
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            product = take_stock(db, store_id, product_id, quantity)
+            
+            if product is None:
+                db.rollback()
+                if db.query(Product.id).filter(Product.id == product_id).first() is None:
+                    raise HTTPException(status_code=404, detail="Product not found")
+                raise HTTPException(status_code=400, detail="Not enough stock available")
+            
+            # Use dynamic pricing
+            price_at_sale = product.current_price
+            
+            # Update sale total atomically
+            sold_at = db.execute(
+                update(Sale)
+                .where(Sale.id == sale_id)
+                .values(total_amount=Sale.total_amount + price_at_sale * quantity, version=Sale.version + 1)
+                .returning(Sale.timestamp)
+                .execution_options(synchronize_session=False)
+            ).scalar_one()
+            
+            # Create sale item
+            sale_item = SaleItem(
+                sale_id=sale_id,
+                product_id=product_id,
+                quantity=quantity,
+                price_at_sale=price_at_sale
+            )
+            db.add(sale_item)
+            
+            # Keep the hourly rollup in the same transaction as the sale item
+            record_sale_item(db, product_id, sold_at, quantity, price_at_sale, product.cost_price)
+            if sold_at.date() < datetime.datetime.utcnow().date():
+                # Sale left open past midnight: cached summaries of its day are stale
+                change_counters.bump(db, CLOSED_SALES_COUNTER)
+            if store_id == DEFAULT_STORE_ID:
+                catalog.stage(db, product_id, stock_quantity=product.stock_quantity, updated_at=product.updated_at)
+            
+            # Stock update for subscribers, committed with the sale
+            outbox.enqueue_event(db, "stock", {
+                "store_id": store_id,
+                "product_id": product_id,
+                "product_name": product.name,
+                "new_stock": product.stock_quantity
+            })
+            db.commit()
+            break
+        except OperationalError as e:
+            db.rollback()
+            if "locked" not in str(e) or attempt == CHECKOUT_RETRIES - 1:
+                raise
+            await asyncio.sleep(0.01 * 2 ** attempt)
     
-    # Update sale total
-    sale.total_amount += price_at_sale * quantity
-    
-    # Update product stock
-    product.stock_quantity -= quantity
-    
-    db.add(sale_item)
-    db.commit()
     db.refresh(sale_item)
     
-    # Broadcast stock update
-    stock_update = json.dumps({
-        "product_id": product.id,
-        "product_name": product.name,
-        "new_stock": product.stock_quantity
-    })
-    await manager.broadcast(stock_update)
+    leaderboard.record(product_id, quantity, price_at_sale * quantity, sold_at)
+    notify_outbox()
     
     return sale_item
 
-@app.get("/sales/{sale_id}")
+@app.get("/sales/export")
+def export_sales(format: str = "ndjson", start_date: Optional[str] = None, end_date: Optional[str] = None,
+                 batch_size: int = Query(1000, ge=1, le=10000)):
+    """Stream sales with their line items as NDJSON (one sale per line) or CSV (one item per row)."""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be one of: ndjson, csv")
+    
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1) if end_date else None
+    
+    batches = iter_sale_batches(start, end, batch_size)
+    if format == "csv":
+        return StreamingResponse(sale_batches_to_csv(batches), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=sales.csv"})
+    return StreamingResponse(sale_batches_to_ndjson(batches), media_type="application/x-ndjson")
+
+@app.get("/sales/{sale_id}", response_model=SaleDetailOut)
 def get_sale(sale_id: int, db: Session = Depends(get_db)):
     """Get details of a specific sale."""
-    sale = db.query(Sale).filter(Sale.id == sale_id).first()
+    # Load items and their products up front instead of one query per line
+    sale = db.query(Sale)\
+        .options(selectinload(Sale.items).joinedload(SaleItem.product))\
+        .filter(Sale.id == sale_id).first()
     if sale is None:
         raise HTTPException(status_code=404, detail="Sale not found")
     
-    # Get sale items
-    items = db.query(SaleItem).filter(SaleItem.sale_id == sale_id).all()
+    items = sale.items
     
     # Format response
     result = {
         "id": sale.id,
         "customer_id": sale.customer_id,
+        "store_id": sale.store_id,
         "total_amount": sale.total_amount,
         "timestamp": sale.timestamp,
         "items": [
@@ -291,12 +1107,15 @@ def get_sale(sale_id: int, db: Session = Depends(get_db)):
     
     return result
 
-@app.get("/sales/")
+@app.get("/sales/", response_model=List[SaleOut])
 def get_sales(start_date: Optional[str] = None, end_date: Optional[str] = None, 
-              skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all sales, optionally filtered by date range."""
+              skip: int = 0, limit: int = 100, store_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Get all sales, optionally filtered by date range and store."""
     query = db.query(Sale)
     
+    if store_id is not None:
+        query = query.filter(Sale.store_id == store_id)
+    
     if start_date:
         start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
         query = query.filter(Sale.timestamp >= start)
@@ -341,20 +1160,30 @@ def create_pricing_rule(product_id: int, rule_type: str, condition: str,
     db.commit()
     db.refresh(rule)
     
-    # Update product's current price
-    product.current_price = calculate_dynamic_price(db, product)
+    # Update product's current price at every store
+    reprice_product(db, product)
     db.commit()
+    notify_pricing_schedule()
     
     return rule
 
 @app.get("/pricing-rules/")
-def get_pricing_rules(product_id: Optional[int] = None, db: Session = Depends(get_db)):
+def get_pricing_rules(request: Request, response: Response, product_id: Optional[int] = None,
+                      db: Session = Depends(get_db)):
     """Get all pricing rules, optionally filtered by product."""
     query = db.query(PricingRule)
     
     if product_id:
         query = query.filter(PricingRule.product_id == product_id)
     
+    # Row count plus latest change identifies the rule set without loading it,
+    # and is the same on every worker
+    count, latest = query.with_entities(func.count(PricingRule.id), func.max(PricingRule.updated_at)).one()
+    etag = f'W/"rules-{product_id or "all"}-{count}-{latest.timestamp() if latest else 0}"'
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    
     rules = query.all()
     return rules
 
@@ -369,56 +1198,136 @@ def delete_pricing_rule(rule_id: int, db: Session = Depends(get_db)):
     db.delete(rule)
     db.commit()
     
-    # Update product's current price
+    # Update product's current price at every store
     product = db.query(Product).filter(Product.id == product_id).first()
-    product.current_price = calculate_dynamic_price(db, product)
+    reprice_product(db, product)
     db.commit()
+    notify_pricing_schedule()
     
     return {"message": "Pricing rule deleted successfully"}
 
+@app.post("/pricing-rules/simulate")
+def simulate_pricing_rules(request: RuleSimulationRequest, db: Session = Depends(get_db)):
+    """Project the revenue and profit of candidate rule sets over past store conditions.
+    
+    Each rule set is replayed hour by hour over the date range (default: the
+    past year) against the store's recorded status and the sales history, with
+    the demand model estimating how quantities respond to the new prices. The
+    currently active rules are replayed as the baseline to compare against.
+    """
+    get_store(db, request.store_id)
+    end = datetime.datetime.combine(request.end_date + datetime.timedelta(days=1) if request.end_date
+                                    else datetime.date.today(), datetime.time())
+    start = datetime.datetime.combine(request.start_date, datetime.time()) if request.start_date \
+        else end - datetime.timedelta(days=365)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date")
+    
+    rule_ids = {rule_id for rule_set in request.rule_sets for rule_id in rule_set.rule_ids}
+    stored = {rule.id: rule for rule in db.query(PricingRule).filter(PricingRule.id.in_(rule_ids))}
+    missing = rule_ids - set(stored)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Pricing rules not found: {sorted(missing)}")
+    product_ids = {rule.product_id for rule_set in request.rule_sets for rule in rule_set.rules}
+    if db.query(Product.id).filter(Product.id.in_(product_ids)).count() < len(product_ids):
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    def parse_condition(condition):
+        if isinstance(condition, dict):
+            return condition
+        try:
+            return json.loads(condition)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Condition must be a valid JSON string")
+    
+    rule_sets = []
+    for rule_set in request.rule_sets:
+        rules = [(r.product_id, r.rule_type, parse_condition(r.condition), r.discount_percentage) for r in rule_set.rules]
+        for rule_id in rule_set.rule_ids:
+            rule = stored[rule_id]
+            # Active rules are already in unless replaced
+            if rule.is_active and not rule_set.replace_active:
+                continue
+            rules.append((rule.product_id, rule.rule_type, parse_condition(rule.condition), rule.discount_percentage))
+        rule_sets.append({"name": rule_set.name, "rules": rules, "replace_active": rule_set.replace_active})
+    
+    from rule_simulation import simulate_rule_sets  # Needs pandas and NumPy, which startup doesn't load
+    with MODEL_SECONDS.time(operation="simulate_rules"):
+        return simulate_rule_sets(db, rule_sets, request.store_id, store_timezone(db, request.store_id), start, end,
+                                  get_prediction_model() if model_trained else None)
+
 # Store status endpoints
 @app.post("/store-status/")
 async def update_store_status(vacancy_rate: Optional[float] = None, 
-                        line_length: Optional[int] = None, db: Session = Depends(get_db)):
-    """Update store status (vacancy rate and line length)."""
-    status = StoreStatus(
-        vacancy_rate=vacancy_rate if vacancy_rate is not None else 0.0,
-        line_length=line_length if line_length is not None else 0
+                        line_length: Optional[int] = None, store_id: int = DEFAULT_STORE_ID,
+                        db: Session = Depends(get_db)):
+    """Update a store's status (vacancy rate and line length).
+    
+    Only products whose line_length or vacancy_rate rules change state are
+    repriced; the status, new prices and price update event commit together.
+    For frequent sensor readings use /store-status/batch or /ws/store-status.
+    """
+    get_store(db, store_id)
+    status = apply_store_status(
+        db, store_id,
+        vacancy_rate if vacancy_rate is not None else 0.0,
+        line_length if line_length is not None else 0
     )
-    
-    db.add(status)
     db.commit()
     db.refresh(status)
-    
-    # Update all products' prices based on new store status
-    products = db.query(Product).all()
-    for product in products:
-        product.current_price = calculate_dynamic_price(db, product)
-    
-    db.commit()
-    
-    # Broadcast price updates
-    price_updates = json.dumps({
-        "event": "price_update",
-        "products": [
-            {
-                "id": p.id,
-                "name": p.name,
-                "current_price": p.current_price
-            }
-            for p in products
-        ]
-    })
-    await manager.broadcast(price_updates)
+    notify_outbox()
     
     return status
 
+@app.post("/store-status/batch", status_code=202)
+def submit_store_status_batch(readings: List[StatusReading], db: Session = Depends(get_db)):
+    """Queue sensor readings; each store's latest values are applied at the end of the debounce window."""
+    known = {row.id for row in db.query(Store.id).filter(Store.id.in_({r.store_id for r in readings}))}
+    unknown = sorted({r.store_id for r in readings} - known)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown store ids: {unknown}")
+    for reading in readings:
+        status_readings.submit(reading.store_id, reading.vacancy_rate, reading.line_length, reading.timestamp)
+    return {"accepted": len(readings)}
+
+@app.websocket("/ws/store-status")
+async def store_status_stream(websocket: WebSocket, store_id: int = DEFAULT_STORE_ID):
+    # Sensors stream JSON readings, one object or an array per message:
+    # {"vacancy_rate": 42.0, "line_length": 3, "timestamp": "...", "store_id": 2}
+    # store_id defaults to the one in the query string
+    db = SessionLocal()
+    try:
+        known = {row.id for row in db.query(Store.id)}
+    finally:
+        db.close()
+    if store_id not in known:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                readings = [StatusReading(**{"store_id": store_id, **item})
+                            for item in (message if isinstance(message, list) else [message])]
+            except (TypeError, ValueError) as e:
+                await websocket.send_json({"error": str(e)})
+                continue
+            unknown = sorted({r.store_id for r in readings} - known)
+            if unknown:
+                await websocket.send_json({"error": f"Unknown store ids: {unknown}"})
+                continue
+            for reading in readings:
+                status_readings.submit(reading.store_id, reading.vacancy_rate, reading.line_length, reading.timestamp)
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/store-status/latest")
-def get_latest_store_status(db: Session = Depends(get_db)):
-    """Get the latest store status."""
-    status = db.query(StoreStatus).order_by(StoreStatus.timestamp.desc()).first()
+def get_latest_store_status(store_id: int = DEFAULT_STORE_ID, db: Session = Depends(get_db)):
+    """Get the latest status of a store."""
+    status = latest_store_status(db, store_id)
     if status is None:
-        return {"vacancy_rate": 0.0, "line_length": 0, "timestamp": datetime.datetime.utcnow()}
+        return {"store_id": store_id, "vacancy_rate": 0.0, "line_length": 0, "timestamp": datetime.datetime.utcnow()}
     return status
 
 # Prediction endpoints
@@ -427,30 +1336,20 @@ def train_prediction_model(db: Session = Depends(get_db)):
     """Train the sales prediction model using historical data."""
     global model_trained
     
-    # Get all sales data
-    sales_data = []
-    sale_items = db.query(SaleItem).join(Sale).all()
+    # Get hourly sales history from the rollup
+    df = load_sales_history(db)
     
-    for item in sale_items:
-        sales_data.append({
-            'date': item.sale.timestamp,
-            'product_id': item.product_id,
-            'quantity': item.quantity,
-            'price': item.price_at_sale
-        })
-    
-    if not sales_data:
+    if df.empty:
         raise HTTPException(status_code=400, detail="Not enough sales data to train model")
     
-    # Convert to DataFrame
-    df = pd.DataFrame(sales_data)
-    
     # Train model
-    score = prediction_model.train(df)
+    with MODEL_SECONDS.time(operation="train"):
+        score = get_prediction_model().train(df)
     model_trained = True
     
     return {"message": "Model trained successfully", "score": score}
 
+@app.get("/prediction/forecast/{product_id}")
 def forecast_product_sales(product_id: int, days: int = 7, db: Session = Depends(get_db)):
     """Forecast sales for a specific product."""
     global model_trained
@@ -462,42 +1361,36 @@ def forecast_product_sales(product_id: int, days: int = 7, db: Session = Depends
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get historical sales data
-    sales_data = []
-    sale_items = db.query(SaleItem).join(Sale).filter(SaleItem.product_id == product_id).all()
+    # Get hourly sales history from the rollup
+    df = load_sales_history(db, product_id)
     
-    for item in sale_items:
-        sales_data.append({
-            'date': item.sale.timestamp,
-            'product_id': item.product_id,
-            'quantity': item.quantity,
-            'price': item.price_at_sale
-        })
-    
-    if not sales_data:
+    if df.empty:
         raise HTTPException(status_code=400, detail="Not enough sales data for this product")
     
-    # Convert to DataFrame
-    df = pd.DataFrame(sales_data)
-    
     # Make prediction
-    forecast = prediction_model.predict_future_sales(
-        product_id=product_id,
-        days_ahead=days,
-        base_price=product.current_price,
-        historical_data=df
-    )
+    with MODEL_SECONDS.time(operation="forecast"):
+        forecast = get_prediction_model().predict_future_sales(
+            product_id=product_id,
+            days_ahead=days,
+            base_price=product.current_price,
+            historical_data=df
+        )
     
     return forecast.to_dict(orient='records')
 
 @app.get("/prediction/optimal-price/{product_id}")
 def get_optimal_price(product_id: int, min_price: Optional[float] = None, 
-                     max_price: Optional[float] = None, db: Session = Depends(get_db)):
-    """Find the optimal price for a product to maximize profit."""
+                     max_price: Optional[float] = None, engine: str = "auto", db: Session = Depends(get_db)):
+    """Find the optimal price for a product to maximize profit.
+    
+    By default the product's elasticity model answers in closed form, and the
+    RandomForest only when that model isn't confident; `engine` can force
+    either ("elasticity" or "forest"). The response names the engine used.
+    """
     global model_trained
     
-    if not model_trained:
-        raise HTTPException(status_code=400, detail="Model needs to be trained first")
+    if engine not in ("auto", "elasticity", "forest"):
+        raise HTTPException(status_code=400, detail="engine must be one of auto, elasticity, forest")
     
     product = db.query(Product).filter(Product.id == product_id).first()
     if product is None:
@@ -510,39 +1403,56 @@ def get_optimal_price(product_id: int, min_price: Optional[float] = None,
     if max_price is None:
         max_price = product.base_price * 1.5  # Up to 50% above base price
     
-    # Get historical sales data
-    sales_data = []
-    sale_items = db.query(SaleItem).join(Sale).filter(SaleItem.product_id == product_id).all()
+    result = {
+        "product_id": product_id,
+        "product_name": product.name,
+        "cost_price": product.cost_price,
+        "current_price": product.current_price
+    }
     
-    for item in sale_items:
-        sales_data.append({
-            'date': item.sale.timestamp,
-            'product_id': item.product_id,
-            'quantity': item.quantity,
-            'price': item.price_at_sale
-        })
+    if engine != "forest":
+        with MODEL_SECONDS.time(operation="elasticity"):
+            demand = elasticity.fit(db, product_id)
+            problem = demand.confidence_problem()
+            if problem is None:
+                optimal_price, predicted_profit = demand.optimal_price(product.cost_price, min_price, max_price)
+        if problem is None:
+            return {
+                **result,
+                "optimal_price": round(optimal_price, 2),
+                "predicted_profit": predicted_profit,
+                "engine": "elasticity",
+                "elasticity": demand.elasticity,
+                "elasticity_std_error": demand.std_error,
+                "observations": demand.observations
+            }
+        if engine == "elasticity":
+            raise HTTPException(status_code=400, detail=problem)
+        result["fallback_reason"] = problem
     
-    if not sales_data:
-        raise HTTPException(status_code=400, detail="Not enough sales data for this product")
+    if not model_trained:
+        raise HTTPException(status_code=400, detail="Model needs to be trained first")
     
-    # Convert to DataFrame
-    df = pd.DataFrame(sales_data)
+    # Get hourly sales history from the rollup
+    df = load_sales_history(db, product_id)
+    
+    if df.empty:
+        raise HTTPException(status_code=400, detail="Not enough sales data for this product")
     
     # Find optimal price
-    optimal_price, predicted_profit = prediction_model.optimize_price(
-        product_id=product_id,
-        historical_data=df,
-        price_range=(min_price, max_price),
-        cost_price=product.cost_price
-    )
+    with MODEL_SECONDS.time(operation="optimize_price"):
+        optimal_price, predicted_profit = get_prediction_model().optimize_price(
+            product_id=product_id,
+            historical_data=df,
+            price_range=(min_price, max_price),
+            cost_price=product.cost_price
+        )
     
     return {
-        "product_id": product_id,
-        "product_name": product.name,
-        "cost_price": product.cost_price,
-        "current_price": product.current_price,
+        **result,
         "optimal_price": optimal_price,
-        "predicted_profit": predicted_profit
+        "predicted_profit": predicted_profit,
+        "engine": "forest"
     }
 
 # Profit group pricing endpoints
@@ -609,10 +1519,10 @@ def adjust_profit_group_prices(group_id: int, db: Session = Depends(get_db)):
     
     price_increase_per_product = profit_shortfall / num_products
     
-    # Update prices
-    for product in group.products:
-        product.current_price += price_increase_per_product
-        db.commit()
+    # Update prices in one transaction
+    write_current_prices(db, DEFAULT_STORE_ID,
+                         [(product, product.current_price + price_increase_per_product) for product in group.products])
+    db.commit()
     
     return {
         "message": "Adjusted prices to meet profit requirement",
@@ -628,11 +1538,90 @@ def adjust_profit_group_prices(group_id: int, db: Session = Depends(get_db)):
         ]
     }
 
+@app.post("/profit-groups/{group_id}/optimize-prices")
+def optimize_profit_group_prices(group_id: int, days: int = Query(7, ge=1, le=60),
+                                 price_points: int = Query(41, ge=2, le=201), max_markup: float = Query(1.5, gt=0),
+                                 apply: bool = True, db: Session = Depends(get_db)):
+    """Choose prices for a whole profit group that maximize expected profit.
+    
+    Candidate prices run from each product's cost floor (5% over cost) to
+    max_markup times its base price. Demand at every candidate over the next
+    `days` days is forecast in one batch, hour by hour weighted by how often
+    each product sold in that hour over the past weeks (products without
+    recent sales expect none), and the prices are chosen together
+    so the group's unit margins meet its min_profit_price. With apply, the
+    prices are set at the default store in one transaction.
+    """
+    if not model_trained:
+        raise HTTPException(status_code=400, detail="Model needs to be trained first")
+    
+    group = db.query(ProfitGroup).options(selectinload(ProfitGroup.products))\
+        .filter(ProfitGroup.id == group_id).first()
+    if group is None:
+        raise HTTPException(status_code=404, detail="Profit group not found")
+    products = sorted(group.products, key=lambda p: p.id)
+    if not products:
+        return {"message": "No products in this group"}
+    
+    from replenishment import sales_history  # numpy, loaded with the prediction stack
+    
+    candidates = [(p.id, p.cost_price, p.cost_price * 1.05, p.base_price * max_markup) for p in products]
+    start = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time())
+    _, hour_weights = sales_history(db, [p.id for p in products], start)
+    with MODEL_SECONDS.time(operation="optimize_group"):
+        result = get_prediction_model().optimize_group_prices(
+            candidates, hour_weights, group.min_profit_price, start, days_ahead=days, price_points=price_points
+        )
+    
+    updates = []
+    for product, price, quantity in zip(products, result["prices"], result["quantities"]):
+        updates.append({
+            "id": product.id,
+            "name": product.name,
+            "old_price": product.current_price,
+            "new_price": price,
+            "expected_quantity": quantity
+        })
+    if apply:
+        changed = [{"id": product.id, "name": product.name, "current_price": line["new_price"]}
+                   for product, line in zip(products, updates) if product.current_price != line["new_price"]]
+        write_current_prices(db, DEFAULT_STORE_ID,
+                             [(product, line["new_price"]) for product, line in zip(products, updates)])
+        if changed:
+            outbox.enqueue_event(db, "prices", {
+                "event": "price_update",
+                "store_id": DEFAULT_STORE_ID,
+                "products": changed
+            })
+        db.commit()
+        notify_outbox()
+    
+    return {
+        "group_id": group.id,
+        "min_profit_required": group.min_profit_price,
+        "unit_profit": result["unit_profit"],
+        "meets_requirement": result["meets_requirement"],
+        "expected_profit": result["expected_profit"],
+        "days": days,
+        "price_vectors_evaluated": result["evaluated"],
+        "applied": apply,
+        "products": updates
+    }
+
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, format: str = "json", since: Optional[int] = None,
+                             store_id: Optional[int] = None):
+    # format: json (default, one frame per event), json-batch or msgpack
+    # since: last event seq the client saw; missed events are replayed first
+    # store_id: only receive that store's stock and price events (default: all stores)
+    if not ws_protocol.is_supported(format):
+        await websocket.close(code=1003)
+        return
+    await manager.connect(websocket, format, store_id)
     try:
+        if since is not None:
+            await manager.replay(websocket, since)
         while True:
             data = await websocket.receive_text()
             # Process any client messages if needed
@@ -640,65 +1629,109 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.get("/events")
+def get_events(since: int = 0, limit: int = Query(500, ge=1, le=5000), db: Session = Depends(get_db)):
+    """Replay broadcast events after a sequence id, for clients that missed them."""
+    events = [outbox.to_message(row) for row in outbox.events_since(db, since, limit)]
+    return {
+        "events": events,
+        "last_seq": events[-1]["seq"] if events else since
+    }
+
+# Monitoring endpoints
+@app.get("/metrics")
+def get_metrics():
+    """Request, SQL, repricing, model and WebSocket metrics in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/debug/profiles")
+def get_slow_request_profiles():
+    """Get the sampled stacks of recent slow requests (set POS_PROFILE_SLOW_MS to enable)."""
+    if slow_request_profiler is None:
+        raise HTTPException(status_code=404, detail="Slow request profiling is off; set POS_PROFILE_SLOW_MS")
+    return list(slow_request_profiler.recent)
+
+# Replenishment endpoints
+@app.post("/replenishment/plan")
+def plan_replenishment_now():
+    """Recompute the replenishment plan now instead of waiting for the schedule."""
+    return run_replenishment_plan()
+
+@app.get("/replenishment")
+def read_replenishment_plan(reorder_only: bool = False, skip: int = 0, limit: int = Query(100, ge=1, le=1000),
+                            db: Session = Depends(get_db)):
+    """Get the latest replenishment plan, soonest stockout first."""
+    query = db.query(ReplenishmentPlan, Product.name, Product.sku)\
+              .join(Product, Product.id == ReplenishmentPlan.product_id)
+    if reorder_only:
+        query = query.filter(ReplenishmentPlan.reorder_quantity > 0)
+    rows = query.order_by(ReplenishmentPlan.days_of_cover.is_(None), ReplenishmentPlan.days_of_cover,
+                          ReplenishmentPlan.product_id).offset(skip).limit(limit).all()
+    return [replenishment_record(plan, name, sku) for plan, name, sku in rows]
+
+@app.get("/products/{product_id}/replenishment")
+def read_product_replenishment(product_id: int, db: Session = Depends(get_db)):
+    """Get a product's stock forecast and reorder advice from the latest plan."""
+    row = db.query(ReplenishmentPlan, Product.name, Product.sku)\
+            .join(Product, Product.id == ReplenishmentPlan.product_id)\
+            .filter(ReplenishmentPlan.product_id == product_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product has not been planned yet")
+    return replenishment_record(*row)
+
 # Analytics endpoints
 @app.get("/analytics/sales-summary")
 def sales_summary(start_date: Optional[str] = None, end_date: Optional[str] = None, 
                  db: Session = Depends(get_db)):
     """Get summary of sales for a given period."""
-    query = db.query(
-        func.sum(Sale.total_amount).label("total_revenue"),
-        func.count(Sale.id).label("total_sales"),
-        func.avg(Sale.total_amount).label("average_sale_value")
-    )
-    
-    if start_date:
-        start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-        query = query.filter(Sale.timestamp >= start)
-    
-    if end_date:
-        end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-        end = end.replace(hour=23, minute=59, second=59)
-        query = query.filter(Sale.timestamp <= end)
-    
-    result = query.first()
-    
-    # Calculate profit
-    sale_items = db.query(SaleItem).join(Sale).join(Product)
-    
-    if start_date:
-        sale_items = sale_items.filter(Sale.timestamp >= start)
-    
-    if end_date:
-        sale_items = sale_items.filter(Sale.timestamp <= end)
-    
-    # Calculate profits
-    profits = []
-    for item in sale_items.all():
-        profit = (item.price_at_sale - item.product.cost_price) * item.quantity
-        profits.append(profit)
-    
-    total_profit = sum(profits) if profits else 0
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+    
+    # Days before today only change through sales left open past midnight, so
+    # that part of the range is cached until one gets an item, and only the
+    # open current day is aggregated live
+    today = datetime.datetime.utcnow().date()
+    closed_end = min(end, today - datetime.timedelta(days=1)) if end else today - datetime.timedelta(days=1)
+    
+    total_revenue, total_sales, total_profit = 0, 0, 0
+    
+    if start is None or start <= closed_end:
+        key = (start, closed_end, change_counters.value(db, CLOSED_SALES_COUNTER))
+        if key not in summary_cache:
+            if len(summary_cache) >= SUMMARY_CACHE_SIZE:
+                summary_cache.clear()
+            summary_cache[key] = aggregate_sales(db, start, closed_end)
+        revenue, count, profit = summary_cache[key]
+        total_revenue += revenue
+        total_sales += count
+        total_profit += profit
+    
+    if end is None or end >= today:
+        revenue, count, profit = aggregate_sales(db, max(start, today) if start else today, end)
+        total_revenue += revenue
+        total_sales += count
+        total_profit += profit
     
     return {
-        "total_revenue": result.total_revenue if result.total_revenue else 0,
+        "total_revenue": total_revenue,
         "total_profit": total_profit,
-        "profit_margin": (total_profit / result.total_revenue * 100) if result.total_revenue else 0,
-        "total_sales": result.total_sales,
-        "average_sale_value": result.average_sale_value if result.average_sale_value else 0
+        "profit_margin": (total_profit / total_revenue * 100) if total_revenue else 0,
+        "total_sales": total_sales,
+        "average_sale_value": (total_revenue / total_sales) if total_sales else 0
     }
 
 @app.get("/analytics/top-products")
 def top_products(limit: int = 10, db: Session = Depends(get_db)):
     """Get top selling products by quantity."""
-    # Join SaleItem with Product and group by product
+    # Join the hourly rollup with Product and group by product
     query = db.query(
         Product.id,
         Product.name,
-        func.sum(SaleItem.quantity).label("total_quantity"),
-        func.sum(SaleItem.price_at_sale * SaleItem.quantity).label("total_revenue")
-    ).join(SaleItem, SaleItem.product_id == Product.id)\
+        func.sum(SalesRollup.quantity).label("total_quantity"),
+        func.sum(SalesRollup.revenue).label("total_revenue")
+    ).join(SalesRollup, SalesRollup.product_id == Product.id)\
      .group_by(Product.id)\
-     .order_by(func.sum(SaleItem.quantity).desc())\
+     .order_by(func.sum(SalesRollup.quantity).desc())\
      .limit(limit)
     
     results = query.all()
@@ -713,9 +1746,493 @@ def top_products(limit: int = 10, db: Session = Depends(get_db)):
         for r in results
     ]
 
+@app.get("/analytics/series")
+def sales_series(bucket: str = "day", start_date: Optional[str] = None, end_date: Optional[str] = None,
+                 product_id: Optional[int] = None, group_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Get quantity, revenue and profit time series for charts, as parallel arrays."""
+    # SQL expressions (SQLite) for the label of each bucket
+    buckets = {
+        'hour': func.printf('%s %02d:00', SalesRollup.day, SalesRollup.hour),
+        'day': func.date(SalesRollup.day),
+        'week': func.date(SalesRollup.day, '-6 days', 'weekday 1')  # Monday of the week
+    }
+    if bucket not in buckets:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Must be one of: {', '.join(buckets)}")
+    
+    label = buckets[bucket].label("bucket")
+    query = db.query(
+        label,
+        func.sum(SalesRollup.quantity),
+        func.sum(SalesRollup.revenue),
+        func.sum(SalesRollup.revenue - SalesRollup.cost)
+    )
+    
+    if start_date:
+        query = query.filter(SalesRollup.day >= datetime.datetime.strptime(start_date, "%Y-%m-%d").date())
+    
+    if end_date:
+        query = query.filter(SalesRollup.day <= datetime.datetime.strptime(end_date, "%Y-%m-%d").date())
+    
+    if product_id is not None:
+        query = query.filter(SalesRollup.product_id == product_id)
+    
+    if group_id is not None:
+        query = query.join(
+            product_group_association,
+            product_group_association.c.product_id == SalesRollup.product_id
+        ).filter(product_group_association.c.group_id == group_id)
+    
+    rows = query.group_by(label).order_by(label).all()
+    
+    return {
+        "bucket": bucket,
+        "timestamps": [r[0] for r in rows],
+        "quantity": [r[1] for r in rows],
+        "revenue": [round(r[2], 2) for r in rows],
+        "profit": [round(r[3], 2) for r in rows]
+    }
+
+@app.get("/analytics/top-products/live")
+def top_products_live():
+    """Get the top products by quantity and revenue over the rolling window, from memory."""
+    return leaderboard_payload()
+
+@app.post("/analytics/rebuild-rollup")
+def rebuild_rollup(db: Session = Depends(get_db)):
+    """Rebuild the hourly sales rollup from raw sales (for backfills)."""
+    rows = rebuild_sales_rollup(db)
+    change_counters.bump(db, CLOSED_SALES_COUNTER)
+    db.commit()
+    summary_cache.clear()
+    leaderboard.reconcile(db)
+    return {"message": "Sales rollup rebuilt", "rows": rows}
+
 # Utility functions
-def calculate_dynamic_price(db, product):
-    """Calculate dynamic price based on pricing rules."""
+def iter_sale_batches(start=None, end=None, batch_size=1000):
+    """Yield lists of (sale, items) in (timestamp, id) order using keyset pagination.
+    
+    Each batch is a seek on the sales timestamp index rather than an OFFSET scan,
+    and only one batch is held in memory at a time. Uses its own session because
+    the generator outlives the request's dependencies while streaming.
+    """
+    db = SessionLocal()
+    try:
+        last_key = None
+        while True:
+            query = db.query(Sale)
+            if start:
+                query = query.filter(Sale.timestamp >= start)
+            if end:
+                query = query.filter(Sale.timestamp < end)
+            if last_key:
+                query = query.filter(tuple_(Sale.timestamp, Sale.id) > tuple_(*last_key))
+            
+            sales = query.order_by(Sale.timestamp, Sale.id).limit(batch_size).all()
+            if not sales:
+                break
+            
+            # Fetch all line items of the batch in one query
+            items_by_sale = {sale.id: [] for sale in sales}
+            items = db.query(SaleItem.sale_id, SaleItem.product_id, Product.name, SaleItem.quantity, SaleItem.price_at_sale)\
+                .join(Product, SaleItem.product_id == Product.id)\
+                .filter(SaleItem.sale_id.in_(items_by_sale))\
+                .order_by(SaleItem.id)
+            for item in items:
+                items_by_sale[item.sale_id].append(item)
+            
+            yield [(sale, items_by_sale[sale.id]) for sale in sales]
+            
+            last_key = (sales[-1].timestamp, sales[-1].id)
+            db.expunge_all()
+    finally:
+        db.close()
+
+def sale_batches_to_ndjson(batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps({
+                "id": sale.id,
+                "customer_id": sale.customer_id,
+                "store_id": sale.store_id,
+                "total_amount": sale.total_amount,
+                "timestamp": sale.timestamp.isoformat() if sale.timestamp else None,
+                "items": [
+                    {
+                        "product_id": item.product_id,
+                        "product_name": item.name,
+                        "quantity": item.quantity,
+                        "price": item.price_at_sale,
+                        "subtotal": item.quantity * item.price_at_sale
+                    }
+                    for item in items
+                ]
+            }) + "\n"
+            for sale, items in batch
+        )
+
+def sale_batches_to_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["sale_id", "timestamp", "customer_id", "total_amount",
+                     "product_id", "product_name", "quantity", "price", "store_id"])
+    for batch in batches:
+        for sale, items in batch:
+            sale_columns = [sale.id, sale.timestamp.isoformat() if sale.timestamp else "", sale.customer_id, sale.total_amount]
+            if not items:
+                writer.writerow(sale_columns + ["", "", "", "", sale.store_id])
+            for item in items:
+                writer.writerow(sale_columns + [item.product_id, item.name, item.quantity, item.price_at_sale, sale.store_id])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def leaderboard_payload():
+    by_quantity, by_revenue = leaderboard.top()
+    
+    def entries(ranking, field):
+        return [
+            {
+                "product_id": product_id,
+                "product_name": product.name if (product := catalog.get(product_id)) else None,
+                field: round(total, 2)
+            }
+            for product_id, total in ranking
+        ]
+    
+    return {
+        "window_hours": leaderboard.window_hours,
+        "by_quantity": entries(by_quantity, "quantity"),
+        "by_revenue": entries(by_revenue, "revenue")
+    }
+
+def etag_matches(request, etag):
+    """Check a request's If-None-Match header against an ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag})
+
+def aggregate_sales(db, start=None, end=None):
+    """Get revenue, sale count and profit for an inclusive range of days in one SQL query."""
+    profit = db.query(func.coalesce(func.sum(SalesRollup.revenue - SalesRollup.cost), 0.0))
+    query = db.query(
+        func.coalesce(func.sum(Sale.total_amount), 0.0),
+        func.count(Sale.id)
+    )
+    
+    if start:
+        profit = profit.filter(SalesRollup.day >= start)
+        query = query.filter(Sale.timestamp >= datetime.datetime.combine(start, datetime.time.min))
+    
+    if end:
+        profit = profit.filter(SalesRollup.day <= end)
+        query = query.filter(Sale.timestamp < datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min))
+    
+    revenue, count, total_profit = query.add_columns(profit.scalar_subquery()).one()
+    return revenue, count, total_profit
+
+def load_sales_history(db, product_id=None):
+    """Load hourly sales history from the rollup as a DataFrame for the prediction model."""
+    import pandas as pd  # Loaded with the prediction stack, not at startup
+    
+    query = db.query(
+        SalesRollup.day,
+        SalesRollup.hour,
+        SalesRollup.product_id,
+        SalesRollup.quantity,
+        SalesRollup.revenue
+    ).filter(SalesRollup.quantity > 0)
+    
+    if product_id is not None:
+        query = query.filter(SalesRollup.product_id == product_id)
+    
+    df = pd.DataFrame(query.all(), columns=['day', 'hour', 'product_id', 'quantity', 'revenue'])
+    if df.empty:
+        return df
+    
+    df['date'] = pd.to_datetime(df['day']) + pd.to_timedelta(df['hour'], unit='h')
+    
+    # Price in effect at the start of each hour, from the price history; hours
+    # from before the history began fall back to the average price sold at
+    changes = price_history.price_changes(
+        db, [product_id] if product_id is not None else None, DEFAULT_STORE_ID,
+        start=df['date'].min(), end=df['date'].max()
+    )
+    df['epoch'] = (df['date'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    if changes:
+        history = pd.DataFrame(changes, columns=['product_id', 'epoch', 'price_cents']).sort_values('epoch')
+        df = pd.merge_asof(df.sort_values('epoch'), history, on='epoch', by='product_id', direction='backward')
+        df['price'] = (df['price_cents'] / 100).fillna(df['revenue'] / df['quantity'])
+    else:
+        df['price'] = df['revenue'] / df['quantity']
+    return df.sort_values(['product_id', 'date'])[['date', 'product_id', 'quantity', 'price']].reset_index(drop=True)
+
+def replenishment_record(plan, name, sku):
+    return {
+        "product_id": plan.product_id,
+        "name": name,
+        "sku": sku,
+        "stock_quantity": plan.stock_quantity,
+        "lead_time_days": plan.lead_time_days,
+        "daily_demand": round(plan.daily_demand, 2),
+        "reorder_point": round(plan.reorder_point, 1),
+        "safety_stock": round(plan.safety_stock, 1),
+        "reorder_quantity": plan.reorder_quantity,
+        "days_of_cover": None if plan.days_of_cover is None else round(plan.days_of_cover, 1),
+        "stockout_date": plan.stockout_date,
+        "reorder_by": plan.reorder_by,
+        "forecast_source": plan.forecast_source,
+        "planned_at": plan.planned_at
+    }
+
+def take_stock(db, store_id, product_id, quantity):
+    """Decrement a product's stock at one store if enough is left.
+    
+    The check and decrement are one conditional UPDATE so concurrent checkouts
+    can never oversell, and the price is read in the same statement.
+    
+    Returns:
+        Row of name, current_price, cost_price, stock_quantity and updated_at,
+        or None if the product is missing or short of stock
+    """
+    if store_id == DEFAULT_STORE_ID:
+        return db.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.stock_quantity >= quantity)
+            .values(stock_quantity=Product.stock_quantity - quantity, version=Product.version + 1)
+            .returning(Product.name, Product.current_price, Product.cost_price,
+                       Product.stock_quantity, Product.updated_at)
+            .execution_options(synchronize_session=False)
+        ).first()
+    
+    def catalog_value(column):
+        return select(column).where(Product.id == product_id).scalar_subquery().label(column.key)
+    
+    return db.execute(
+        update(StoreProduct)
+        .where(StoreProduct.store_id == store_id, StoreProduct.product_id == product_id,
+               StoreProduct.stock_quantity >= quantity)
+        .values(stock_quantity=StoreProduct.stock_quantity - quantity, version=StoreProduct.version + 1)
+        .returning(catalog_value(Product.name), StoreProduct.current_price, catalog_value(Product.cost_price),
+                   StoreProduct.stock_quantity, StoreProduct.updated_at)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+def get_store(db, store_id):
+    store = db.get(Store, store_id)
+    if store is None:
+        raise HTTPException(status_code=404, detail="Store not found")
+    return store
+
+def store_timezone(db, store_id=DEFAULT_STORE_ID):
+    store = db.get(Store, store_id)
+    return ZoneInfo(store.timezone if store else "UTC")
+
+def parse_timezone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone '{name}'")
+    return name
+
+def latest_store_status(db, store_id=DEFAULT_STORE_ID):
+    return db.query(StoreStatus)\
+        .filter(StoreStatus.store_id == store_id)\
+        .order_by(StoreStatus.timestamp.desc()).first()
+
+def with_store_stock(db, store_id, records):
+    """Swap one store's stock and current prices into catalog records."""
+    rows = db.query(StoreProduct.product_id, StoreProduct.stock_quantity, StoreProduct.current_price)\
+        .filter(StoreProduct.store_id == store_id,
+                StoreProduct.product_id.in_([r.id for r in records])).all()
+    by_product = {row.product_id: row for row in rows}
+    result = []
+    for record in records:
+        row = by_product.get(record.id)
+        result.append(record._replace(
+            stock_quantity=row.stock_quantity if row else 0,
+            current_price=row.current_price if row else record.base_price
+        ))
+    return result
+
+def reprice_store(db, store_id, product_ids=None, now=None, only_changed=False):
+    """Recalculate current prices at one store.
+    
+    Args:
+        product_ids: Only reprice these products (default: all)
+        now: Instant to evaluate time-based rules at (default: the current time)
+        only_changed: Only return products whose price changed
+    
+    Returns:
+        List of {"id", "name", "current_price"} for the price update event
+    """
+    start = time.perf_counter()
+    if store_id == DEFAULT_STORE_ID:
+        query = db.query(Product)
+        if product_ids is not None:
+            query = query.filter(Product.id.in_(product_ids))
+        rows = [(product, product) for product in query.all()]
+        prices = None
+    else:
+        query = db.query(StoreProduct)\
+            .options(joinedload(StoreProduct.product))\
+            .filter(StoreProduct.store_id == store_id)
+        if product_ids is not None:
+            query = query.filter(StoreProduct.product_id.in_(product_ids))
+        rows = [(row, row.product) for row in query.all()]
+        prices = store_group_prices(db, store_id, [product for _, product in rows])
+    
+    updates, writes = [], []
+    for row, product in rows:
+        price = calculate_dynamic_price(db, product, store_id, row.stock_quantity, prices, now)
+        if only_changed and price == row.current_price:
+            continue
+        writes.append((row, price))
+        if prices is not None:
+            prices[product.id] = price
+        updates.append({"id": product.id, "name": product.name, "current_price": price})
+    write_current_prices(db, store_id, writes)
+    REPRICE_SECONDS.observe(time.perf_counter() - start, kind="store")
+    REPRICED_PRODUCTS.inc(len(rows), kind="store")
+    return updates
+
+def reprice_imported(db, product_ids, new_product_ids=()):
+    """Reprice imported products at every store, staging a price update event per store.
+    
+    A product with no active pricing rules and no profit groups is priced at
+    its base price, so those are repriced from one query per store and written
+    with executemany. The rest go through reprice_store. New products get a
+    price history row even when their starting price stands.
+    
+    Returns:
+        Number of prices changed
+    """
+    priced_by_rules = {product_id for product_id, in db.query(PricingRule.product_id)
+                       .filter(PricingRule.is_active == True).distinct()}
+    priced_by_rules.update(product_id for product_id, in db.query(product_group_association.c.product_id).distinct())
+    simple = set(product_ids) - priced_by_rules
+    by_rules = sorted(set(product_ids) & priced_by_rules)
+    start = time.perf_counter()
+    now = datetime.datetime.utcnow()
+    epoch = price_history.to_epoch(now)
+    
+    total = evaluated = 0
+    for store_id, in db.query(Store.id).order_by(Store.id).all():
+        if store_id == DEFAULT_STORE_ID:
+            table = Product.__table__
+            rows = db.query(Product.id, Product.name, Product.base_price, Product.cost_price, Product.current_price)
+            target = table.c.id == bindparam("row_id")
+        else:
+            table = StoreProduct.__table__
+            rows = db.query(StoreProduct.product_id, Product.name, Product.base_price, Product.cost_price,
+                            StoreProduct.current_price)\
+                .join(Product, Product.id == StoreProduct.product_id)\
+                .filter(StoreProduct.store_id == store_id)
+            target = and_(table.c.store_id == store_id, table.c.product_id == bindparam("row_id"))
+        
+        changed, updates, history = [], [], []
+        for product_id, name, base_price, cost_price, current_price in rows:
+            if product_id not in simple:
+                continue
+            price = floor_price(base_price, cost_price)
+            evaluated += 1
+            if price != current_price:
+                changed.append({"id": product_id, "name": name, "current_price": price})
+                updates.append({"row_id": product_id, "row_price": price})
+            if price != current_price or product_id in new_product_ids:
+                history.append({"store_id": store_id, "product_id": product_id, "epoch": epoch,
+                                "price_cents": price_history.to_cents(price)})
+        if updates:
+            db.execute(update(table).where(target).values(
+                current_price=bindparam("row_price"), version=table.c.version + 1, updated_at=now
+            ), updates)
+        price_history.record(db.connection(), history)
+        
+        for offset in range(0, len(by_rules), 500):
+            changed += reprice_store(db, store_id, by_rules[offset:offset + 500], only_changed=True)
+        if changed:
+            outbox.enqueue_event(db, "prices", {
+                "event": "price_update",
+                "store_id": store_id,
+                "products": changed
+            })
+        total += len(changed)
+    # Products priced by rules are counted by reprice_store
+    REPRICE_SECONDS.observe(time.perf_counter() - start, kind="import")
+    REPRICED_PRODUCTS.inc(evaluated, kind="import")
+    return total
+
+def write_current_prices(db, store_id, writes):
+    """Set current prices at one store without the optimistic version check.
+    
+    Prices follow from rules, stock and the clock, so a reprice shouldn't fail
+    because a checkout bumped a row's version after it was read. The changed
+    prices go out as one UPDATE by primary key, and the loaded rows, the price
+    history and the catalog are brought up to date as the flush hooks would.
+    
+    Args:
+        writes: List of (Product or StoreProduct row, new price)
+    """
+    writes = [(row, price) for row, price in writes if price != row.current_price]
+    if not writes:
+        return
+    now = datetime.datetime.utcnow()
+    if store_id == DEFAULT_STORE_ID:
+        table = Product.__table__
+        target = table.c.id == bindparam("row_id")
+        product_ids = [row.id for row, _ in writes]
+    else:
+        table = StoreProduct.__table__
+        target = and_(table.c.store_id == store_id, table.c.product_id == bindparam("row_id"))
+        product_ids = [row.product_id for row, _ in writes]
+    db.execute(update(table).where(target).values(current_price=bindparam("row_price"), updated_at=now),
+               [{"row_id": product_id, "row_price": price} for product_id, (_, price) in zip(product_ids, writes)])
+    
+    epoch = price_history.to_epoch(now)
+    price_history.record(db.connection(), [
+        {"store_id": store_id, "product_id": product_id, "epoch": epoch, "price_cents": price_history.to_cents(price)}
+        for product_id, (_, price) in zip(product_ids, writes)
+    ])
+    for product_id, (row, price) in zip(product_ids, writes):
+        attributes.set_committed_value(row, "current_price", price)
+        attributes.set_committed_value(row, "updated_at", now)
+        if store_id == DEFAULT_STORE_ID:
+            catalog.stage(db, product_id, current_price=price, updated_at=now)
+
+def reprice_product(db, product):
+    """Recalculate a product's current price at every store."""
+    start = time.perf_counter()
+    write_current_prices(db, DEFAULT_STORE_ID, [(product, calculate_dynamic_price(db, product))])
+    rows = db.query(StoreProduct).filter(StoreProduct.product_id == product.id).all()
+    for row in rows:
+        prices = store_group_prices(db, row.store_id, [product])
+        price = calculate_dynamic_price(db, product, row.store_id, row.stock_quantity, prices)
+        write_current_prices(db, row.store_id, [(row, price)])
+    REPRICE_SECONDS.observe(time.perf_counter() - start, kind="product")
+    REPRICED_PRODUCTS.inc(1 + len(rows), kind="product")
+
+def store_group_prices(db, store_id, products):
+    """Get current prices at one store of every product sharing a profit group with `products`."""
+    group_product_ids = {p.id for product in products for group in product.profit_groups for p in group.products}
+    group_product_ids.update(product.id for product in products)
+    return dict(db.query(StoreProduct.product_id, StoreProduct.current_price)
+                .filter(StoreProduct.store_id == store_id, StoreProduct.product_id.in_(group_product_ids)).all())
+
+def calculate_dynamic_price(db, product, store_id=DEFAULT_STORE_ID, stock_quantity=None, prices=None, now=None):
+    """Calculate dynamic price based on pricing rules.
+    
+    For stores other than the default, `stock_quantity` is the store's stock
+    and `prices` maps product ids to the store's current prices, used for
+    profit group checks. Time-based rules are evaluated in the store's local
+    time at `now` (an aware datetime, default the current time).
+    """
+    if stock_quantity is None:
+        stock_quantity = product.stock_quantity
+    
     # Start with base price
     price = product.base_price
     total_discount_percentage = 0
@@ -726,10 +2243,10 @@ def calculate_dynamic_price(db, product):
         PricingRule.is_active == True
     ).all()
     
-    now = datetime.datetime.utcnow()
+    now = local_time(store_timezone(db, store_id), now)
     
-    # Get latest store status
-    store_status = db.query(StoreStatus).order_by(StoreStatus.timestamp.desc()).first()
+    # Get latest status of this store
+    store_status = latest_store_status(db, store_id)
     vacancy_rate = store_status.vacancy_rate if store_status else 0
     line_length = store_status.line_length if store_status else 0
     
@@ -737,33 +2254,20 @@ def calculate_dynamic_price(db, product):
     for rule in rules:
         condition = json.loads(rule.condition)
         
-        if rule.rule_type == 'time_of_day':
-            # Example condition: {"start_hour": 14, "end_hour": 17}
-            current_hour = now.hour
-            if 'start_hour' in condition and 'end_hour' in condition:
-                if condition['start_hour'] <= current_hour < condition['end_hour']:
-                    total_discount_percentage += rule.discount_percentage
-        
-        elif rule.rule_type == 'day_of_week':
-            # Example condition: {"days": [0, 6]} (0=Monday, 6=Sunday)
-            current_day = now.weekday()
-            if 'days' in condition and current_day in condition['days']:
+        if rule.rule_type in TIME_RULE_TYPES:
+            # time_of_day and day_of_week, in the store's local time
+            if rule_active(rule.rule_type, condition, now):
                 total_discount_percentage += rule.discount_percentage
         
         elif rule.rule_type == 'stock_level':
             # Example condition: {"min_stock": 10, "max_stock": 50}
             if ('min_stock' in condition and 'max_stock' in condition and 
-                condition['min_stock'] <= product.stock_quantity <= condition['max_stock']):
+                condition['min_stock'] <= stock_quantity <= condition['max_stock']):
                 total_discount_percentage += rule.discount_percentage
         
-        elif rule.rule_type == 'line_length':
-            # Example condition: {"min_length": 5}
-            if 'min_length' in condition and line_length >= condition['min_length']:
-                total_discount_percentage += rule.discount_percentage
-        
-        elif rule.rule_type == 'vacancy_rate':
-            # Example condition: {"min_rate": 50}
-            if 'min_rate' in condition and vacancy_rate >= condition['min_rate']:
+        elif rule.rule_type in STATUS_RULE_TYPES:
+            # line_length and vacancy_rate, from the store's latest status
+            if status_rule_active(rule.rule_type, condition, vacancy_rate, line_length):
                 total_discount_percentage += rule.discount_percentage
     
     # Apply total discount
@@ -772,22 +2276,32 @@ def calculate_dynamic_price(db, product):
     
     # Check profit group constraints
     for group in product.profit_groups:
-        group_price_check = check_profit_group_min_price(db, group)
+        group_price_check = check_profit_group_min_price(db, group, prices)
         if not group_price_check["meets_requirement"]:
             # This price would violate the group's minimum profit
             # We'll adjust this product's price to help meet the requirement
-            price = adjust_price_for_group(db, product, group, price)
+            price = adjust_price_for_group(db, product, group, price, prices)
     
+    return floor_price(price, product.cost_price)
+
+def floor_price(price, cost_price):
+    """Keep a price above cost and round it to cents."""
     # Ensure price doesn't go below cost
-    if price < product.cost_price * 1.05:  # minimum 5% markup
-        price = product.cost_price * 1.05
+    if price < cost_price * 1.05:  # minimum 5% markup
+        price = cost_price * 1.05
     
     return round(price, 2)
 
-def check_profit_group_min_price(db, group):
+def group_price(product, prices=None):
+    """Get a product's current price, from a store's `prices` map when given."""
+    if prices is None:
+        return product.current_price
+    return prices.get(product.id, product.base_price)
+
+def check_profit_group_min_price(db, group, prices=None):
     """Check if a group meets its minimum profit requirement."""
     total_cost = sum(product.cost_price for product in group.products)
-    total_revenue = sum(product.current_price for product in group.products)
+    total_revenue = sum(group_price(product, prices) for product in group.products)
     current_profit = total_revenue - total_cost
     
     return {
@@ -796,13 +2310,13 @@ def check_profit_group_min_price(db, group):
         "meets_requirement": current_profit >= group.min_profit_price
     }
 
-def adjust_price_for_group(db, product, group, suggested_price):
+def adjust_price_for_group(db, product, group, suggested_price, prices=None):
     """Adjust a product's price to help the group meet its minimum profit requirements."""
     # Calculate current group profit with the suggested price
     total_cost = sum(p.cost_price for p in group.products)
     
     # Calculate what the total revenue would be with this new price
-    total_revenue = sum(p.current_price for p in group.products if p.id != product.id) + suggested_price
+    total_revenue = sum(group_price(p, prices) for p in group.products if p.id != product.id) + suggested_price
     
     current_profit = total_revenue - total_cost
     
@@ -822,4 +2336,4 @@ def adjust_price_for_group(db, product, group, suggested_price):
 # Run the app
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=True)
@@ -0,0 +1,212 @@
+"""Process-local cache of the product catalog.
+
+Product reads are served from memory. Every committed change to a Product,
+whichever endpoint makes it, is written through to the cache by session event
+hooks, and each change bumps the catalog version so clients can tell when their
+copy is stale.
+
+The version is the shared 'catalog' change counter (change_counters.py), bumped
+in the transaction that changes the products, so it survives restarts and is
+the same in every worker. A commit whose version isn't the next one after the
+cache's means another worker committed in between, and the cache reloads.
+`refresh_if_stale` also picks up other workers' changes by comparing the
+counter, and changes made outside the application's sessions by comparing a
+cheap fingerprint (row count and latest updated_at).
+"""
+import bisect
+import threading
+from typing import NamedTuple, Optional
+import datetime
+
+from sqlalchemy import event, func
+
+from database_models import Product
+import change_counters
+
+VERSION_COUNTER = "catalog"
+
+
+class ProductRecord(NamedTuple):
+    id: int
+    sku: str
+    name: str
+    description: Optional[str]
+    cost_price: float
+    base_price: float
+    current_price: float
+    stock_quantity: Optional[int]
+    created_at: Optional[datetime.datetime]
+    updated_at: Optional[datetime.datetime]
+    version: int  # Catalog version at which this product last changed
+
+
+class CatalogCache:
+    def __init__(self):
+        self.records = {}
+        self.ids = []  # Sorted product ids, for skip/limit listing
+        self.version = 0  # Value of the catalog change counter the cache is current with
+        self.base_version = 0  # Version of the last full load
+        self.deleted = {}  # Product id -> version it was deleted at, since the last full load
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        """Replace the cache contents with the full catalog from the database."""
+        # Same read transaction, so the version matches the rows
+        version = change_counters.value(db, VERSION_COUNTER)
+        products = db.query(Product).order_by(Product.id).all()
+        with self._lock:
+            self.version = version
+            self.base_version = version
+            self.records = {p.id: self._record(p, version) for p in products}
+            self.ids = sorted(self.records)
+            self.deleted = {}
+            self.loaded = True
+
+    def get(self, product_id):
+        return self.records.get(product_id)
+
+    def list(self, skip=0, limit=100):
+        records = self.records
+        return [records[i] for i in self.ids[skip:skip + limit]]
+
+    def changes_since(self, since):
+        """Get products changed and ids deleted after a given catalog version.
+        
+        Returns:
+            (reset, products, deleted_ids). When `since` predates the last full
+            load, deletions in between are unknown, so reset is True and
+            products is the whole catalog, which should replace the client's copy.
+            The same goes for a `since` ahead of the cache, which came from
+            another database.
+        """
+        records = self.records
+        if since < self.base_version or since > self.version:
+            return True, [records[i] for i in self.ids], []
+        products = [r for r in records.values() if r.version > since]
+        deleted_ids = [i for i, version in self.deleted.items() if version > since]
+        return False, products, deleted_ids
+
+    def apply(self, changed, deleted_ids, version):
+        """Write product changes committed at `version` through to the cache.
+        
+        Returns:
+            False if changes from other commits are missing in between, so
+            the cache has to be reloaded instead
+        """
+        with self._lock:
+            if version <= self.version:
+                return True  # A reload since the commit already has it
+            if version != self.version + 1:
+                return False
+            self.version = version
+            for values in changed:
+                current = self.records.get(values['id'])
+                if current is not None:
+                    # Staged changes may only carry the fields that changed
+                    self.records[values['id']] = current._replace(version=self.version, **values)
+                    continue
+                bisect.insort(self.ids, values['id'])
+                self.records[values['id']] = ProductRecord(version=self.version, **values)
+                self.deleted.pop(values['id'], None)
+            for product_id in deleted_ids:
+                if self.records.pop(product_id, None) is not None:
+                    self.ids.remove(product_id)
+                    self.deleted[product_id] = self.version
+        return True
+
+    def fingerprint(self):
+        latest = max((r.updated_at for r in self.records.values() if r.updated_at), default=None)
+        return len(self.records), latest
+
+    def refresh_if_stale(self, db):
+        """Reload when another process has changed the catalog. Returns True if reloaded."""
+        if change_counters.value(db, VERSION_COUNTER) == self.version:
+            count, latest = db.query(func.count(Product.id), func.max(Product.updated_at)).one()
+            if (count, latest) == self.fingerprint():
+                return False
+            # Changed without the counter (e.g. a script writing to the database directly)
+            change_counters.bump(db, VERSION_COUNTER)
+            db.commit()
+        self.load(db)
+        return True
+
+    @staticmethod
+    def _values(product):
+        return {
+            'id': product.id,
+            'sku': product.sku,
+            'name': product.name,
+            'description': product.description,
+            'cost_price': product.cost_price,
+            'base_price': product.base_price,
+            'current_price': product.current_price,
+            'stock_quantity': product.stock_quantity,
+            'created_at': product.created_at,
+            'updated_at': product.updated_at
+        }
+
+    @classmethod
+    def _record(cls, product, version):
+        return ProductRecord(version=version, **cls._values(product))
+
+    def stage(self, session, product_id, **fields):
+        """Queue a change made with a bulk UPDATE, which the flush hooks can't see.
+        
+        It is applied to the cache when the session commits.
+        """
+        changed, deleted_ids = session.info.setdefault('catalog_pending', ({}, set()))
+        changed.setdefault(product_id, {'id': product_id}).update(fields)
+
+    def stage_reload(self, session):
+        """Queue a full reload for bulk changes to many products (imports).
+        
+        The catalog version is bumped with the commit, and the cache reloads
+        after it.
+        """
+        session.info['catalog_reload'] = True
+
+    def attach(self, session_factory):
+        """Hook a sessionmaker so committed Product changes are written through."""
+
+        @event.listens_for(session_factory, "after_flush")
+        def collect_product_changes(session, flush_context):
+            # Snapshot values now; after commit the instances are expired
+            pending = session.info.setdefault('catalog_pending', ({}, set()))
+            changed, deleted_ids = pending
+            for obj in list(session.new) + list(session.dirty):
+                if isinstance(obj, Product):
+                    changed.setdefault(obj.id, {}).update(self._values(obj))
+                    deleted_ids.discard(obj.id)
+            for obj in session.deleted:
+                if isinstance(obj, Product):
+                    changed.pop(obj.id, None)
+                    deleted_ids.add(obj.id)
+
+        @event.listens_for(session_factory, "before_commit")
+        def bump_version(session):
+            # Flush first so after_flush has collected everything being committed
+            session.flush()
+            changed, deleted_ids = session.info.get('catalog_pending', ({}, set()))
+            if changed or deleted_ids or session.info.get('catalog_reload'):
+                session.info['catalog_version'] = change_counters.bump(session, VERSION_COUNTER)
+
+        @event.listens_for(session_factory, "after_commit")
+        def apply_product_changes(session):
+            pending = session.info.pop('catalog_pending', None)
+            version = session.info.pop('catalog_version', None)
+            reload = session.info.pop('catalog_reload', False)
+            if version is None or not self.loaded:
+                return
+            changed, deleted_ids = pending or ({}, set())
+            if reload or not self.apply(list(changed.values()), deleted_ids, version):
+                db = session_factory()
+                try:
+                    self.load(db)
+                finally:
+                    db.close()
+
+        @event.listens_for(session_factory, "after_rollback")
+        def discard_product_changes(session):
+            for key in ('catalog_pending', 'catalog_version', 'catalog_reload'):
+                session.info.pop(key, None)
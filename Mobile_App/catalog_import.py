@@ -0,0 +1,191 @@
+"""Bulk import of product catalogs from CSV or NDJSON.
+
+The upload is read as a stream of lines and never held in memory whole. Rows
+are validated in chunks of CHUNK_SIZE and each chunk is upserted by sku with
+one executemany statement and committed, so a 50k-SKU catalog goes in as a
+handful of transactions instead of one per product. A row that fails
+validation is reported with its line number and skipped; the rest of its
+chunk still goes in.
+
+Prices are left for the caller to reprice once at the end. New products
+start at their base price, and existing products keep their current price
+until then.
+"""
+import codecs
+import csv
+import datetime
+import json
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, func, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database_models import Product, Store, StoreProduct, DEFAULT_STORE_ID
+from schemas import ProductImportRow
+
+FORMATS = ("csv", "ndjson")
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_lines(chunks):
+    """Split a stream of UTF-8 byte chunks into text lines, keeping line endings."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        # The last piece is a line cut off by the chunk boundary, or empty
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def read_rows(lines, fmt):
+    """Yield (line number, field dict or None, parse error or None) for each row."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num, None, str(e)
+                continue
+            # Empty cells are missing values; cells past the header are ignored
+            yield reader.line_num, {k: v if v != "" else None for k, v in row.items() if k is not None}, None
+    else:
+        for line_num, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_num, None, f"Invalid JSON: {e.msg}"
+                continue
+            if isinstance(row, dict):
+                yield line_num, row, None
+            else:
+                yield line_num, None, "Expected a JSON object"
+
+
+def validate(fields):
+    """Validate one row, returning (ProductImportRow, None) or (None, error message)."""
+    try:
+        return ProductImportRow.model_validate(fields), None
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors())
+
+
+def upsert_statement():
+    table = Product.__table__
+    stmt = sqlite_insert(table).values(
+        sku=bindparam("row_sku"),
+        name=bindparam("row_name"),
+        description=bindparam("row_description"),
+        cost_price=bindparam("row_cost_price"),
+        base_price=bindparam("row_base_price"),
+        current_price=bindparam("row_base_price"),
+        stock_quantity=func.coalesce(bindparam("row_stock_quantity"), 0),
+        version=1,
+        created_at=bindparam("row_now"),
+        updated_at=bindparam("row_now")
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["sku"],
+        set_={
+            "name": stmt.excluded.name,
+            "description": func.coalesce(bindparam("row_description"), table.c.description),
+            "cost_price": stmt.excluded.cost_price,
+            "base_price": stmt.excluded.base_price,
+            "stock_quantity": func.coalesce(bindparam("row_stock_quantity"), table.c.stock_quantity),
+            "version": table.c.version + 1,
+            "updated_at": stmt.excluded.updated_at
+        }
+    )
+
+
+class CatalogImport:
+    """Result of an import: counts, per-row errors, and the products touched."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.product_ids = set()
+        self.new_product_ids = set()
+
+    def error(self, line_num, sku, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_num, "sku": sku, "error": message})
+
+    def summary(self):
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+
+def import_catalog(db, lines, fmt, chunk_size=CHUNK_SIZE):
+    """Upsert the products in a CSV or NDJSON line stream, committing once per chunk."""
+    result = CatalogImport()
+    existing = {sku for sku, in db.query(Product.sku)}
+    stmt = upsert_statement()
+    chunk = {}
+
+    def flush():
+        if chunk:
+            write_chunk(db, stmt, chunk, existing, result)
+            chunk.clear()
+
+    for line_num, fields, error in read_rows(lines, fmt):
+        result.rows += 1
+        if error is None:
+            row, error = validate(fields)
+        if error is not None:
+            result.error(line_num, (fields or {}).get("sku"), error)
+            continue
+        # A sku repeated within a chunk keeps its last row, as it would across chunks
+        chunk.pop(row.sku, None)
+        chunk[row.sku] = row
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    return result
+
+
+def write_chunk(db, stmt, chunk, existing, result):
+    now = datetime.datetime.utcnow()
+    db.execute(stmt, [
+        {"row_sku": row.sku, "row_name": row.name, "row_description": row.description,
+         "row_cost_price": row.cost_price, "row_base_price": row.base_price,
+         "row_stock_quantity": row.stock_quantity, "row_now": now}
+        for row in chunk.values()
+    ])
+    ids = dict(db.query(Product.sku, Product.id).filter(Product.sku.in_(list(chunk))).all())
+    new_ids = [ids[sku] for sku in chunk if sku not in existing]
+
+    # Other stores carry new products too, starting with no stock
+    if new_ids:
+        db.execute(sqlite_insert(StoreProduct).from_select(
+            ["store_id", "product_id", "stock_quantity", "current_price"],
+            select(Store.id, Product.id, literal(0), Product.base_price)
+            .where(Store.id != DEFAULT_STORE_ID, Product.id.in_(new_ids))
+        ).on_conflict_do_nothing())
+    db.commit()
+
+    result.created += len(new_ids)
+    result.updated += len(chunk) - len(new_ids)
+    result.product_ids.update(ids.values())
+    result.new_product_ids.update(new_ids)
+    existing.update(chunk)
@@ -0,0 +1,29 @@
+"""Shared change counters (the change_counters table).
+
+A counter is bumped in the same transaction as the change it counts, so every
+worker, and the same worker after a restart, sees it move exactly when the
+change commits. Caches keep the value they were built at and compare.
+"""
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database_models import ChangeCounter
+
+
+def bump(db, name):
+    """Stage an increment of a counter. Does not commit.
+
+    Returns:
+        The counter's new value
+    """
+    stmt = sqlite_insert(ChangeCounter).values(name=name, value=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'value': ChangeCounter.value + 1}
+    ).returning(ChangeCounter.value)
+    return db.execute(stmt).scalar_one()
+
+
+def value(db, name):
+    """Current value of a counter; 0 before it is first bumped."""
+    return db.execute(select(ChangeCounter.value).where(ChangeCounter.name == name)).scalar() or 0
@@ -0,0 +1,107 @@
+# Concurrent checkout stress test
+#
+# Runs several worker processes against one SQLite file, all buying the same
+# scarce products, then checks that stock never went negative and that stock,
+# sale items and sale totals agree. Reports checkout transactions per second.
+#
+#   python checkout_stress.py --workers 8 --checkouts 200 --stock 500
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+
+def worker(database_url, product_ids, sale_ids, checkouts, seed, results):
+    os.environ["POS_DATABASE_URL"] = database_url
+    from fastapi.testclient import TestClient
+    import api_backend
+
+    rng = random.Random(seed)
+    sold = sold_out = errors = 0
+    with TestClient(api_backend.app) as client:
+        for _ in range(checkouts):
+            quantity = rng.randint(1, 3)
+            response = client.post(f"/sales/{rng.choice(sale_ids)}/add-item",
+                                   params={"product_id": rng.choice(product_ids), "quantity": quantity})
+            if response.status_code == 200:
+                sold += quantity
+            elif response.status_code == 400:
+                sold_out += 1
+            else:
+                errors += 1
+    results.put((sold, sold_out, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent checkouts for oversells and lost updates.")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--checkouts", type=int, default=200, help="Checkouts per worker")
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--stock", type=int, default=500, help="Initial stock per product")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    database_url = f"sqlite:///{path}"
+    os.environ["POS_DATABASE_URL"] = database_url
+    os.environ.setdefault("POS_PREDICTION_WARMUP", "0")  # Workers only sell
+    from fastapi.testclient import TestClient
+    import api_backend
+
+    # Entering the client runs startup, which creates the schema
+    with TestClient(api_backend.app) as client:
+        product_ids = [
+            client.post("/products/", params={"name": f"Stress {i}", "sku": f"STRESS-{i}", "cost_price": 1.0,
+                                              "base_price": 2.0, "stock_quantity": args.stock}).json()["id"]
+            for i in range(args.products)
+        ]
+        sale_ids = [client.post("/sales/").json()["id"] for _ in range(args.workers * 4)]
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(database_url, product_ids, sale_ids, args.checkouts, seed, results))
+        for seed in range(args.workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    sold = sum(t[0] for t in totals)
+    sold_out = sum(t[1] for t in totals)
+    errors = sum(t[2] for t in totals)
+    attempts = args.workers * args.checkouts
+
+    conn = sqlite3.connect(path)
+    remaining = conn.execute("SELECT SUM(stock_quantity), MIN(stock_quantity) FROM products").fetchone()
+    items_quantity, items_total = conn.execute("SELECT SUM(quantity), SUM(quantity * price_at_sale) FROM sale_items").fetchone()
+    sales_total = conn.execute("SELECT SUM(total_amount) FROM sales").fetchone()[0]
+    conn.close()
+
+    initial = args.stock * args.products
+    print(f"Checkouts: {attempts} attempted, {attempts - sold_out - errors} succeeded, "
+          f"{sold_out} rejected for stock, {errors} errors")
+    print(f"Throughput: {attempts / elapsed:.1f} checkouts/sec over {elapsed:.2f}s with {args.workers} workers")
+    print(f"Stock: {initial} initial, {remaining[0]} remaining, {sold} sold (minimum per product {remaining[1]})")
+
+    checks = {
+        "no negative stock": remaining[1] >= 0,
+        "no oversell": sold <= initial,
+        "stock matches sold units": initial - remaining[0] == sold == (items_quantity or 0),
+        "sale totals match items": abs((sales_total or 0) - (items_total or 0)) < 1e-6,
+        "no errors": errors == 0
+    }
+    for name, passed in checks.items():
+        print(f"{'✅' if passed else '❌'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Table, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Table, Boolean, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
 
 Base = declarative_base()
 
+# The original single location. Its stock and current prices live on the
+# products table; every other store keeps its own in store_products.
+DEFAULT_STORE_ID = 1
+
 # Association table for many-to-many relationship between products and profit groups
 product_group_association = Table(
     'product_group_association', 
@@ -22,11 +26,15 @@ class Product(Base):
     description = Column(String(500))
     cost_price = Column(Float, nullable=False)
     base_price = Column(Float, nullable=False)
-    current_price = Column(Float, nullable=False)  # Current dynamically adjusted price
-    stock_quantity = Column(Integer, default=0)
+    current_price = Column(Float, nullable=False)  # Current dynamically adjusted price (default store)
+    stock_quantity = Column(Integer, default=0)  # Stock at the default store
+    lead_time_days = Column(Integer, nullable=False, default=3, server_default='3')  # Supplier lead time, for replenishment
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # Optimistic concurrency
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     
+    __mapper_args__ = {'version_id_col': version}
+    
     # Relationships
     sales = relationship("SaleItem", back_populates="product")
     profit_groups = relationship("ProfitGroup", secondary=product_group_association, back_populates="products")
@@ -57,9 +65,14 @@ class Sale(Base):
     
     id = Column(Integer, primary_key=True)
     customer_id = Column(Integer, ForeignKey('customers.id'), nullable=True)  # Optional
+    store_id = Column(Integer, ForeignKey('stores.id'), nullable=False, default=DEFAULT_STORE_ID,
+                      server_default=str(DEFAULT_STORE_ID), index=True)
     total_amount = Column(Float, nullable=False)
     payment_method = Column(String(50))
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # Optimistic concurrency
+    
+    __mapper_args__ = {'version_id_col': version}
     
     # Relationships
     customer = relationship("Customer", back_populates="sales")
@@ -121,13 +134,241 @@ class PricingRule(Base):
         return f"<PricingRule(type='{self.rule_type}', discount={self.discount_percentage}%)>"
 
 
+class Store(Base):
+    __tablename__ = 'stores'
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    timezone = Column(String(50), nullable=False, default='UTC', server_default='UTC')  # IANA name; pricing rules use local time
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<Store(id={self.id}, name='{self.name}')>"
+
+
+# Stock and current price of each product at the stores other than the default one
+class StoreProduct(Base):
+    __tablename__ = 'store_products'
+    
+    store_id = Column(Integer, ForeignKey('stores.id'), primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    stock_quantity = Column(Integer, nullable=False, default=0)
+    current_price = Column(Float, nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # Optimistic concurrency
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    __mapper_args__ = {'version_id_col': version}
+    
+    product = relationship("Product")
+    
+    def __repr__(self):
+        return f"<StoreProduct(store_id={self.store_id}, product_id={self.product_id}, stock={self.stock_quantity})>"
+
+
 class StoreStatus(Base):
     __tablename__ = 'store_status'
     
     id = Column(Integer, primary_key=True)
+    store_id = Column(Integer, ForeignKey('stores.id'), nullable=False, default=DEFAULT_STORE_ID,
+                      server_default=str(DEFAULT_STORE_ID))
     vacancy_rate = Column(Float, default=0.0)  # Percentage of capacity
     line_length = Column(Integer, default=0)  # Number of people in line
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     
+    # Latest status of one store is an index seek
+    __table_args__ = (Index('ix_store_status_store_time', 'store_id', 'timestamp'),)
+    
     def __repr__(self):
         return f"<StoreStatus(vacancy_rate={self.vacancy_rate}%, line_length={self.line_length})>"
+
+
+# Downsampled store status readings, per minute and then per hour, once the
+# raw rows pass their retention period
+class StoreStatusHistory(Base):
+    __tablename__ = 'store_status_history'
+    
+    store_id = Column(Integer, ForeignKey('stores.id'), primary_key=True)
+    resolution = Column(String(10), primary_key=True)  # 'minute' or 'hour'
+    bucket_start = Column(DateTime, primary_key=True)
+    samples = Column(Integer, nullable=False)  # Raw readings folded into this bucket
+    vacancy_avg = Column(Float, nullable=False)
+    vacancy_max = Column(Float, nullable=False)
+    line_avg = Column(Float, nullable=False)
+    line_max = Column(Integer, nullable=False)
+    
+    def __repr__(self):
+        return f"<StoreStatusHistory(store_id={self.store_id}, {self.resolution} {self.bucket_start}, samples={self.samples})>"
+
+
+# Hourly per-product sales totals, updated in the same transaction as each sale item
+class SalesRollup(Base):
+    __tablename__ = 'sales_rollup'
+    
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    hour = Column(Integer, primary_key=True)  # 0-23, from the sale timestamp
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)  # Sum of price_at_sale * quantity
+    cost = Column(Float, nullable=False, default=0.0)  # Sum of cost_price * quantity at time of sale
+    
+    __table_args__ = (
+        Index('ix_sales_rollup_day', 'day'),
+    )
+    
+    def __repr__(self):
+        return f"<SalesRollup(product_id={self.product_id}, day={self.day}, hour={self.hour}, quantity={self.quantity})>"
+
+
+# Sufficient statistics of the per-product log-log demand regression, one row
+# per (product, weekday), kept in step with sales_rollup (see elasticity.py).
+# x is log(average price) and y is log(quantity) of an hourly rollup bucket.
+class DemandStats(Base):
+    __tablename__ = 'demand_stats'
+
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    day_of_week = Column(Integer, primary_key=True)  # 0 = Monday
+    observations = Column(Integer, nullable=False, default=0)
+    sum_x = Column(Float, nullable=False, default=0.0)
+    sum_y = Column(Float, nullable=False, default=0.0)
+    sum_xx = Column(Float, nullable=False, default=0.0)
+    sum_xy = Column(Float, nullable=False, default=0.0)
+    sum_yy = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DemandStats(product_id={self.product_id}, day_of_week={self.day_of_week}, observations={self.observations})>"
+
+
+# Latest replenishment plan, one row per product, rewritten by each planner run
+# (see replenishment.py)
+class ReplenishmentPlan(Base):
+    __tablename__ = 'replenishment_plan'
+
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    stock_quantity = Column(Integer, nullable=False)
+    lead_time_days = Column(Integer, nullable=False)
+    daily_demand = Column(Float, nullable=False)  # Mean forecast units per day over the horizon
+    lead_time_demand = Column(Float, nullable=False)
+    safety_stock = Column(Float, nullable=False)
+    reorder_point = Column(Float, nullable=False)
+    reorder_quantity = Column(Integer, nullable=False)  # 0 when no order is due
+    days_of_cover = Column(Float)  # None when there is no demand
+    stockout_date = Column(Date)
+    reorder_by = Column(Date)  # Last day to order for delivery before the stockout
+    forecast_source = Column(String(20), nullable=False)  # "model" or "history"
+    planned_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ReplenishmentPlan(product_id={self.product_id}, stockout_date={self.stockout_date}, reorder_quantity={self.reorder_quantity})>"
+
+
+# Append-only record of every current price change, one compact row per change.
+# The primary key doubles as the "price as of t" index, and WITHOUT ROWID keeps
+# rows clustered on it.
+class PriceHistory(Base):
+    __tablename__ = 'price_history'
+    
+    store_id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    epoch = Column(Integer, primary_key=True)  # Seconds since 1970-01-01 UTC
+    price_cents = Column(Integer, nullable=False)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+    
+    def __repr__(self):
+        return f"<PriceHistory(store_id={self.store_id}, product_id={self.product_id}, epoch={self.epoch}, price_cents={self.price_cents})>"
+
+
+# Events written in the same transaction as the change they describe, then
+# delivered to WebSocket subscribers by a background dispatcher
+class OutboxEvent(Base):
+    __tablename__ = 'outbox_events'
+    
+    id = Column(Integer, primary_key=True)  # Sequence number clients replay from
+    channel = Column(String(50), nullable=False)  # 'stock', 'prices', etc.
+    payload = Column(String, nullable=False)  # JSON-encoded event
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    claimed_until = Column(DateTime, nullable=True)  # Lease held by the worker dispatching it
+    dispatched_at = Column(DateTime, nullable=True, index=True)
+    
+    # Pruning can empty the table, and without AUTOINCREMENT SQLite would then
+    # hand out ids clients have already seen
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    def __repr__(self):
+        return f"<OutboxEvent(id={self.id}, channel='{self.channel}', dispatched={self.dispatched_at is not None})>"
+
+
+# Shared log the database pub/sub backend uses to fan broadcasts out to every worker
+class BroadcastMessage(Base):
+    __tablename__ = 'broadcast_messages'
+    
+    id = Column(Integer, primary_key=True)
+    channel = Column(String(50), nullable=False)
+    payload = Column(String, nullable=False)  # JSON array of events
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    
+    # Workers read rows after the last id they saw, so ids must keep growing
+    # even when pruning empties the table
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    def __repr__(self):
+        return f"<BroadcastMessage(id={self.id}, channel='{self.channel}')>"
+
+
+# Named counters shared by every worker, bumped in the transaction that makes
+# the change they count, so caches can tell when their copy is stale
+class ChangeCounter(Base):
+    __tablename__ = 'change_counters'
+
+    name = Column(String(50), primary_key=True)  # 'closed_sales', ...
+    value = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ChangeCounter(name='{self.name}', value={self.value})>"
+
+
+def add_missing_columns(engine):
+    """Add columns that are in the models but not yet in an existing database.
+    
+    create_all only creates missing tables, so this lets new columns reach an
+    existing pos_system.db. New columns must be nullable or have a server_default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    # Quote text defaults; numbers go in as they are
+                    if not default.lstrip('-').replace('.', '', 1).isdigit():
+                        default = "'" + default.replace("'", "''") + "'"
+                    ddl += f" NOT NULL DEFAULT {default}" if not column.nullable else f" DEFAULT {default}"
+                conn.execute(text(ddl))
+
+
+def add_autoincrement(engine, model):
+    """Rebuild a table created before its model asked for AUTOINCREMENT.
+    
+    SQLite can't change a primary key in place, so the rows are copied into a
+    new table in one transaction. Run after add_missing_columns.
+    """
+    table = model.__table__
+    with engine.begin() as conn:
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {"name": table.name}).scalar()
+        if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+            return
+        conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+        # The indexes moved with the rename; free their names for the new table's
+        for index in table.indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        table.create(conn)
+        columns = ', '.join(column.name for column in table.columns)
+        conn.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old'))
+        conn.execute(text(f'DROP TABLE {table.name}_old'))
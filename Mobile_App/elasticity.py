@@ -0,0 +1,177 @@
+"""Per-product constant-elasticity demand model, the fast path for optimal prices.
+
+Each hourly sales rollup bucket is one observation of demand: x = log of the
+bucket's average price, y = log of its quantity. Per product the model is
+
+    log q = a[weekday] + b * log p
+
+with one intercept per day of the week and a shared elasticity b, fitted by
+least squares. The fit only needs a handful of sums per (product, weekday),
+kept in demand_stats: when a checkout changes a rollup bucket, the bucket's
+old observation is subtracted and its new one added in the same transaction,
+so the statistics are always those of the current rollup without refitting.
+
+With q proportional to p^b the profit (p - c) * q peaks at
+
+    p* = c * b / (1 + b)        for b < -1
+
+independent of the intercepts, so the optimal price is a closed-form
+expression instead of a search over model predictions. When demand isn't
+clearly elastic (b near or above -1, or too few observations) p* is
+meaningless and the caller falls back to the forest.
+"""
+import collections
+import math
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database_models import DemandStats, SalesRollup
+
+MIN_OBSERVATIONS = 30
+# Two-sided 95% interval on the elasticity
+CONFIDENCE_Z = 1.96
+SUMS = ("sum_x", "sum_y", "sum_xx", "sum_xy", "sum_yy")
+
+
+def observation(quantity, revenue):
+    """(log price, log quantity) of a rollup bucket, or None for an empty or free one."""
+    if not quantity or quantity <= 0 or revenue <= 0:
+        return None
+    return math.log(revenue / quantity), math.log(quantity)
+
+
+def terms(x, y):
+    return (x, y, x * x, x * y, y * y)
+
+
+def record_bucket_change(db, product_id, day, before, after):
+    """Replace a rollup bucket's observation in its weekday's statistics.
+
+    `before` and `after` are the bucket's (quantity, revenue) on either side
+    of the change. Only stages the upsert; the caller commits it with the
+    rollup.
+    """
+    old, new = observation(*before), observation(*after)
+    if old == new:
+        return
+    count = 0
+    deltas = [0.0] * len(SUMS)
+    for sign, point in ((-1, old), (1, new)):
+        if point is not None:
+            count += sign
+            deltas = [d + sign * t for d, t in zip(deltas, terms(*point))]
+
+    values = dict(zip(SUMS, deltas))
+    stmt = sqlite_insert(DemandStats).values(
+        product_id=product_id, day_of_week=day.weekday(), observations=count, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['product_id', 'day_of_week'],
+        set_={
+            'observations': DemandStats.observations + stmt.excluded.observations,
+            **{name: getattr(DemandStats, name) + getattr(stmt.excluded, name) for name in SUMS}
+        }
+    )
+    db.execute(stmt)
+
+
+def rebuild_demand_stats(db):
+    """Recompute all statistics from the rollup. Does not commit.
+
+    Returns:
+        Number of (product, weekday) rows written
+    """
+    stats = {}
+    rows = db.query(SalesRollup.product_id, SalesRollup.day, SalesRollup.quantity, SalesRollup.revenue)\
+             .execution_options(yield_per=10000)
+    for product_id, day, quantity, revenue in rows:
+        point = observation(quantity, revenue)
+        if point is None:
+            continue
+        key = (product_id, day.weekday())
+        sums = stats.setdefault(key, [0] + [0.0] * len(SUMS))
+        sums[0] += 1
+        for i, term in enumerate(terms(*point), 1):
+            sums[i] += term
+
+    db.query(DemandStats).delete()
+    if stats:
+        db.execute(sqlite_insert(DemandStats), [
+            {"product_id": product_id, "day_of_week": day_of_week, "observations": sums[0],
+             **dict(zip(SUMS, sums[1:]))}
+            for (product_id, day_of_week), sums in stats.items()
+        ])
+    return len(stats)
+
+
+class DemandFit:
+    """Least-squares fit of one product's log-log demand with weekday intercepts."""
+
+    def __init__(self, rows):
+        """`rows` are the product's DemandStats rows."""
+        self.intercepts = {}  # weekday -> (intercept, observations)
+        self.elasticity = None
+        self.std_error = None
+        self.residual_variance = None
+        groups = [r for r in rows if r.observations > 0]
+        self.observations = sum(r.observations for r in groups)
+
+        # Sums of squares within each weekday, pooled; the weekday means absorb the intercepts
+        sxx = sum(r.sum_xx - r.sum_x ** 2 / r.observations for r in groups)
+        sxy = sum(r.sum_xy - r.sum_x * r.sum_y / r.observations for r in groups)
+        syy = sum(r.sum_yy - r.sum_y ** 2 / r.observations for r in groups)
+        degrees_of_freedom = self.observations - len(groups) - 1
+        if sxx <= 1e-12 or degrees_of_freedom <= 0:
+            return
+
+        b = sxy / sxx
+        self.elasticity = b
+        self.residual_variance = max(syy - b * sxy, 0.0) / degrees_of_freedom
+        self.std_error = math.sqrt(self.residual_variance / sxx)
+        self.intercepts = {
+            r.day_of_week: ((r.sum_y - b * r.sum_x) / r.observations, r.observations) for r in groups
+        }
+
+    def confidence_problem(self):
+        """Why the fit can't be trusted to price with, or None when it can."""
+        if self.observations < MIN_OBSERVATIONS:
+            return f"Only {self.observations} sales observations (need {MIN_OBSERVATIONS})"
+        if self.elasticity is None:
+            return "No price variation in sales history"
+        upper = self.elasticity + CONFIDENCE_Z * self.std_error
+        if upper >= -1:
+            return (f"Demand not clearly elastic (elasticity {self.elasticity:.2f} "
+                    f"± {CONFIDENCE_Z * self.std_error:.2f})")
+        return None
+
+    def expected_quantity(self, price):
+        """Expected units over the observed buckets at `price`, like the forest's
+        prediction summed over the product's history."""
+        # exp(s²/2) turns the median of log-normal demand into its mean
+        scale = math.exp(self.residual_variance / 2)
+        return sum(n * math.exp(a) for a, n in self.intercepts.values()) * price ** self.elasticity * scale
+
+    def optimal_price(self, cost_price, min_price, max_price):
+        """Profit-maximizing price within [min_price, max_price] and its expected profit.
+
+        Profit is unimodal in price for b < -1, so clamping the unconstrained
+        optimum gives the constrained one.
+        """
+        b = self.elasticity
+        price = min(max(cost_price * b / (1 + b), min_price), max_price)
+        return price, (price - cost_price) * self.expected_quantity(price)
+
+
+def fit(db, product_id):
+    # Plain rows rather than ORM objects; this is on the request path
+    table = DemandStats.__table__
+    return DemandFit(db.execute(select(table).where(table.c.product_id == product_id)).all())
+
+
+def fits(db, product_ids):
+    """DemandFit per product id, from one query."""
+    table = DemandStats.__table__
+    rows = collections.defaultdict(list)
+    for row in db.execute(select(table).where(table.c.product_id.in_(list(product_ids)))):
+        rows[row.product_id].append(row)
+    return {product_id: DemandFit(rows[product_id]) for product_id in product_ids}
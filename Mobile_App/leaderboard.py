@@ -0,0 +1,132 @@
+"""Streaming top-products leaderboard over a rolling window.
+
+Each hour of the window keeps a weighted Space-Saving summary (Metwally et al.)
+of at most `capacity` products, so memory is bounded by window_hours x capacity
+no matter how many products or sales there are. Checkout only touches the
+current hour's summary; the merged top-K is recomputed lazily and cached, so
+reads are O(K) between changes.
+
+Space-Saving counts are upper bounds that are exact for products that never
+got evicted. `reconcile` periodically replaces the summaries with exact hourly
+totals from the sales rollup; a checkout that lands while it runs may be missed
+until the next reconcile.
+"""
+import heapq
+import threading
+import datetime
+
+from database_models import SalesRollup
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def hour_index(timestamp):
+    return int((timestamp - EPOCH).total_seconds() // 3600)
+
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, item, weight):
+        if item in self.counts or len(self.counts) < self.capacity:
+            self.counts[item] = self.counts.get(item, 0) + weight
+            return
+        # Replace the smallest counter; the newcomer inherits its count as error
+        smallest = min(self.counts, key=self.counts.get)
+        self.counts[item] = self.counts.pop(smallest) + weight
+
+
+class RollingTopK:
+    def __init__(self, window_hours=24, capacity=100, k=10):
+        self.window_hours = window_hours
+        self.capacity = capacity
+        self.k = k
+        self.buckets = {}  # Hour index -> SpaceSaving
+        self.ranking = []  # Cached [(product_id, total)], best first
+        self.dirty = False
+
+    def add(self, product_id, weight, timestamp):
+        hour = hour_index(timestamp)
+        bucket = self.buckets.get(hour)
+        if bucket is None:
+            bucket = self.buckets[hour] = SpaceSaving(self.capacity)
+        bucket.add(product_id, weight)
+        self.dirty = True
+
+    def expire(self, now):
+        oldest = hour_index(now) - self.window_hours + 1
+        for hour in [h for h in self.buckets if h < oldest]:
+            del self.buckets[hour]
+            self.dirty = True
+
+    def top(self, now):
+        """Get the cached top-K, recomputing it only if something changed."""
+        self.expire(now)
+        if self.dirty:
+            totals = {}
+            for bucket in self.buckets.values():
+                for product_id, count in bucket.counts.items():
+                    totals[product_id] = totals.get(product_id, 0) + count
+            self.ranking = heapq.nlargest(self.k, totals.items(), key=lambda item: item[1])
+            self.dirty = False
+        return self.ranking
+
+
+class Leaderboard:
+    def __init__(self, window_hours=24, capacity=100, k=10):
+        self.window_hours = window_hours
+        self.by_quantity = RollingTopK(window_hours, capacity, k)
+        self.by_revenue = RollingTopK(window_hours, capacity, k)
+        self.last_pushed = None
+        self._lock = threading.Lock()
+
+    def record(self, product_id, quantity, revenue, timestamp):
+        with self._lock:
+            self.by_quantity.add(product_id, quantity, timestamp)
+            self.by_revenue.add(product_id, revenue, timestamp)
+
+    def top(self, now=None):
+        now = now or datetime.datetime.utcnow()
+        with self._lock:
+            return self.by_quantity.top(now), self.by_revenue.top(now)
+
+    def changed_since_push(self, now=None):
+        """Check whether the ranking order differs from the last one pushed, and mark it pushed."""
+        by_quantity, by_revenue = self.top(now)
+        order = ([p for p, _ in by_quantity], [p for p, _ in by_revenue])
+        if order == self.last_pushed:
+            return False
+        self.last_pushed = order
+        return True
+
+    def reconcile(self, db, now=None):
+        """Rebuild the window from exact hourly totals in the sales rollup."""
+        now = now or datetime.datetime.utcnow()
+        start = now - datetime.timedelta(hours=self.window_hours - 1)
+        rows = db.query(
+            SalesRollup.product_id,
+            SalesRollup.day,
+            SalesRollup.hour,
+            SalesRollup.quantity,
+            SalesRollup.revenue
+        ).filter(SalesRollup.day >= start.date()).all()
+
+        hourly = {}
+        for product_id, day, hour, quantity, revenue in rows:
+            key = hour_index(datetime.datetime.combine(day, datetime.time(hour)))
+            hourly.setdefault(key, []).append((product_id, quantity, revenue))
+
+        by_quantity = RollingTopK(self.window_hours, self.by_quantity.capacity, self.by_quantity.k)
+        by_revenue = RollingTopK(self.window_hours, self.by_revenue.capacity, self.by_revenue.k)
+        for target, column in ((by_quantity, 1), (by_revenue, 2)):
+            for key, products in hourly.items():
+                # Keep the exact totals of the `capacity` largest products per hour
+                bucket = target.buckets[key] = SpaceSaving(target.capacity)
+                for row in heapq.nlargest(target.capacity, products, key=lambda r: r[column]):
+                    bucket.counts[row[0]] = row[column]
+            target.dirty = True
+
+        with self._lock:
+            self.by_quantity, self.by_revenue = by_quantity, by_revenue
@@ -0,0 +1,326 @@
+# Async load generator and latency benchmark for the POS API
+#
+# Drives the API with concurrent cashiers (open a sale, scan a basket, fetch
+# the receipt), store status sensors and WebSocket subscribers for a fixed
+# duration, then reports throughput and p50/p95/p99 latency per endpoint and
+# how long stock updates take to reach subscribers.
+#
+# By default the app runs in this process on a fresh temporary database,
+# through httpx's ASGI transport with its startup tasks running, so no server
+# is needed. The client shares the event loop with the app, so absolute
+# numbers include its overhead; compare runs with each other, not with a
+# server. --url targets a running server and its existing catalog instead.
+#
+#   python load_test.py --cashiers 16 --basket-size 6 --sensor-rate 5 --subscribers 20
+#   python load_test.py --save-baseline baseline.json
+#   python load_test.py --baseline baseline.json  # Exits 1 on a regression
+#   python load_test.py --url http://localhost:8000 --duration 30
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+CASHIER_ENDPOINTS = ("POST /sales/", "POST /sales/{id}/add-item", "GET /sales/{id}")
+SENSOR_ENDPOINT = "POST /store-status/batch"
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {"p50": percentile(ordered, 50), "p95": percentile(ordered, 95), "p99": percentile(ordered, 99)}
+
+
+class Recorder:
+    """Latencies and outcomes per endpoint, plus stock event lag seen by subscribers."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.rejected = defaultdict(int)  # 4xx, e.g. out of stock on a live catalog
+        self.errors = defaultdict(int)  # 5xx and transport failures
+        self.checkouts = defaultdict(list)  # (store_id, product_id) -> checkout response times
+        self.event_lag = []
+        self.events_received = 0
+
+    async def request(self, label, call):
+        start = time.perf_counter()
+        try:
+            response = await call()
+        except httpx.HTTPError:
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            self.errors[label] += 1
+        elif response.status_code >= 400:
+            self.rejected[label] += 1
+        else:
+            return response
+        return None
+
+
+async def cashier(client, recorder, stores, products, basket_size, deadline, rng):
+    while time.perf_counter() < deadline:
+        store_id = rng.choice(stores)
+        response = await recorder.request("POST /sales/", lambda: client.post("/sales/", params={"store_id": store_id}))
+        if response is None:
+            continue
+        sale_id = response.json()["id"]
+        for _ in range(rng.randint(1, basket_size)):
+            product_id = rng.choice(products)
+            response = await recorder.request("POST /sales/{id}/add-item", lambda: client.post(
+                f"/sales/{sale_id}/add-item", params={"product_id": product_id, "quantity": rng.randint(1, 3)}))
+            if response is not None:
+                recorder.checkouts[(store_id, product_id)].append(time.perf_counter())
+        await recorder.request("GET /sales/{id}", lambda: client.get(f"/sales/{sale_id}"))
+
+
+async def sensor(client, recorder, stores, rate, deadline, rng):
+    """Report a reading for every store `rate` times a second."""
+    interval = 1 / rate
+    next_tick = time.perf_counter()
+    while next_tick < deadline:
+        readings = [{"store_id": store_id, "vacancy_rate": rng.randint(0, 100), "line_length": rng.randint(0, 12)}
+                    for store_id in stores]
+        await recorder.request(SENSOR_ENDPOINT, lambda: client.post("/store-status/batch", json=readings))
+        next_tick += interval
+        await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+
+
+class ASGIWebSocket:
+    """Just enough of a WebSocket client to talk to the app over ASGI in this process."""
+
+    def __init__(self, app, path, query=""):
+        self.app = app
+        self.scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+            "headers": [(b"host", b"testserver")], "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+            "subprotocols": []
+        }
+        self.to_app = asyncio.Queue()
+        self.from_app = asyncio.Queue()
+        self.task = None
+
+    async def __aenter__(self):
+        await self.to_app.put({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(self.scope, self.to_app.get, self.from_app.put))
+        message = await self.from_app.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"WebSocket rejected: {message}")
+        return self
+
+    async def recv(self):
+        message = await self.from_app.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError("WebSocket closed by the app")
+        return message.get("text") or message.get("bytes")
+
+    async def __aexit__(self, *exc_info):
+        await self.to_app.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, 1.0)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.task.cancel()
+
+
+async def subscriber(connect, recorder, deadline):
+    """Count stock events and time each from the checkout response that caused it."""
+    seen = defaultdict(int)
+    async with connect() as websocket:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            try:
+                frame = await asyncio.wait_for(websocket.recv(), remaining)
+            except asyncio.TimeoutError:
+                return
+            received = time.perf_counter()
+            payload = json.loads(frame)
+            for event in payload if isinstance(payload, list) else [payload]:
+                recorder.events_received += 1
+                if "new_stock" not in event:
+                    continue
+                key = (event.get("store_id"), event["product_id"])
+                if key not in recorder.checkouts:
+                    continue  # Another client's sale
+                sent = recorder.checkouts[key]
+                # Zero when the event arrived before the checkout's own response
+                lag = received - sent[seen[key]] if seen[key] < len(sent) else 0.0
+                recorder.event_lag.append(max(0.0, lag))
+                seen[key] += 1
+
+
+async def seed(client, num_products, num_stores):
+    """Create the stores and products of a fresh in-process database."""
+    stores = [1]
+    for i in range(1, num_stores):
+        stores.append((await client.post("/stores/", params={"name": f"Load store {i}"})).json()["id"])
+    products = []
+    for i in range(num_products):
+        response = await client.post("/products/", params={
+            "name": f"Load {i}", "sku": f"LOAD-{i}", "cost_price": 1.0, "base_price": 2.0,
+            "stock_quantity": 1_000_000})
+        products.append(response.json()["id"])
+    for store_id in stores[1:]:
+        for product_id in products:
+            await client.put(f"/stores/{store_id}/products/{product_id}", params={"stock_quantity": 1_000_000})
+    return stores, products
+
+
+async def run(args, client, connect):
+    if args.url:
+        stores = [store["id"] for store in (await client.get("/stores/")).json()][:args.stores]
+        products = [product["id"] for product in (await client.get("/products/")).json() if product["stock_quantity"] > 0]
+        if not products:
+            raise SystemExit("No products in stock. Populate the database first.")
+    else:
+        stores, products = await seed(client, args.products, args.stores)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    tasks = [subscriber(connect, recorder, deadline + args.drain) for _ in range(args.subscribers)]
+    tasks += [cashier(client, recorder, stores, products, args.basket_size, deadline, random.Random(rng.random()))
+              for _ in range(args.cashiers)]
+    if args.sensor_rate > 0:
+        tasks.append(sensor(client, recorder, stores, args.sensor_rate, deadline, random.Random(rng.random())))
+    await asyncio.sleep(0)  # Let subscribers connect before load starts
+    await asyncio.gather(*tasks)
+    return recorder, min(time.perf_counter(), deadline) - start
+
+
+def report(recorder, elapsed, args):
+    """Print the results table and return them in baseline form."""
+    results = {}
+    print(f"\n{args.cashiers} cashiers, basket up to {args.basket_size}, {args.stores} stores, "
+          f"sensor {args.sensor_rate}/s, {args.subscribers} subscribers, {elapsed:.1f}s")
+    print(f"{'endpoint':<28}{'requests':>10}{'rejected':>10}{'errors':>8}{'req/s':>10}"
+          f"{'p50_ms':>9}{'p95_ms':>9}{'p99_ms':>9}")
+    for label in CASHIER_ENDPOINTS + (SENSOR_ENDPOINT,):
+        samples = recorder.latencies.get(label)
+        if not samples and not recorder.errors.get(label):
+            continue
+        stats = summarize(samples or [])
+        results[label] = {"throughput": len(samples or []) / elapsed,
+                          **{q: stats[q] * 1000 if stats[q] is not None else None for q in stats}}
+        row = results[label]
+        print(f"{label:<28}{len(samples or []):>10}{recorder.rejected[label]:>10}{recorder.errors[label]:>8}"
+              f"{row['throughput']:>10.1f}" + "".join(f"{row[q] or 0:>9.1f}" for q in ("p50", "p95", "p99")))
+    if args.subscribers:
+        lag = summarize(recorder.event_lag)
+        print(f"\nWebSocket: {recorder.events_received} events received, "
+              f"{len(recorder.event_lag)} stock events matched to checkouts")
+        if recorder.event_lag:
+            results["ws stock event lag"] = {q: lag[q] * 1000 for q in lag}
+            print("Stock event lag after checkout response: " +
+                  ", ".join(f"{q} {lag[q] * 1000:.1f}ms" for q in lag))
+    return results
+
+
+def compare(results, baseline, tolerance, floor_ms):
+    """Check results against a saved baseline; returns the regressions found."""
+    regressions = []
+    for label, base in baseline["results"].items():
+        current = results.get(label)
+        if current is None:
+            regressions.append(f"{label}: missing from this run")
+            continue
+        for q in ("p50", "p95"):
+            if base.get(q) is not None and current.get(q) is not None and \
+                    current[q] > base[q] * (1 + tolerance) + floor_ms:
+                regressions.append(f"{label}: {q} {current[q]:.1f}ms vs baseline {base[q]:.1f}ms")
+        if "throughput" in base and current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{label}: {current['throughput']:.1f} req/s vs baseline {base['throughput']:.1f}")
+    return regressions
+
+
+async def main_async(args):
+    if args.url:
+        try:
+            import websockets
+        except ImportError:
+            websockets = None
+        if args.subscribers and websockets is None:
+            raise SystemExit("The websockets package is required for subscribers against a server")
+        ws_url = args.url.replace("http", "ws", 1).rstrip("/") + "/ws"
+        async with httpx.AsyncClient(base_url=args.url, timeout=30,
+                                     limits=httpx.Limits(max_connections=args.cashiers + 2)) as client:
+            return await run(args, client, lambda: websockets.connect(ws_url))
+
+    os.environ["POS_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+    # Importing the prediction stack in the background would skew the first seconds
+    os.environ.setdefault("POS_PREDICTION_WARMUP", "0")
+    import api_backend
+
+    app = api_backend.app
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver",
+                                     timeout=30) as client:
+            return await run(args, client, lambda: ASGIWebSocket(app, "/ws"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the POS API and report latency per endpoint.")
+    parser.add_argument("--url", help="Server to test (default: run the app in this process)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--cashiers", type=int, default=8, help="Concurrent checkout loops")
+    parser.add_argument("--basket-size", type=int, default=5, help="Most items per sale (1 to this many)")
+    parser.add_argument("--sensor-rate", type=float, default=2.0, help="Status readings per store per second")
+    parser.add_argument("--subscribers", type=int, default=10, help="WebSocket clients on /ws")
+    parser.add_argument("--stores", type=int, default=1, help="Stores to spread sales over")
+    parser.add_argument("--products", type=int, default=50, help="Products to create (in-process only)")
+    parser.add_argument("--drain", type=float, default=1.0, help="Seconds subscribers keep listening after load")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-baseline", metavar="PATH", help="Save the results as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="Fail if results regress against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed fractional slowdown in p50/p95 and drop in throughput")
+    parser.add_argument("--floor-ms", type=float, default=2.0,
+                        help="Latency increase always allowed, so fast endpoints don't fail on noise")
+    args = parser.parse_args()
+
+    recorder, elapsed = asyncio.run(main_async(args))
+    results = report(recorder, elapsed, args)
+    config = {name: getattr(args, name) for name in
+              ("url", "duration", "cashiers", "basket_size", "sensor_rate", "subscribers", "stores", "products")}
+
+    failed = False
+    if sum(recorder.errors.values()):
+        print(f"\n❌ {sum(recorder.errors.values())} requests failed")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"\nNote: baseline was recorded with {baseline.get('config')}")
+        regressions = compare(results, baseline, args.tolerance, args.floor_ms)
+        for regression in regressions:
+            print(f"❌ {regression}")
+        if not regressions:
+            print(f"\n✅ No regressions against {args.baseline}")
+        failed = failed or bool(regressions)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
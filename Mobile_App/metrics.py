@@ -0,0 +1,260 @@
+"""Process metrics in the Prometheus text format.
+
+Counters, histograms and gauges live in a module-level registry and are
+rendered by `render` for the /metrics endpoint. Gauges can be given a function
+that is called at scrape time, so values such as queue depths are read only
+when someone asks.
+
+`track_sql` counts the statements an engine runs and the time spent in them,
+in total and per request: the API's middleware opens a `RequestStats` with
+`request_stats` and SQL run on that request's behalf, in the event loop or in
+a worker thread, is added to it.
+"""
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+from sqlalchemy import event
+
+# Seconds; from a cached read to a slow report or model fit
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, function=None, **kwargs):
+        """`function`, when given, returns the value at scrape time: a number, or
+        a dict of label value tuples to numbers for a labelled gauge."""
+        super().__init__(*args, **kwargs)
+        self.function = function
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = (("le", format_value(float(bound))),)
+                yield f"{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(counts[-2])}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key)} {counts[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render():
+    return REGISTRY.render()
+
+
+class RequestStats:
+    """SQL work done on behalf of one request."""
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+@contextlib.contextmanager
+def request_stats():
+    """Collect the SQL of the code run within, including worker threads it starts."""
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        yield stats
+    finally:
+        current_request.reset(token)
+
+
+SQL_STATEMENTS = Counter("pos_sql_statements_total", "SQL statements executed", ["context"])
+SQL_SECONDS = Counter("pos_sql_seconds_total", "Time spent executing SQL statements", ["context"])
+
+
+def track_sql(engine):
+    """Count an engine's statements and their time, per request and in total."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+        label = "request" if stats is not None else "background"
+        SQL_STATEMENTS.inc(context=label)
+        SQL_SECONDS.inc(elapsed, context=label)
+
+
+REQUEST_SECONDS = Histogram("pos_request_seconds", "HTTP request latency", ["method", "route"])
+REQUESTS = Counter("pos_requests_total", "HTTP requests by response status", ["method", "route", "status"])
+REQUEST_SQL_STATEMENTS = Histogram("pos_request_sql_statements", "SQL statements run per HTTP request",
+                                   ["method", "route"], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+REQUEST_SQL_SECONDS = Histogram("pos_request_sql_seconds", "Time spent in SQL per HTTP request", ["method", "route"])
+
+
+class MetricsMiddleware:
+    """Time every HTTP request by route template, with its SQL work.
+
+    With a `profiler` (see profiler.py), requests that run past its threshold
+    are sampled too.
+    """
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sampling = self.profiler.start() if self.profiler else None
+        start = time.perf_counter()
+        with request_stats() as stats:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                elapsed = time.perf_counter() - start
+                # Label by route template so ids in paths don't each become a series
+                route = scope.get("route")
+                labels = {"method": scope["method"], "route": getattr(route, "path", "unmatched")}
+                REQUEST_SECONDS.observe(elapsed, **labels)
+                REQUESTS.inc(**labels, status=status)
+                REQUEST_SQL_STATEMENTS.observe(stats.statements, **labels)
+                REQUEST_SQL_SECONDS.observe(stats.sql_seconds, **labels)
+                if sampling is not None:
+                    self.profiler.finish(sampling, scope["method"], scope["path"], elapsed)
@@ -0,0 +1,89 @@
+"""Transactional outbox for broadcast events.
+
+Endpoints stage events with `enqueue_event` before committing, so an event
+exists if and only if its change was committed. The dispatcher in api_backend
+reads pending events in id order, hands them to the WebSocket manager and then
+marks them dispatched. An event is marked only after delivery, so a crash in
+between re-delivers it once its claim lease expires (at-least-once); clients
+dedupe on `seq`.
+"""
+import datetime
+import json
+
+from sqlalchemy import select, update, func
+
+from database_models import OutboxEvent
+
+
+def enqueue_event(db, channel, event):
+    """Stage an event in the caller's transaction."""
+    db.add(OutboxEvent(channel=channel, payload=json.dumps(event)))
+
+
+def to_message(row):
+    """Turn an outbox row into the event dict sent to clients, tagged with its sequence id."""
+    return {**json.loads(row.payload), "seq": row.id}
+
+
+def claim_pending(db, limit=500, lease=datetime.timedelta(seconds=30)):
+    """Claim the oldest pending events for this dispatcher.
+
+    Nothing is claimed while another dispatcher holds an unexpired lease, so
+    with several workers only one publishes at a time and events stay in
+    sequence order. A dispatcher that dies mid-batch lets its lease expire and
+    the events are claimed again.
+    """
+    now = datetime.datetime.utcnow()
+    leased = select(OutboxEvent.id).where(
+        OutboxEvent.dispatched_at.is_(None), OutboxEvent.claimed_until > now
+    ).exists()
+    oldest = select(OutboxEvent.id)\
+        .where(OutboxEvent.dispatched_at.is_(None))\
+        .order_by(OutboxEvent.id)\
+        .limit(limit)
+    rows = db.execute(
+        update(OutboxEvent)
+        .where(OutboxEvent.id.in_(oldest), ~leased)
+        .values(claimed_until=now + lease)
+        .returning(OutboxEvent.id, OutboxEvent.channel, OutboxEvent.payload)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def release(db, ids):
+    """Give up a claim without dispatching, so the events can be retried right away."""
+    db.query(OutboxEvent)\
+        .filter(OutboxEvent.id.in_(ids))\
+        .update({OutboxEvent.claimed_until: None}, synchronize_session=False)
+    db.commit()
+
+
+def mark_dispatched(db, ids):
+    db.query(OutboxEvent)\
+        .filter(OutboxEvent.id.in_(ids))\
+        .update({OutboxEvent.dispatched_at: datetime.datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+
+def pending_count(db):
+    return db.query(func.count(OutboxEvent.id)).filter(OutboxEvent.dispatched_at.is_(None)).scalar()
+
+
+def events_since(db, since, limit=1000):
+    """Get events after a sequence id, dispatched or not, for client replay."""
+    return db.query(OutboxEvent)\
+        .filter(OutboxEvent.id > since)\
+        .order_by(OutboxEvent.id)\
+        .limit(limit).all()
+
+
+def prune(db, retention):
+    """Delete dispatched events older than the retention period."""
+    cutoff = datetime.datetime.utcnow() - retention
+    deleted = db.query(OutboxEvent)\
+        .filter(OutboxEvent.dispatched_at.isnot(None), OutboxEvent.dispatched_at < cutoff)\
+        .delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -1,5 +1,8 @@
 # Sample program
 
+import json
+import sys
+
 import requests
 
 # Backend API URL
@@ -45,21 +48,28 @@ dummy_products = [
 ]
 
 
-def add_product(product):
-    """Send a request to the FastAPI backend to add a product."""
-    # In populate_db.py
-    #response = requests.post(f"{BASE_URL}/products/", json=product)
-    response = requests.post(f"{BASE_URL}/products/", params=product)
-    
-    if response.status_code == 200:
-        print(f"✅ Added product: {product['name']} (SKU: {product['sku']})")
-    else:
-        print(f"❌ Failed to add {product['name']}: {response.text}")
+def import_products(body, fmt):
+    """Send a catalog to the bulk import endpoint and report the result."""
+    response = requests.post(f"{BASE_URL}/products/import", params={"format": fmt}, data=body)
+    if response.status_code != 200:
+        print(f"❌ Import failed: {response.text}")
+        return
+    result = response.json()
+    print(f"✅ Imported {result['created']} new and {result['updated']} updated products, "
+          f"{result['repriced']} prices changed")
+    for error in result["errors"]:
+        print(f"❌ Line {error['line']} (SKU: {error['sku']}): {error['error']}")
 
 if __name__ == "__main__":
-    print("\n🚀 Populating database with dummy products...\n")
-    
-    for product in dummy_products:
-        add_product(product)
+    # python populate_db.py [catalog.csv | catalog.ndjson] imports a supplier catalog file instead
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+        print(f"\n🚀 Importing {path}...\n")
+        with open(path, "rb") as f:
+            # A file body is streamed rather than read into memory
+            import_products(f, "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+    else:
+        print("\n🚀 Populating database with dummy products...\n")
+        import_products("".join(json.dumps(product) + "\n" for product in dummy_products).encode(), "ndjson")
 
     print("\n✅ Database population complete! You can now see products in the POS system.\n")
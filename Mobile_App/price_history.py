@@ -0,0 +1,137 @@
+"""Append-only history of current prices.
+
+Every change to a current price, on Product (the default store) or StoreProduct
+(other stores), is appended to price_history by a session hook, whichever
+endpoint or background task made it. The rows of one flush go out as a single
+executemany in the same transaction as the change, so history and prices never
+disagree. Bulk INSERT ... SELECT paths, which the hook can't see, call
+`snapshot` instead.
+
+Two changes to the same price within one second keep the later one.
+"""
+import calendar
+import datetime
+
+from sqlalchemy import event, insert, select, literal, func, cast, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import attributes
+
+from database_models import Product, StoreProduct, PriceHistory, DEFAULT_STORE_ID
+
+
+def to_epoch(timestamp):
+    """Seconds since the epoch for a naive UTC or an aware datetime."""
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+def from_epoch(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch)
+
+
+def to_cents(price):
+    return int(round(price * 100))
+
+
+def cents_column(column):
+    return cast(func.round(column * 100), Integer)
+
+
+def record(connection, rows):
+    """Append {"store_id", "product_id", "epoch", "price_cents"} rows as one statement."""
+    if not rows:
+        return
+    stmt = sqlite_insert(PriceHistory)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['store_id', 'product_id', 'epoch'],
+        set_={'price_cents': stmt.excluded.price_cents}
+    )
+    connection.execute(stmt, rows)
+
+
+def price_changed(obj):
+    history = attributes.get_history(obj, 'current_price')
+    if not history.added:
+        return False
+    # A new row, or an update whose old value wasn't loaded, counts as a change
+    return not history.deleted or history.deleted[0] != history.added[0]
+
+
+def attach(session_factory):
+    """Hook a sessionmaker so every committed price change is appended to the history."""
+
+    @event.listens_for(session_factory, "after_flush")
+    def append_price_changes(session, flush_context):
+        epoch = to_epoch(datetime.datetime.utcnow())
+        rows = {}
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, Product):
+                key = (DEFAULT_STORE_ID, obj.id)
+            elif isinstance(obj, StoreProduct):
+                key = (obj.store_id, obj.product_id)
+            else:
+                continue
+            if obj.current_price is not None and price_changed(obj):
+                rows[key] = {"store_id": key[0], "product_id": key[1], "epoch": epoch,
+                             "price_cents": to_cents(obj.current_price)}
+        record(session.connection(), list(rows.values()))
+
+
+def snapshot(db, store_id=None, product_id=None):
+    """Append the current prices of a store and/or product, for changes made with bulk SQL.
+
+    With neither argument, snapshots every price at every store.
+    """
+    epoch = to_epoch(datetime.datetime.utcnow())
+    columns = ["store_id", "product_id", "epoch", "price_cents"]
+    if store_id in (None, DEFAULT_STORE_ID):
+        query = select(literal(DEFAULT_STORE_ID), Product.id, literal(epoch),
+                       cents_column(Product.current_price))
+        if product_id is not None:
+            query = query.where(Product.id == product_id)
+        db.execute(insert(PriceHistory).from_select(columns, query).prefix_with("OR REPLACE"))
+    if store_id != DEFAULT_STORE_ID:
+        query = select(StoreProduct.store_id, StoreProduct.product_id, literal(epoch),
+                       cents_column(StoreProduct.current_price))
+        if store_id is not None:
+            query = query.where(StoreProduct.store_id == store_id)
+        if product_id is not None:
+            query = query.where(StoreProduct.product_id == product_id)
+        db.execute(insert(PriceHistory).from_select(columns, query).prefix_with("OR REPLACE"))
+
+
+def price_as_of(db, product_id, at, store_id=DEFAULT_STORE_ID):
+    """Get the price in effect at a point in time, or None if there's no history that far back."""
+    cents = db.query(PriceHistory.price_cents)\
+        .filter(PriceHistory.store_id == store_id,
+                PriceHistory.product_id == product_id,
+                PriceHistory.epoch <= to_epoch(at))\
+        .order_by(PriceHistory.epoch.desc())\
+        .limit(1).scalar()
+    return cents / 100 if cents is not None else None
+
+
+def price_changes(db, product_ids=None, store_id=DEFAULT_STORE_ID, start=None, end=None):
+    """Get (product_id, epoch, price_cents) rows in (product, time) order.
+
+    When `start` is given, the change in effect at `start` is included too, so
+    the rows cover the whole range.
+    """
+    def scoped(query):
+        query = query.filter(PriceHistory.store_id == store_id)
+        if product_ids is not None:
+            query = query.filter(PriceHistory.product_id.in_(product_ids))
+        return query
+
+    query = scoped(db.query(PriceHistory.product_id, PriceHistory.epoch, PriceHistory.price_cents))
+    if start is not None:
+        query = query.filter(PriceHistory.epoch > to_epoch(start))
+    if end is not None:
+        query = query.filter(PriceHistory.epoch <= to_epoch(end))
+    rows = query.all()
+
+    if start is not None:
+        # SQLite returns the other columns from the row holding the max
+        rows += scoped(db.query(PriceHistory.product_id, func.max(PriceHistory.epoch), PriceHistory.price_cents))\
+            .filter(PriceHistory.epoch <= to_epoch(start))\
+            .group_by(PriceHistory.product_id).all()
+    return sorted(rows, key=lambda row: (row[0], row[1]))
@@ -0,0 +1,102 @@
+"""When time-based pricing rules turn on and off.
+
+`time_of_day` and `day_of_week` conditions are whole hours and days in a
+store's local time, so a rule can only flip at the start of a local hour.
+`plan_next_transition` steps through the coming local hours to find the first
+one at which any rule flips, and which (store, product) pairs it affects, so
+the API can sleep until then and reprice just those products.
+"""
+import datetime
+import json
+from zoneinfo import ZoneInfo
+
+TIME_RULE_TYPES = ('time_of_day', 'day_of_week')
+
+# A weekly rule flips at least once a week if it ever does
+LOOKAHEAD_HOURS = 8 * 24
+
+
+def rule_active(rule_type, condition, local_time):
+    """Check whether a time-based rule applies at a local wall-clock time."""
+    if rule_type == 'time_of_day':
+        # Example condition: {"start_hour": 14, "end_hour": 17}
+        return ('start_hour' in condition and 'end_hour' in condition and
+                condition['start_hour'] <= local_time.hour < condition['end_hour'])
+    if rule_type == 'day_of_week':
+        # Example condition: {"days": [0, 6]} (0=Monday, 6=Sunday)
+        return 'days' in condition and local_time.weekday() in condition['days']
+    raise ValueError(f"'{rule_type}' is not a time-based rule type")
+
+
+def local_time(zone, now=None):
+    """Get the wall-clock time in a timezone; `now` is an aware instant (default: the current time)."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.astimezone(zone)
+
+
+def next_flip(conditions, zone, now):
+    """Find the first local hour after `now` at which any condition changes state.
+
+    Args:
+        conditions: Dict of key -> (rule_type, condition dict)
+        zone: ZoneInfo of the store
+        now: Aware datetime
+
+    Returns:
+        (instant, keys that flip) with instant an aware UTC datetime, or (None, [])
+    """
+    hour = local_time(zone, now).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    state = {key: rule_active(rule_type, condition, hour) for key, (rule_type, condition) in conditions.items()}
+    for _ in range(LOOKAHEAD_HOURS):
+        hour += datetime.timedelta(hours=1)
+        flipped = []
+        for key, (rule_type, condition) in conditions.items():
+            active = rule_active(rule_type, condition, hour)
+            if active != state[key]:
+                state[key] = active
+                flipped.append(key)
+        if flipped:
+            return hour.replace(tzinfo=zone).astimezone(datetime.timezone.utc), flipped
+    return None, []
+
+
+def plan_next_transition(rules, stores, now):
+    """Find the next instant any active time-based rule flips at any store.
+
+    Args:
+        rules: Iterable of (product_id, rule_type, condition JSON string)
+        stores: Iterable of (store_id, timezone name)
+        now: Aware datetime
+
+    Returns:
+        (instant, sorted list of (store_id, product_id) to reprice), or (None, [])
+    """
+    # Rules often share a condition, so evaluate each distinct one once
+    products_by_condition = {}
+    conditions = {}
+    for product_id, rule_type, condition in rules:
+        key = (rule_type, condition)
+        if key not in conditions:
+            try:
+                conditions[key] = (rule_type, json.loads(condition))
+            except json.JSONDecodeError:
+                continue
+        products_by_condition.setdefault(key, set()).add(product_id)
+    if not conditions:
+        return None, []
+
+    stores_by_zone = {}
+    for store_id, timezone in stores:
+        stores_by_zone.setdefault(timezone or "UTC", []).append(store_id)
+
+    earliest, targets = None, set()
+    for timezone, store_ids in stores_by_zone.items():
+        instant, flipped = next_flip(conditions, ZoneInfo(timezone), now)
+        if instant is None or (earliest is not None and instant > earliest):
+            continue
+        if earliest is None or instant < earliest:
+            earliest, targets = instant, set()
+        targets.update((store_id, product_id)
+                       for key in flipped for product_id in products_by_condition[key]
+                       for store_id in store_ids)
+    return earliest, sorted(targets)
@@ -0,0 +1,100 @@
+"""Sampling profiler for individual slow requests, for debugging.
+
+Enabled with the POS_PROFILE_SLOW_MS environment variable. Each request arms a
+timer; if the request is still running when it fires, the timer thread samples
+the stacks of the process's busy threads until the request finishes. The
+samples are logged as collapsed stacks (the flame graph input format) and the
+most recent profiles are kept for the /debug/profiles endpoint.
+
+Stacks are sampled across the process, since a sync endpoint runs in whichever
+worker thread is free, so requests running at the same time show up in each
+other's profiles. Profile one request at a time when that matters.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger("pos.profiler")
+
+# Innermost frames in these files are threads waiting for work
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "base_events.py", "thread.py")
+
+
+def collapsed_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class Sampling(threading.Thread):
+    """Waits out the threshold, then samples stacks until stopped."""
+
+    def __init__(self, threshold, interval):
+        super().__init__(daemon=True)
+        self.threshold = threshold
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def run(self):
+        if self.stopped.wait(self.threshold):
+            return
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                self.stacks[collapsed_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms, interval_ms=5, keep=20, top=15):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.top = top
+        self.recent = collections.deque(maxlen=keep)
+
+    @classmethod
+    def from_environment(cls):
+        """Build a profiler when POS_PROFILE_SLOW_MS is set, else None."""
+        threshold = os.environ.get("POS_PROFILE_SLOW_MS")
+        if not threshold:
+            return None
+        return cls(float(threshold), float(os.environ.get("POS_PROFILE_INTERVAL_MS", 5)))
+
+    def start(self):
+        sampling = Sampling(self.threshold, self.interval)
+        sampling.start()
+        return sampling
+
+    def finish(self, sampling, method, path, duration):
+        """Stop sampling a request; records and logs a profile if it ran past the threshold."""
+        sampling.stop()
+        if not sampling.samples:
+            return None
+        profile = {
+            "method": method,
+            "path": path,
+            "duration_ms": round(duration * 1000, 1),
+            "samples": sampling.samples,
+            "interval_ms": self.interval * 1000,
+            "finished_at": time.time(),
+            "stacks": dict(sampling.stacks.most_common())
+        }
+        self.recent.append(profile)
+        logger.warning("Slow request %s %s took %.0fms; top stacks of %d samples:\n%s",
+                       method, path, duration * 1000, sampling.samples,
+                       "\n".join(f"{count:>6} {stack}" for stack, count in sampling.stacks.most_common(self.top)))
+        return profile
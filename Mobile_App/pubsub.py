@@ -0,0 +1,182 @@
+"""Pub/sub backends that carry WebSocket broadcasts to every worker process.
+
+Each worker only holds its own WebSocket connections. Events are published to
+a backend, and every worker runs the backend's `run` loop to receive them and
+send them to its local connections. Messages are batches of events on a
+channel ('stock', 'prices', ...); every backend delivers the messages of a
+channel in the order they were published.
+
+Pick one with the POS_PUBSUB environment variable:
+
+    memory             In-process only (default; a single worker)
+    db                 Polls a shared table in the application database
+    redis://host:port  Redis PUBLISH/PSUBSCRIBE (needs the redis package)
+"""
+import asyncio
+import datetime
+import json
+import logging
+
+from database_models import BroadcastMessage
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger("pos.pubsub")
+
+
+class InProcessPubSub:
+    """Deliver published messages straight to this process's subscribers."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    async def publish(self, channel, events):
+        await self.queue.put((channel, events))
+
+    async def run(self, deliver):
+        while True:
+            channel, events = await self.queue.get()
+            await deliver(channel, events)
+
+
+class DatabasePubSub:
+    """Share messages through the broadcast_messages table, polled by every worker.
+
+    Needs nothing beyond the database the workers already share. Rows are read
+    in id order, which is also publish order, so channels stay ordered. Each
+    worker starts from the newest row, and old rows are pruned as it goes.
+    """
+
+    def __init__(self, session_factory, poll_interval=0.05, batch_size=500,
+                 retention=datetime.timedelta(minutes=10), prune_interval=60.0):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.wakeup = asyncio.Event()
+
+    def _insert(self, channel, events):
+        db = self.session_factory()
+        try:
+            db.add(BroadcastMessage(channel=channel, payload=json.dumps(events)))
+            db.commit()
+        finally:
+            db.close()
+
+    def _latest_id(self):
+        db = self.session_factory()
+        try:
+            return db.query(BroadcastMessage.id).order_by(BroadcastMessage.id.desc()).limit(1).scalar() or 0
+        finally:
+            db.close()
+
+    def _read_after(self, last_id):
+        db = self.session_factory()
+        try:
+            return db.query(BroadcastMessage.id, BroadcastMessage.channel, BroadcastMessage.payload)\
+                .filter(BroadcastMessage.id > last_id)\
+                .order_by(BroadcastMessage.id)\
+                .limit(self.batch_size).all()
+        finally:
+            db.close()
+
+    def _prune(self):
+        db = self.session_factory()
+        try:
+            cutoff = datetime.datetime.utcnow() - self.retention
+            db.query(BroadcastMessage)\
+                .filter(BroadcastMessage.created_at < cutoff)\
+                .delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def publish(self, channel, events):
+        await asyncio.to_thread(self._insert, channel, events)
+        self.wakeup.set()  # Deliver locally without waiting for the next poll
+
+    async def run(self, deliver):
+        # A busy database ("database is locked") is expected under load, so
+        # failures are logged and retried; the reader must never stop
+        while True:
+            try:
+                last_id = await asyncio.to_thread(self._latest_id)
+                break
+            except Exception:
+                logger.exception("Reading the latest broadcast message failed; retrying")
+                await asyncio.sleep(self.poll_interval)
+        loop = asyncio.get_running_loop()
+        next_prune = loop.time() + self.prune_interval
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                rows = await asyncio.to_thread(self._read_after, last_id)
+            except Exception:
+                logger.exception("Reading broadcast messages after %s failed; retrying", last_id)
+                continue
+            for row in rows:
+                try:
+                    await deliver(row.channel, json.loads(row.payload))
+                except Exception:
+                    logger.exception("Delivering broadcast message %s failed", row.id)
+                last_id = row.id
+            if loop.time() >= next_prune:
+                next_prune = loop.time() + self.prune_interval
+                try:
+                    await asyncio.to_thread(self._prune)
+                except Exception:
+                    logger.exception("Pruning broadcast messages failed")
+
+
+class RedisPubSub:
+    """Share messages through Redis pub/sub.
+
+    Redis delivers the messages of one channel in publish order. `client` is
+    anything with the redis.asyncio interface, so a local fake can stand in.
+    """
+
+    def __init__(self, client, prefix="pos:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        if redis_asyncio is None:
+            raise RuntimeError("The redis package is required for the Redis pub/sub backend")
+        return cls(redis_asyncio.from_url(url), **kwargs)
+
+    async def publish(self, channel, events):
+        await self.client.publish(self.prefix + channel, json.dumps(events))
+
+    async def run(self, deliver):
+        pubsub = self.client.pubsub()
+        await pubsub.psubscribe(self.prefix + "*")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                await deliver(channel[len(self.prefix):], json.loads(message["data"]))
+        finally:
+            await pubsub.close()
+
+
+def create_backend(spec, session_factory):
+    """Build the backend named by a POS_PUBSUB value."""
+    if spec in (None, "", "memory"):
+        return InProcessPubSub()
+    if spec == "db":
+        return DatabasePubSub(session_factory)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPubSub.from_url(spec)
+    raise ValueError(f"Unknown pub/sub backend '{spec}'")
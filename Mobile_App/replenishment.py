@@ -0,0 +1,172 @@
+"""Replenishment planning: when each product runs out and how much to reorder.
+
+`plan_replenishment` plans the whole catalog at once. It forecasts daily
+demand for every product over the horizon, then derives stockout dates,
+reorder points and order quantities with array operations over all products
+together. The result replaces the replenishment_plan table in one
+transaction, so pages read a precomputed plan instead of forecasting per
+request.
+
+Demand comes from the sales prediction model when it is trained, and
+otherwise from the average sales of the same weekday over the last
+HISTORY_DAYS. Either way the rollup counts sales at every store, while the
+stock planned against is the default store's.
+
+Policy, per product with lead time L days (order-up-to with daily review):
+
+    safety stock   = SERVICE_Z * sd(daily sales) * sqrt(L)
+    reorder point  = forecast demand over L days + safety stock
+    order-up-to    = forecast demand over L + REVIEW_DAYS days + safety stock
+
+An order is due when stock is at or below the reorder point, for the
+difference up to the order-up-to level.
+"""
+import datetime
+import math
+
+import numpy as np
+from sqlalchemy import insert
+
+from database_models import Product, ReplenishmentPlan, SalesRollup
+
+HISTORY_DAYS = 28
+REVIEW_DAYS = 7
+MAX_HORIZON_DAYS = 90
+# One-sided z for a 95% chance of not running out during the lead time
+SERVICE_Z = 1.65
+
+
+def sales_history(db, product_ids, start):
+    """Daily units (products x HISTORY_DAYS) and share of days sold per hour (products x 24)
+    over the HISTORY_DAYS days before `start`."""
+    index = {product_id: i for i, product_id in enumerate(product_ids)}
+    first_day = start.date() - datetime.timedelta(days=HISTORY_DAYS)
+    rows = db.query(SalesRollup.product_id, SalesRollup.day, SalesRollup.hour, SalesRollup.quantity)\
+             .filter(SalesRollup.day >= first_day, SalesRollup.day < start.date(), SalesRollup.quantity > 0).all()
+
+    daily = np.zeros((len(product_ids), HISTORY_DAYS))
+    hour_days = np.zeros((len(product_ids), 24))
+    if rows:
+        products, days, hours, quantities = zip(*rows)
+        known = np.array([p in index for p in products])
+        rows_index = np.array([index.get(p, 0) for p in products])[known]
+        day_index = np.array([(d - first_day).days for d in days])[known]
+        np.add.at(daily, (rows_index, day_index), np.array(quantities, dtype=float)[known])
+        np.add.at(hour_days, (rows_index, np.array(hours)[known]), 1)
+    return daily, hour_days / HISTORY_DAYS
+
+
+def weekday_average(daily, start, days):
+    """Forecast each day as the product's mean sales on that weekday in `daily`."""
+    history_weekdays = (start.date() - datetime.timedelta(days=HISTORY_DAYS)).weekday() + np.arange(HISTORY_DAYS)
+    means = np.stack([daily[:, history_weekdays % 7 == k].mean(axis=1) for k in range(7)], axis=1)
+    return means[:, (start.weekday() + np.arange(days)) % 7]
+
+
+def plan(stock, lead_times, demand, daily_sd):
+    """Stockouts and orders for all products from their daily demand forecasts.
+
+    Args:
+        stock: Units on hand per product
+        lead_times: Lead time in days per product
+        demand: Forecast units per product per day (products x horizon days)
+        daily_sd: Standard deviation of each product's daily sales
+
+    Returns:
+        Dict of per-product arrays: days_of_cover (nan for no demand),
+        lead_time_demand, safety_stock, reorder_point, reorder_quantity
+    """
+    n, horizon = demand.shape
+    rows = np.arange(n)
+    cumulative = np.cumsum(demand, axis=1)
+    # Demand over the first k days, for any k from 0 to the horizon
+    through = np.concatenate([np.zeros((n, 1)), cumulative], axis=1)
+
+    # First day whose cumulative demand exceeds the stock, interpolated within the day
+    exceeds = cumulative > stock[:, None]
+    runs_out = exceeds.any(axis=1)
+    day = np.argmax(exceeds, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        within = day + (stock - through[rows, day]) / demand[rows, day]
+        # Past the horizon, extrapolate at the average rate
+        rate = cumulative[:, -1] / horizon
+        beyond = horizon + (stock - cumulative[:, -1]) / rate
+    days_of_cover = np.where(runs_out, within, np.where(rate > 0, beyond, np.nan))
+    days_of_cover = np.where(stock <= 0, 0.0, days_of_cover)
+
+    lead = np.clip(lead_times, 0, horizon)
+    lead_time_demand = through[rows, lead]
+    safety_stock = SERVICE_Z * daily_sd * np.sqrt(lead)
+    reorder_point = lead_time_demand + safety_stock
+    order_up_to = through[rows, np.clip(lead + REVIEW_DAYS, 0, horizon)] + safety_stock
+    reorder_quantity = np.where((stock <= reorder_point) & (order_up_to > stock),
+                                np.ceil(order_up_to - stock - 1e-9), 0)
+    return {
+        "days_of_cover": days_of_cover,
+        "lead_time_demand": lead_time_demand,
+        "safety_stock": safety_stock,
+        "reorder_point": reorder_point,
+        "reorder_quantity": reorder_quantity.astype(int)
+    }
+
+
+def plan_replenishment(db, model=None, now=None):
+    """Plan every product and replace the stored plan. Commits.
+
+    Args:
+        model: Trained SalesPredictionModel to forecast with, or None to
+            forecast from recent sales by weekday
+
+    Returns:
+        Summary dict of the run
+    """
+    now = now or datetime.datetime.utcnow()
+    start = datetime.datetime.combine(now.date(), datetime.time())
+    products = db.query(Product.id, Product.current_price, Product.stock_quantity, Product.lead_time_days)\
+                 .order_by(Product.id).all()
+    ids = [p.id for p in products]
+    stock = np.array([p.stock_quantity or 0 for p in products], dtype=float)
+    lead_times = np.array([p.lead_time_days for p in products], dtype=int)
+    horizon = int(min(max(lead_times.max(initial=0), 1) + REVIEW_DAYS, MAX_HORIZON_DAYS))
+
+    daily, hour_weights = sales_history(db, ids, start)
+    if model is not None and len(ids):
+        demand = model.forecast_demand([(p.id, p.current_price) for p in products], hour_weights, start, horizon)
+        source = "model"
+    else:
+        demand = weekday_average(daily, start, horizon)
+        source = "history"
+    result = plan(stock, lead_times, demand, daily.std(axis=1, ddof=1))
+
+    rows = []
+    for i, product_id in enumerate(ids):
+        cover = result["days_of_cover"][i]
+        stockout = None if math.isnan(cover) else now.date() + datetime.timedelta(days=int(cover))
+        rows.append({
+            "product_id": product_id,
+            "stock_quantity": int(stock[i]),
+            "lead_time_days": int(lead_times[i]),
+            "daily_demand": float(demand[i].mean()),
+            "lead_time_demand": float(result["lead_time_demand"][i]),
+            "safety_stock": float(result["safety_stock"][i]),
+            "reorder_point": float(result["reorder_point"][i]),
+            "reorder_quantity": int(result["reorder_quantity"][i]),
+            "days_of_cover": None if math.isnan(cover) else float(cover),
+            "stockout_date": stockout,
+            "reorder_by": None if stockout is None else max(stockout - datetime.timedelta(days=int(lead_times[i])), now.date()),
+            "forecast_source": source,
+            "planned_at": now
+        })
+
+    db.query(ReplenishmentPlan).delete()
+    if rows:
+        db.execute(insert(ReplenishmentPlan), rows)
+    db.commit()
+    return {
+        "products": len(rows),
+        "reorder": int((result["reorder_quantity"] > 0).sum()),
+        "stockouts_within_lead_time": int((result["days_of_cover"] <= lead_times).sum()),
+        "horizon_days": horizon,
+        "forecast_source": source,
+        "planned_at": now
+    }
@@ -0,0 +1,265 @@
+"""What-if simulation of pricing rules over past store conditions.
+
+`simulate_rule_sets` replays an hourly timeline of a store's history, with
+each hour's local time and weekday, its line length and vacancy rate as of the
+start of the hour, and each product's stock then. Every rule is evaluated for
+all hours at once as an array mask, so a rule set over a year is a handful of
+array operations per rule rather than 8760 calls to calculate_dynamic_price.
+
+Each rule set prices the affected products hour by hour: the base price less
+the active discounts, floored as the API floors it. The hours in which a
+product actually sold (the sales rollup) are then re-priced. The quantity
+sold responds through the demand model:
+- q * (new price / old price) ^ elasticity for products with an elasticity
+  fit (elasticity.py);
+- otherwise, the forest's predicted quantity at the new price over its
+  prediction at the old one, when it is trained;
+- otherwise, no response.
+Results are compared with the currently active rules replayed the same way.
+
+Approximations:
+- Hours without sales stay without sales.
+- Profit group adjustments are not applied.
+- Current base and cost prices are used throughout.
+- Past stock is the current stock plus everything sold since, as restocks
+  are not recorded.
+- The rollup counts sales at all stores.
+"""
+import collections
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+
+from database_models import (PricingRule, Product, SalesRollup, StoreProduct, StoreStatus, StoreStatusHistory,
+                             DEFAULT_STORE_ID)
+import elasticity
+
+# Fitted elasticities outside this range are treated as noise and clipped
+ELASTICITY_RANGE = (-5.0, 0.0)
+# As floor_price in the API
+MIN_MARKUP = 1.05
+
+
+def status_timeline(db, store_id, hours):
+    """(vacancy_rate, line_length) arrays as of the start of each hour; 0 before the first reading."""
+    start = hours[0].to_pydatetime()
+    end = hours[-1].to_pydatetime() + datetime.timedelta(hours=1)
+    readings = []
+    # Readings past their retention survive as minute and hour averages
+    for table, time, vacancy, line in (
+            (StoreStatus, StoreStatus.timestamp, StoreStatus.vacancy_rate, StoreStatus.line_length),
+            (StoreStatusHistory, StoreStatusHistory.bucket_start, StoreStatusHistory.vacancy_avg,
+             StoreStatusHistory.line_avg)):
+        query = db.query(time, vacancy, line).filter(table.store_id == store_id)
+        # The status carried into the first hour, then the window itself
+        readings += query.filter(time < start).order_by(time.desc()).limit(1).all()
+        readings += query.filter(time >= start, time < end).all()
+    readings.sort(key=lambda r: r[0])
+    if not readings:
+        return np.zeros(len(hours)), np.zeros(len(hours))
+
+    times = np.array([r[0] for r in readings], dtype='datetime64[ns]')
+    vacancy = np.array([r[1] or 0 for r in readings], dtype=float)
+    line = np.array([r[2] or 0 for r in readings], dtype=float)
+    latest = np.searchsorted(times, hours.values, side='right') - 1
+    seen = latest >= 0
+    latest = np.maximum(latest, 0)
+    return np.where(seen, vacancy[latest], 0.0), np.where(seen, line[latest], 0.0)
+
+
+def demand_response(db, product_ids, model, row, sale_times, actual_price):
+    """How each product's demand responds to price: a function from the new
+    price of every sale entry to the factor on its quantity, and the model
+    used per product."""
+    fits = elasticity.fits(db, product_ids)
+    slopes = np.zeros(len(product_ids))
+    models = {}
+    forest_products = []
+    for i, product_id in enumerate(product_ids):
+        fit = fits[product_id]
+        if fit.elasticity is not None and fit.observations >= elasticity.MIN_OBSERVATIONS:
+            slopes[i] = np.clip(fit.elasticity, *ELASTICITY_RANGE)
+            models[product_id] = "elasticity"
+        elif model is not None:
+            forest_products.append(i)
+            models[product_id] = "forest"
+        else:
+            models[product_id] = "none"
+
+    ids = np.array(product_ids)
+    by_forest = np.isin(row, forest_products)
+    if by_forest.any():
+        forest_rows = (ids[row[by_forest]], sale_times[by_forest])
+        predicted_actual = np.clip(model.predict_rows(*forest_rows, actual_price[by_forest]), 0, None)
+
+    def factor(price):
+        ratio = np.divide(price, actual_price, out=np.ones_like(price), where=actual_price > 0)
+        result = ratio ** slopes[row]
+        if by_forest.any():
+            predicted = np.clip(model.predict_rows(*forest_rows, price[by_forest]), 0, None)
+            result[by_forest] = np.divide(predicted, predicted_actual, out=np.ones_like(predicted),
+                                          where=predicted_actual > 1e-9)
+        return result
+
+    return {"factor": factor, "models": models}
+
+
+def totals(product_ids, products, row, units, price, cost, discounted_hours):
+    """Revenue, profit and units in total and per product."""
+    n = len(product_ids)
+    product_units = np.bincount(row, weights=units, minlength=n)
+    product_revenue = np.bincount(row, weights=units * price, minlength=n)
+    product_profit = product_revenue - product_units * cost
+    return {
+        "revenue": round(float(product_revenue.sum()), 2),
+        "profit": round(float(product_profit.sum()), 2),
+        "units": round(float(product_units.sum()), 1),
+        "products": [
+            {
+                "product_id": product_id,
+                "name": products[product_id].name,
+                "units": round(float(product_units[i]), 1),
+                "revenue": round(float(product_revenue[i]), 2),
+                "profit": round(float(product_profit[i]), 2),
+                "average_price": round(float(product_revenue[i] / product_units[i]), 2) if product_units[i] > 0 else None,
+                "discounted_hours": int(discounted_hours[i])
+            }
+            for i, product_id in enumerate(product_ids)
+        ]
+    }
+
+
+def rule_mask(rule_type, condition, timeline, stock):
+    """Hours in which a rule applies, matching calculate_dynamic_price.
+
+    Args:
+        timeline: Dict of per-hour arrays: local_hour, weekday, vacancy_rate, line_length
+        stock: The product's stock per hour
+    """
+    if rule_type == 'time_of_day':
+        if 'start_hour' in condition and 'end_hour' in condition:
+            hour = timeline['local_hour']
+            return (condition['start_hour'] <= hour) & (hour < condition['end_hour'])
+    elif rule_type == 'day_of_week':
+        if 'days' in condition:
+            return np.isin(timeline['weekday'], condition['days'])
+    elif rule_type == 'stock_level':
+        if 'min_stock' in condition and 'max_stock' in condition:
+            return (condition['min_stock'] <= stock) & (stock <= condition['max_stock'])
+    elif rule_type == 'line_length':
+        if 'min_length' in condition:
+            return timeline['line_length'] >= condition['min_length']
+    elif rule_type == 'vacancy_rate':
+        if 'min_rate' in condition:
+            return timeline['vacancy_rate'] >= condition['min_rate']
+    return np.zeros(len(timeline['local_hour']), dtype=bool)
+
+
+def simulate_rule_sets(db, rule_sets, store_id, zone, start, end, model=None):
+    """Project revenue and profit of each rule set over [start, end).
+
+    Args:
+        rule_sets: List of {"name", "rules": [(product_id, rule_type, condition dict,
+            discount_percentage)], "replace_active"}
+        zone: The store's ZoneInfo, for time-based rules
+        start, end: Naive UTC midnights
+        model: Trained SalesPredictionModel for products without an
+            elasticity fit, or None
+
+    Returns:
+        Dict with the actual sales and the projections of the current rules
+        ("baseline") and of each rule set, over the products the rule sets touch
+    """
+    product_ids = sorted({rule[0] for rule_set in rule_sets for rule in rule_set["rules"]})
+    index = {product_id: i for i, product_id in enumerate(product_ids)}
+    n = len(product_ids)
+
+    active = collections.defaultdict(list)
+    for rule in db.query(PricingRule).filter(PricingRule.is_active == True, PricingRule.product_id.in_(product_ids)):
+        try:
+            condition = json.loads(rule.condition)
+        except json.JSONDecodeError:
+            continue
+        active[rule.product_id].append((rule.product_id, rule.rule_type, condition, rule.discount_percentage))
+
+    products = {p.id: p for p in db.query(Product).filter(Product.id.in_(product_ids))}
+    base = np.array([products[p].base_price for p in product_ids])
+    cost = np.array([products[p].cost_price for p in product_ids])
+    if store_id == DEFAULT_STORE_ID:
+        current_stock = {p: products[p].stock_quantity or 0 for p in product_ids}
+    else:
+        current_stock = dict(db.query(StoreProduct.product_id, StoreProduct.stock_quantity)
+                             .filter(StoreProduct.store_id == store_id, StoreProduct.product_id.in_(product_ids)).all())
+
+    hours = pd.date_range(start, end, freq='h', inclusive='left')
+    local = hours.tz_localize('UTC').tz_convert(zone)
+    vacancy, line = status_timeline(db, store_id, hours)
+    timeline = {"local_hour": local.hour.values, "weekday": local.dayofweek.values,
+                "vacancy_rate": vacancy, "line_length": line}
+
+    # Sales in the window, one entry per (product, hour) sold in
+    sales = db.query(SalesRollup.product_id, SalesRollup.day, SalesRollup.hour, SalesRollup.quantity, SalesRollup.revenue)\
+              .filter(SalesRollup.product_id.in_(product_ids), SalesRollup.quantity > 0,
+                      SalesRollup.day >= start.date(), SalesRollup.day < end.date()).all()
+    later = dict(db.query(SalesRollup.product_id, func.sum(SalesRollup.quantity))
+                 .filter(SalesRollup.product_id.in_(product_ids), SalesRollup.day >= end.date())
+                 .group_by(SalesRollup.product_id).all())
+    if sales:
+        sold_product, days, sold_hour, quantity, revenue = (np.array(column) for column in zip(*sales))
+        row = np.array([index[p] for p in sold_product])
+        day_offset = (days.astype('datetime64[D]') - np.datetime64(start.date(), 'D')).astype(int)
+        column = day_offset * 24 + sold_hour.astype(int)
+        quantity, revenue = quantity.astype(float), revenue.astype(float)
+    else:
+        row = column = np.zeros(0, dtype=int)
+        quantity = revenue = np.zeros(0)
+    actual_price = np.divide(revenue, quantity, out=np.zeros_like(revenue), where=quantity > 0)
+
+    # Stock at the start of each hour: today's stock plus everything sold since
+    sold = np.zeros((n, len(hours)))
+    np.add.at(sold, (row, column), quantity)
+    sold_since = np.flip(np.cumsum(np.flip(sold, axis=1), axis=1), axis=1)
+    stock = np.array([current_stock.get(p, 0) + later.get(p, 0) for p in product_ids], dtype=float)[:, None] + sold_since
+
+    response = demand_response(db, product_ids, model, row, hours.values[column], actual_price)
+
+    def project(rules):
+        discount = np.zeros((n, len(hours)))
+        for product_id, rule_type, condition, percentage in rules:
+            i = index[product_id]
+            discount[i] += percentage * rule_mask(rule_type, condition, timeline, stock[i])
+        price = np.where(discount > 0, base[:, None] * (1 - discount / 100), base[:, None])
+        price = np.round(np.maximum(price, cost[:, None] * MIN_MARKUP), 2)
+        sale_price = price[row, column]
+        units = quantity * response["factor"](sale_price)
+        return totals(product_ids, products, row, units, sale_price, cost, (discount > 0).sum(axis=1))
+
+    baseline = project([rule for p in product_ids for rule in active[p]])
+    projections = []
+    for rule_set in rule_sets:
+        rules = list(rule_set["rules"])
+        if not rule_set.get("replace_active"):
+            rules += [rule for p in product_ids for rule in active[p]]
+        result = project(rules)
+        projections.append({
+            "name": rule_set["name"],
+            **result,
+            "revenue_change": round(result["revenue"] - baseline["revenue"], 2),
+            "profit_change": round(result["profit"] - baseline["profit"], 2)
+        })
+
+    actual = totals(product_ids, products, row, quantity, actual_price, cost, np.zeros(n, dtype=int))
+    return {
+        "store_id": store_id,
+        "start": start,
+        "end": end,
+        "hours": len(hours),
+        "sales_hours": len(row),
+        "demand_models": response["models"],
+        "actual": {k: actual[k] for k in ("revenue", "profit", "units")},
+        "baseline": baseline,
+        "rule_sets": projections
+    }
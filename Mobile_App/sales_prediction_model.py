@@ -26,51 +26,64 @@ class SalesPredictionModel:
         """Preprocess sales data for training or prediction.
         
         Args:
-            data: DataFrame with columns ['date', 'product_id', 'quantity', 'price', etc.]
+            data: DataFrame with columns ['date', 'product_id', 'quantity', 'price', etc.],
+                e.g. hourly buckets from the sales rollup
         
         Returns:
             X: Feature matrix
             y: Target values (if available)
         """
-        # Extract date features
-        df = data.copy()
-        df['date'] = pd.to_datetime(df['date'])
-        df['day_of_week'] = df['date'].dt.dayofweek
-        df['month'] = df['date'].dt.month
-        df['day'] = df['date'].dt.day
-        df['hour'] = df['date'].dt.hour
+        df = self.date_features(data)
         
         # Group by date and product to get daily sales
-        daily_sales = df.groupby(['date', 'product_id']).agg({
-            'quantity': 'sum',
+        aggregations = {
             'price': 'mean',
             'day_of_week': 'first',
             'month': 'first',
             'day': 'first',
             'hour': 'first'
-        }).reset_index()
+        }
+        # Prediction inputs have no quantity column
+        if 'quantity' in df.columns:
+            aggregations['quantity'] = 'sum'
+        daily_sales = df.groupby(['date', 'product_id']).agg(aggregations).reset_index()
+        X = self.encode(daily_sales)
+        
+        if 'quantity' in daily_sales.columns:
+            y = daily_sales['quantity']
+            return X, y
+        else:
+            return X
+    
+    def date_features(self, data):
+        """Add day_of_week, month, day and hour columns from the date column."""
+        df = data.copy()
+        df['date'] = pd.to_datetime(df['date'])
+        df['day_of_week'] = df['date'].dt.dayofweek
+        df['month'] = df['date'].dt.month
+        df['day'] = df['date'].dt.day
+        df['hour'] = df['date'].dt.hour
+        return df
+    
+    def encode(self, rows):
+        """Build the feature matrix from rows with date features, fitting the encoder when untrained."""
+        rows = rows.reset_index(drop=True)
         
         # One-hot encode categorical features
         categorical_features = ['product_id', 'day_of_week', 'month']
         
         if not self.trained:
-            self.encoder = OneHotEncoder(sparse=False, handle_unknown='ignore')
-            encoded_features = self.encoder.fit_transform(daily_sales[categorical_features])
+            self.encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
+            encoded_features = self.encoder.fit_transform(rows[categorical_features])
         else:
-            encoded_features = self.encoder.transform(daily_sales[categorical_features])
+            encoded_features = self.encoder.transform(rows[categorical_features])
         
         encoded_df = pd.DataFrame(encoded_features, 
                                  columns=self.encoder.get_feature_names_out(categorical_features))
         
         # Combine encoded features with numerical features
         numerical_features = ['day', 'hour', 'price']
-        X = pd.concat([encoded_df, daily_sales[numerical_features]], axis=1)
-        
-        if 'quantity' in daily_sales.columns:
-            y = daily_sales['quantity']
-            return X, y
-        else:
-            return X
+        return pd.concat([encoded_df, rows[numerical_features]], axis=1)
     
     def train(self, training_data):
         """Train the model on historical sales data.
@@ -102,7 +115,8 @@ class SalesPredictionModel:
         if not self.trained:
             raise ValueError("Model needs to be trained before making predictions")
         
-        X = self.preprocess_data(features)
+        # Ignore any observed quantities so only the feature matrix is returned
+        X = self.preprocess_data(features.drop(columns=['quantity'], errors='ignore'))
         return self.model.predict(X)
     
     def predict_future_sales(self, product_id, days_ahead=7, base_price=None, historical_data=None):
@@ -156,6 +170,77 @@ class SalesPredictionModel:
         
         return result_df
     
+    def forecast_demand(self, products, hour_weights, start, days_ahead=7, batch_cells=20_000_000):
+        """Forecast expected units sold per day for many products in one pass.
+        
+        The model predicts the quantity sold in an hour in which a product
+        sells, since the rollup only has hours with sales. Each (product, hour
+        of day) prediction is weighted by how often the product sold in that
+        hour, and the hours of a day are summed.
+        
+        Args:
+            products: List of (product_id, price)
+            hour_weights: Array (products x 24) of the share of days each
+                product sold in each hour; hours weighted 0 are not predicted
+            start: Midnight of the first forecast day
+            days_ahead: Number of days to forecast
+            batch_cells: See predict_rows
+        
+        Returns:
+            Array (products x days) of expected units
+        """
+        if not self.trained:
+            raise ValueError("Model needs to be trained before making predictions")
+        
+        ids = np.array([p[0] for p in products])
+        prices = np.array([p[1] for p in products], dtype=float)
+        product_index, hours = np.nonzero(hour_weights)
+        
+        # One row per (product, hour, day) with a nonzero weight
+        pair = np.repeat(np.arange(len(product_index)), days_ahead)
+        day = np.tile(np.arange(days_ahead), len(product_index))
+        rows_product = product_index[pair]
+        dates = (np.datetime64(start, 'h') + day * np.timedelta64(24, 'h')
+                 + hours[pair] * np.timedelta64(1, 'h')).astype('datetime64[ns]')
+        
+        quantity = self.predict_rows(ids[rows_product], dates, prices[rows_product], batch_cells)
+        
+        demand = np.zeros((len(products), days_ahead))
+        weights = hour_weights[rows_product, hours[pair]]
+        np.add.at(demand, (rows_product, day), np.clip(quantity, 0, None) * weights)
+        return demand
+    
+    def predict_rows(self, product_ids, dates, prices, batch_cells=20_000_000):
+        """Predict the hourly quantity for each (product, hour, price) row, in row order.
+        
+        Unlike `predict`, rows are not grouped, so the same product and hour
+        can be predicted at several prices.
+        
+        Args:
+            product_ids, dates, prices: Equal-length arrays, one entry per row
+            batch_cells: Bound on the size of the dense feature matrix
+                (rows x features) built per batch
+        
+        Returns:
+            Array of predicted quantities
+        """
+        if not self.trained:
+            raise ValueError("Model needs to be trained before making predictions")
+        
+        # One-hot product columns make the features as wide as the catalog
+        features = len(self.encoder.get_feature_names_out()) + 3
+        batch = max(1000, batch_cells // features)
+        quantity = np.empty(len(product_ids))
+        for low in range(0, len(product_ids), batch):
+            high = low + batch
+            rows = pd.DataFrame({
+                'date': dates[low:high],
+                'product_id': product_ids[low:high],
+                'price': prices[low:high]
+            })
+            quantity[low:high] = self.model.predict(self.encode(self.date_features(rows)))
+        return quantity
+    
     def optimize_price(self, product_id, historical_data, price_range, cost_price):
         """Find optimal price for maximum profit.
         
@@ -191,6 +276,118 @@ class SalesPredictionModel:
         
         return optimal_price, best_profit
     
+    def optimize_group_prices(self, products, hour_weights, min_profit, start, days_ahead=7, price_points=41):
+        """Jointly choose prices for the products of a profit group for maximum expected profit.
+        
+        Demand for every product at every candidate price is forecast over
+        all hours of the coming days in one batch, weighting each hour as
+        `forecast_demand` does. A price vector is then picked for the group
+        that maximizes total expected profit while the unit margins
+        (price - cost) add up to at least `min_profit`.
+        
+        Args:
+            products: List of (product_id, cost_price, min_price, max_price)
+            hour_weights: Array (products x 24) of the share of days each
+                product sold in each hour; see `forecast_demand`
+            min_profit: Minimum sum of unit margins over the group
+            start: Midnight of the first forecast day
+            days_ahead: Number of days of demand to optimize over
+            price_points: Candidate prices per product, evenly spaced in cents
+        
+        Returns:
+            Dict with the chosen "prices" and expected "quantities" over the
+            days (per product), "expected_profit" over the days, "unit_profit",
+            "meets_requirement" and the number of price vectors "evaluated"
+        """
+        if not self.trained:
+            raise ValueError("Model needs to be trained before making predictions")
+        
+        ids = np.array([p[0] for p in products])
+        costs = np.array([p[1] for p in products], dtype=float)
+        low = np.array([p[2] for p in products], dtype=float)
+        high = np.maximum(np.array([p[3] for p in products], dtype=float), low)
+        # Candidates in whole cents, never below a product's floor
+        grid = np.ceil(np.linspace(low, high, price_points).T * 100 - 1e-6) / 100
+        
+        # One row per (product, hour) with a nonzero weight, candidate price and day
+        product_index, hours = np.nonzero(hour_weights)
+        n, k, d = len(products), price_points, days_ahead
+        pair = np.repeat(np.arange(len(product_index)), k * d)
+        candidate = np.tile(np.repeat(np.arange(k), d), len(product_index))
+        day = np.tile(np.arange(d), len(product_index) * k)
+        rows_product = product_index[pair]
+        dates = (np.datetime64(start, 'h') + day * np.timedelta64(24, 'h')
+                 + hours[pair] * np.timedelta64(1, 'h')).astype('datetime64[ns]')
+        
+        predicted = self.predict_rows(ids[rows_product], dates, grid[rows_product, candidate])
+        quantity = np.zeros((n, k))
+        weights = hour_weights[rows_product, hours[pair]]
+        np.add.at(quantity, (rows_product, candidate), np.clip(predicted, 0, None) * weights)
+        
+        margin = grid - costs[:, None]
+        profit = margin * quantity
+        choice, evaluated = self.choose_prices(profit, margin, min_profit)
+        
+        index = np.arange(n)
+        unit_profit = float(margin[index, choice].sum())
+        return {
+            "prices": grid[index, choice].tolist(),
+            "quantities": quantity[index, choice].tolist(),
+            "expected_profit": float(profit[index, choice].sum()),
+            "unit_profit": unit_profit,
+            "meets_requirement": unit_profit >= min_profit - 1e-9,
+            "evaluated": evaluated
+        }
+    
+    @staticmethod
+    def choose_prices(profit, margin, min_profit, iterations=50):
+        """Pick one candidate per product maximizing total profit with total margin >= min_profit.
+        
+        Relaxes the margin constraint with a multiplier: for a given weight each
+        product independently takes the candidate maximizing profit + weight *
+        margin. The weight is bisected to the smallest that meets the
+        constraint, and the most profitable feasible vector seen is kept. When
+        even the highest prices fall short, those are returned.
+        
+        Returns:
+            (candidate index per product, number of price vectors evaluated)
+        """
+        index = np.arange(profit.shape[0])
+        
+        def pick(weight):
+            choice = np.argmax(profit + weight * margin, axis=1)
+            return choice, margin[index, choice].sum(), profit[index, choice].sum()
+        
+        choice, unit, total = pick(0.0)
+        if unit >= min_profit:
+            return choice, 1
+        
+        highest = np.argmax(margin, axis=1)
+        if margin[index, highest].sum() < min_profit:
+            return highest, 2
+        best, best_total = highest, profit[index, highest].sum()
+        
+        low, high, evaluated = 0.0, 1.0, 2
+        for _ in range(64):
+            evaluated += 1
+            if pick(high)[1] >= min_profit:
+                break
+            low, high = high, high * 2
+        for _ in range(iterations):
+            middle = (low + high) / 2
+            choice, unit, total = pick(middle)
+            evaluated += 1
+            if unit >= min_profit:
+                high = middle
+                if total > best_total:
+                    best, best_total = choice, total
+            else:
+                low = middle
+        choice, unit, total = pick(high)
+        if total > best_total:
+            best = choice
+        return best, evaluated + 1
+    
     def save(self, model_path):
         """Save the trained model to a file.
         
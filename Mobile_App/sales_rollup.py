@@ -0,0 +1,97 @@
+"""Maintenance of the hourly sales rollup table.
+
+The rollup holds one row per (product, day, hour) so that training, forecasting
+and analytics read a number of rows proportional to days x products instead of
+scanning every sale item.
+
+Run this module directly to rebuild the rollup from raw sales (e.g. after a
+backfill or import):
+
+    python sales_rollup.py [--database-url sqlite:///./pos_system.db]
+"""
+import argparse
+
+from sqlalchemy import create_engine, func, cast, Integer, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import sessionmaker
+
+from database_models import Base, Product, Sale, SaleItem, SalesRollup
+from elasticity import record_bucket_change, rebuild_demand_stats
+
+DEFAULT_DATABASE_URL = "sqlite:///./pos_system.db"
+
+
+def record_sale_item(db, product_id, timestamp, quantity, price, cost_price):
+    """Add a sale item to its rollup bucket, and the bucket to the demand statistics.
+
+    Only stages the upserts on the session; the caller commits them together
+    with the sale item so the rollup never drifts from the raw sales.
+    """
+    stmt = sqlite_insert(SalesRollup).values(
+        product_id=product_id,
+        day=timestamp.date(),
+        hour=timestamp.hour,
+        quantity=quantity,
+        revenue=price * quantity,
+        cost=cost_price * quantity
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['product_id', 'day', 'hour'],
+        set_={
+            'quantity': SalesRollup.quantity + stmt.excluded.quantity,
+            'revenue': SalesRollup.revenue + stmt.excluded.revenue,
+            'cost': SalesRollup.cost + stmt.excluded.cost
+        }
+    ).returning(SalesRollup.quantity, SalesRollup.revenue)
+    total_quantity, total_revenue = db.execute(stmt).one()
+    record_bucket_change(db, product_id, timestamp.date(),
+                         (total_quantity - quantity, total_revenue - price * quantity),
+                         (total_quantity, total_revenue))
+
+
+def rebuild_sales_rollup(db):
+    """Recompute the whole rollup from sale items in a single INSERT ... SELECT,
+    and the demand statistics from it.
+
+    Cost uses each product's current cost price, since historical cost is not
+    stored on sale items.
+
+    Returns:
+        Number of rollup rows written
+    """
+    day = func.date(Sale.timestamp)
+    hour = cast(func.strftime('%H', Sale.timestamp), Integer)
+    aggregate = db.query(
+        SaleItem.product_id,
+        day.label('day'),
+        hour.label('hour'),
+        func.sum(SaleItem.quantity),
+        func.sum(SaleItem.price_at_sale * SaleItem.quantity),
+        func.sum(Product.cost_price * SaleItem.quantity)
+    ).join(Sale, SaleItem.sale_id == Sale.id)\
+     .join(Product, SaleItem.product_id == Product.id)\
+     .group_by(SaleItem.product_id, day, hour)
+
+    db.query(SalesRollup).delete()
+    db.execute(insert(SalesRollup).from_select(
+        ['product_id', 'day', 'hour', 'quantity', 'revenue', 'cost'],
+        aggregate.statement
+    ))
+    rebuild_demand_stats(db)
+    db.commit()
+    return db.query(func.count()).select_from(SalesRollup).scalar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the sales rollup table from raw sales.")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        rows = rebuild_sales_rollup(db)
+        print(f"✅ Rebuilt sales rollup: {rows} rows")
+    finally:
+        db.close()
@@ -0,0 +1,105 @@
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import List, Literal, Optional, Union
+import datetime
+
+from database_models import DEFAULT_STORE_ID
+
+
+# Response schemas for the hot read endpoints. Declaring them lets FastAPI
+# serialize straight from ORM attributes instead of inspecting each object.
+class ProductOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    sku: str
+    name: str
+    description: Optional[str] = None
+    cost_price: float
+    base_price: float
+    current_price: float
+    stock_quantity: Optional[int] = None
+    created_at: Optional[datetime.datetime] = None
+    updated_at: Optional[datetime.datetime] = None
+
+
+class SaleOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    customer_id: Optional[int] = None
+    store_id: Optional[int] = None
+    total_amount: float
+    payment_method: Optional[str] = None
+    timestamp: Optional[datetime.datetime] = None
+
+
+class SaleLineOut(BaseModel):
+    product_id: int
+    product_name: str
+    quantity: int
+    price: float
+    subtotal: float
+
+
+class SaleDetailOut(BaseModel):
+    id: int
+    customer_id: Optional[int] = None
+    store_id: Optional[int] = None
+    total_amount: float
+    timestamp: Optional[datetime.datetime] = None
+    items: List[SaleLineOut]
+
+
+# One occupancy sensor reading; omitted fields keep the store's last value
+class StatusReading(BaseModel):
+    store_id: int = DEFAULT_STORE_ID
+    vacancy_rate: Optional[float] = None
+    line_length: Optional[int] = None
+    timestamp: Optional[datetime.datetime] = None
+
+    @field_validator('timestamp')
+    @classmethod
+    def naive_utc(cls, value):
+        # Stored timestamps are naive UTC; an offset is converted and dropped so
+        # readings with and without one compare and sort together
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+
+
+# One row of a bulk catalog import; omitted description and stock keep the
+# existing product's values
+class ProductImportRow(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    sku: str = Field(min_length=1, max_length=50)
+    name: str = Field(min_length=1, max_length=100)
+    description: Optional[str] = Field(None, max_length=500)
+    cost_price: float = Field(ge=0)
+    base_price: float = Field(gt=0)
+    stock_quantity: Optional[int] = Field(None, ge=0)
+
+
+# A pricing rule to try in a what-if simulation; like a stored rule, but the
+# condition may be given as an object
+class SimulatedRule(BaseModel):
+    product_id: int
+    rule_type: Literal['time_of_day', 'day_of_week', 'stock_level', 'line_length', 'vacancy_rate']
+    condition: Union[dict, str]
+    discount_percentage: float
+
+
+# Rules simulated together: new ones and stored ones by id (active or not),
+# on top of the active rules unless replace_active
+class SimulatedRuleSet(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    rules: List[SimulatedRule] = []
+    rule_ids: List[int] = []
+    replace_active: bool = False
+
+
+class RuleSimulationRequest(BaseModel):
+    rule_sets: List[SimulatedRuleSet] = Field(min_length=1, max_length=20)
+    store_id: int = DEFAULT_STORE_ID
+    start_date: Optional[datetime.date] = None  # Default: a year before end_date
+    end_date: Optional[datetime.date] = None  # Inclusive; default: yesterday
@@ -0,0 +1,76 @@
+# Cold start benchmark for the API
+#
+# Times, each in a fresh interpreter, importing api_backend and running its
+# startup (schema setup on a new database, catalog load, background tasks)
+# until it would accept requests. Also checks that the prediction stack
+# (pandas, NumPy, scikit-learn, joblib) was not loaded on the way. Exits 1 when
+# the median time is over a target or a heavy module was imported.
+#
+#   python startup_bench.py --runs 5 --import-target-ms 1500 --startup-target-ms 1000
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ("pandas", "numpy", "sklearn", "joblib")
+
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import api_backend
+imported = time.perf_counter()
+
+async def start_app():
+    async with api_backend.app.router.lifespan_context(api_backend.app):
+        return time.perf_counter()
+
+ready = asyncio.run(start_app())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "heavy_modules": [m for m in %r if m in sys.modules]
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once():
+    env = dict(os.environ,
+               POS_DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}",
+               POS_PREDICTION_WARMUP="0")
+    output = subprocess.run([sys.executable, "-W", "ignore", "-c", CHILD], env=env, check=True,
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time importing and starting the API in fresh interpreters.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-target-ms", type=float, default=1500.0)
+    parser.add_argument("--startup-target-ms", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    imports = [r["import_ms"] for r in results]
+    startups = [r["startup_ms"] for r in results]
+    heavy = sorted({m for r in results for m in r["heavy_modules"]})
+
+    print(f"Import:  median {statistics.median(imports):.0f}ms, max {max(imports):.0f}ms over {args.runs} runs")
+    print(f"Startup: median {statistics.median(startups):.0f}ms, max {max(startups):.0f}ms (new database)")
+
+    checks = {
+        f"import under {args.import_target_ms:.0f}ms": statistics.median(imports) <= args.import_target_ms,
+        f"startup under {args.startup_target_ms:.0f}ms": statistics.median(startups) <= args.startup_target_ms,
+        "prediction stack not loaded" + (f" (loaded {', '.join(heavy)})" if heavy else ""): not heavy
+    }
+    for name, passed in checks.items():
+        print(f"{'✅' if passed else '❌'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Ingestion and retention of store status (occupancy sensor) readings.
+
+Sensors can report every second, so readings are not written one by one.
+`StatusCoalescer` keeps the latest reading per store; the API flushes it once
+per debounce window, writing at most one store_status row per store per
+window. Only products whose line_length or vacancy_rate rules change state
+between the previous and new status are repriced (`flipped_products`).
+
+`downsample` keeps the status table bounded: raw rows past the retention
+period are folded into per-minute aggregates in store_status_history, and old
+minute aggregates into hourly ones.
+"""
+import datetime
+import json
+import threading
+from typing import NamedTuple, Optional
+
+from sqlalchemy import func, select, literal, and_, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+
+from database_models import StoreStatus, StoreStatusHistory
+
+STATUS_RULE_TYPES = ('line_length', 'vacancy_rate')
+
+
+class RetentionPolicy(NamedTuple):
+    raw: datetime.timedelta  # Keep individual readings this long
+    minute: datetime.timedelta  # Then minute aggregates this long
+    hour: Optional[datetime.timedelta]  # Then hour aggregates this long (None: forever)
+
+
+def status_rule_active(rule_type, condition, vacancy_rate, line_length):
+    """Check whether a status-based rule applies for a store status."""
+    if rule_type == 'line_length':
+        # Example condition: {"min_length": 5}
+        return 'min_length' in condition and line_length >= condition['min_length']
+    if rule_type == 'vacancy_rate':
+        # Example condition: {"min_rate": 50}
+        return 'min_rate' in condition and vacancy_rate >= condition['min_rate']
+    raise ValueError(f"'{rule_type}' is not a status-based rule type")
+
+
+def flipped_products(rules, old, new):
+    """Get the products whose status rules change state from `old` to `new`.
+
+    Args:
+        rules: Iterable of (product_id, rule_type, condition JSON string)
+        old, new: (vacancy_rate, line_length)
+    """
+    product_ids = set()
+    for product_id, rule_type, condition in rules:
+        try:
+            condition = json.loads(condition)
+        except json.JSONDecodeError:
+            continue
+        if status_rule_active(rule_type, condition, *old) != status_rule_active(rule_type, condition, *new):
+            product_ids.add(product_id)
+    return product_ids
+
+
+class StatusCoalescer:
+    """Latest pending reading per store, merged until the next flush."""
+
+    def __init__(self):
+        self.pending = {}  # store_id -> {"vacancy_rate", "line_length", "timestamp", "readings"}
+        self._lock = threading.Lock()
+
+    def submit(self, store_id, vacancy_rate=None, line_length=None, timestamp=None):
+        """Merge a reading; a field left out keeps its last pending (or stored) value."""
+        with self._lock:
+            reading = self.pending.setdefault(store_id, {"vacancy_rate": None, "line_length": None,
+                                                         "timestamp": None, "readings": 0})
+            if vacancy_rate is not None:
+                reading["vacancy_rate"] = vacancy_rate
+            if line_length is not None:
+                reading["line_length"] = line_length
+            reading["timestamp"] = max(filter(None, (reading["timestamp"], timestamp)), default=None)
+            reading["readings"] += 1
+
+    def drain(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, store_id, reading):
+        """Put back a drained reading that failed to apply, under any newer one."""
+        with self._lock:
+            newer = self.pending.get(store_id)
+            if newer is None:
+                self.pending[store_id] = reading
+                return
+            for field in ("vacancy_rate", "line_length"):
+                if newer[field] is None:
+                    newer[field] = reading[field]
+            newer["readings"] += reading["readings"]
+
+
+def downsample(db, policy, now=None):
+    """Fold raw readings and minute aggregates past their retention into coarser aggregates.
+
+    The latest raw reading of each store is always kept, since pricing reads it.
+
+    Returns:
+        Number of raw status rows removed
+    """
+    now = now or datetime.datetime.utcnow()
+    raw_cutoff = now - policy.raw
+    newer = aliased(StoreStatus)
+    latest = select(func.max(newer.timestamp)).where(newer.store_id == StoreStatus.store_id).scalar_subquery()
+    expired = and_(StoreStatus.timestamp < raw_cutoff, StoreStatus.timestamp < latest)
+
+    minute = func.strftime('%Y-%m-%d %H:%M:00', StoreStatus.timestamp)
+    merge_into(db, select(
+        StoreStatus.store_id, literal('minute'), minute,
+        func.count(), func.avg(StoreStatus.vacancy_rate), func.max(StoreStatus.vacancy_rate),
+        func.avg(StoreStatus.line_length), func.max(StoreStatus.line_length)
+    ).where(expired).group_by(StoreStatus.store_id, minute))
+    removed = db.execute(delete(StoreStatus).where(expired)).rowcount
+
+    minute_cutoff = now - policy.raw - policy.minute
+    old_minutes = and_(StoreStatusHistory.resolution == 'minute', StoreStatusHistory.bucket_start < minute_cutoff)
+    hour = func.strftime('%Y-%m-%d %H:00:00', StoreStatusHistory.bucket_start)
+    samples = func.sum(StoreStatusHistory.samples)
+    merge_into(db, select(
+        StoreStatusHistory.store_id, literal('hour'), hour, samples,
+        func.sum(StoreStatusHistory.vacancy_avg * StoreStatusHistory.samples) / samples,
+        func.max(StoreStatusHistory.vacancy_max),
+        func.sum(StoreStatusHistory.line_avg * StoreStatusHistory.samples) / samples,
+        func.max(StoreStatusHistory.line_max)
+    ).where(old_minutes).group_by(StoreStatusHistory.store_id, hour))
+    db.execute(delete(StoreStatusHistory).where(old_minutes))
+
+    if policy.hour is not None:
+        hour_cutoff = minute_cutoff - policy.hour
+        db.execute(delete(StoreStatusHistory).where(StoreStatusHistory.resolution == 'hour',
+                                                    StoreStatusHistory.bucket_start < hour_cutoff))
+    db.commit()
+    return removed
+
+
+def merge_into(db, aggregates):
+    """Insert aggregate rows, combining with any existing row for the same bucket."""
+    history = StoreStatusHistory.__table__.c
+    stmt = sqlite_insert(StoreStatusHistory).from_select(
+        ['store_id', 'resolution', 'bucket_start', 'samples', 'vacancy_avg', 'vacancy_max', 'line_avg', 'line_max'],
+        aggregates
+    )
+    total = history.samples + stmt.excluded.samples
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['store_id', 'resolution', 'bucket_start'],
+        set_={
+            'samples': total,
+            'vacancy_avg': (history.vacancy_avg * history.samples + stmt.excluded.vacancy_avg * stmt.excluded.samples) / total,
+            'vacancy_max': func.max(history.vacancy_max, stmt.excluded.vacancy_max),
+            'line_avg': (history.line_avg * history.samples + stmt.excluded.line_avg * stmt.excluded.samples) / total,
+            'line_max': func.max(history.line_max, stmt.excluded.line_max)
+        }
+    )
+    db.execute(stmt)
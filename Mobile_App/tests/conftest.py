@@ -0,0 +1,44 @@
+"""Shared fixtures: the API running against a throwaway database.
+
+api_backend reads POS_DATABASE_URL when it is imported, so one database serves
+the whole session. Tests create the rows they need under their own skus
+rather than assume an empty catalog.
+"""
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+sku_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    os.environ["POS_DATABASE_URL"] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'pos.db'}"
+    os.environ["POS_PREDICTION_WARMUP"] = "0"
+    import api_backend
+    return api_backend
+
+
+@pytest.fixture(scope="session")
+def client(api):
+    from fastapi.testclient import TestClient
+    with TestClient(api.app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_product(client):
+    """Create a product through the API and return its id."""
+    def make(prefix, **params):
+        count = next(sku_numbers)
+        fields = {"name": f"{prefix} {count}", "sku": f"{prefix}-{count}", "cost_price": 1.0,
+                  "base_price": 2.0, "stock_quantity": 1000, **params}
+        response = client.post("/products/", params=fields)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    return make
@@ -0,0 +1,92 @@
+"""The log-log demand fit and the statistics kept in step with checkouts."""
+import datetime
+import math
+import types
+
+import numpy as np
+import pytest
+
+from database_models import DemandStats, Sale
+import elasticity
+
+ELASTICITY = -2.5
+
+
+def synthetic_rows(intercepts, elasticity_, points=40, seed=7):
+    """DemandStats-like rows of log q = a[weekday] + b log p plus a little noise."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for day_of_week, intercept in intercepts.items():
+        x = np.log(rng.uniform(2.0, 8.0, points))
+        y = intercept + elasticity_ * x + rng.normal(0, 0.05, points)
+        rows.append(types.SimpleNamespace(
+            day_of_week=day_of_week, observations=points, sum_x=x.sum(), sum_y=y.sum(),
+            sum_xx=(x * x).sum(), sum_xy=(x * y).sum(), sum_yy=(y * y).sum()))
+    return rows
+
+
+def test_fit_recovers_a_known_elasticity():
+    fit = elasticity.DemandFit(synthetic_rows({0: 5.0, 3: 6.0, 6: 4.5}, ELASTICITY))
+    assert fit.elasticity == pytest.approx(ELASTICITY, abs=0.05)
+    assert fit.intercepts[3][0] == pytest.approx(6.0, abs=0.1)
+    assert fit.confidence_problem() is None
+
+    cost = 4.0
+    price, profit = fit.optimal_price(cost, 1.0, 100.0)
+    assert price == pytest.approx(cost * fit.elasticity / (1 + fit.elasticity))
+    assert profit == pytest.approx((price - cost) * fit.expected_quantity(price))
+    # The closed form is the maximum: nearby prices earn less
+    for nearby in (price * 0.95, price * 1.05):
+        assert (nearby - cost) * fit.expected_quantity(nearby) < profit
+    # and clamping it to the allowed range is the constrained optimum
+    assert fit.optimal_price(cost, 1.0, 5.0)[0] == 5.0
+
+
+def stats_rows(db, product_id):
+    return {
+        row.day_of_week: (row.observations, row.sum_x, row.sum_y, row.sum_xx, row.sum_xy, row.sum_yy)
+        for row in db.query(DemandStats).filter(DemandStats.product_id == product_id)
+    }
+
+
+def test_checkouts_keep_the_statistics_of_a_rebuild(api, client, make_product):
+    product_id = make_product("DEMAND", base_price=5.0, cost_price=1.0)
+    monday = datetime.datetime(2025, 6, 2, 10)
+
+    def past_sale(when, *quantities):
+        sale_id = client.post("/sales/").json()["id"]
+        db = api.SessionLocal()
+        try:
+            db.query(Sale).filter(Sale.id == sale_id).update({"timestamp": when})
+            db.commit()
+        finally:
+            db.close()
+        for quantity in quantities:
+            add_item(sale_id, quantity)
+        return sale_id
+
+    def add_item(sale_id, quantity):
+        response = client.post(f"/sales/{sale_id}/add-item", params={"product_id": product_id, "quantity": quantity})
+        assert response.status_code == 200, response.text
+
+    open_sale = past_sale(monday, 2)
+    past_sale(monday + datetime.timedelta(minutes=20), 3)  # The same bucket
+    past_sale(monday + datetime.timedelta(days=1, hours=4), 1)
+    past_sale(monday + datetime.timedelta(days=7, hours=1), 4, 1)
+    # An item added later to a sale that's long closed changes its old bucket
+    add_item(open_sale, 5)
+
+    db = api.SessionLocal()
+    try:
+        incremental = stats_rows(db, product_id)
+        elasticity.rebuild_demand_stats(db)
+        rebuilt = stats_rows(db, product_id)
+    finally:
+        db.rollback()
+        db.close()
+    assert incremental.keys() == rebuilt.keys() == {0, 1}
+    for day_of_week, sums in rebuilt.items():
+        assert incremental[day_of_week] == pytest.approx(sums)
+    # Monday: the 10:00 bucket (2 + 3 + 5 units) and the next week's 11:00 one; Tuesday: one bucket
+    assert incremental[0][0] == 2 and incremental[1][0] == 1
+    assert incremental[0][2] == pytest.approx(math.log(10) + math.log(5))
@@ -0,0 +1,126 @@
+"""Fan-out and ordering of the cross-worker pub/sub backends."""
+import asyncio
+import collections
+import json
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database_models import Base
+from pubsub import DatabasePubSub, RedisPubSub
+
+
+class FakeRedis:
+    """The part of the redis.asyncio client RedisPubSub uses, fanning out in memory."""
+
+    def __init__(self):
+        self.subscribers = []
+
+    async def publish(self, channel, data):
+        for subscriber in self.subscribers:
+            if channel.startswith(subscriber.prefix):
+                subscriber.queue.put_nowait({"type": "pmessage", "channel": channel.encode(), "data": data})
+
+    def pubsub(self):
+        return FakeRedisSubscription(self)
+
+
+class FakeRedisSubscription:
+    def __init__(self, client):
+        self.client = client
+        self.prefix = None
+        self.queue = asyncio.Queue()
+
+    async def psubscribe(self, pattern):
+        self.prefix = pattern.rstrip("*")
+        self.client.subscribers.append(self)
+        self.queue.put_nowait({"type": "psubscribe", "channel": pattern.encode(), "data": 1})
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        self.client.subscribers.remove(self)
+
+
+def fan_out(workers, published, timeout=5.0):
+    """Run every worker's receive loop, publish from the first one, and collect
+    what each received per channel."""
+    async def scenario():
+        received = [collections.defaultdict(list) for _ in workers]
+
+        def collector(inbox):
+            async def deliver(channel, events):
+                inbox[channel].extend(events)
+            return deliver
+
+        tasks = [asyncio.create_task(worker.run(collector(inbox))) for worker, inbox in zip(workers, received)]
+        await asyncio.sleep(0.05)  # Let every worker subscribe or find its starting id
+        for channel, events in published:
+            await workers[0].publish(channel, events)
+
+        expected = sum(len(events) for _, events in published)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while any(sum(map(len, inbox.values())) < expected for inbox in received):
+            assert asyncio.get_running_loop().time() < deadline, "messages were not delivered"
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return received
+
+    return asyncio.run(scenario())
+
+
+PUBLISHED = [("stock", [{"n": 1}, {"n": 2}]), ("prices", [{"n": 3}]), ("stock", [{"n": 4}]),
+             ("prices", [{"n": 5}, {"n": 6}]), ("stock", [{"n": 7}])]
+
+
+def expected_by_channel():
+    expected = collections.defaultdict(list)
+    for channel, events in PUBLISHED:
+        expected[channel].extend(events)
+    return expected
+
+
+def test_redis_fans_out_to_every_worker_in_order():
+    client = FakeRedis()
+    workers = [RedisPubSub(client), RedisPubSub(client)]
+    for received in fan_out(workers, PUBLISHED):
+        assert received == expected_by_channel()
+
+
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pubsub.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def test_database_fans_out_to_every_worker_in_order(tmp_path):
+    factory = session_factory(tmp_path)
+    workers = [DatabasePubSub(factory, poll_interval=0.01) for _ in range(2)]
+    for received in fan_out(workers, PUBLISHED):
+        assert received == expected_by_channel()
+
+
+def test_database_reader_survives_a_locked_database(tmp_path):
+    factory = session_factory(tmp_path)
+    flaky = DatabasePubSub(factory, poll_interval=0.01)
+    read_after = flaky._read_after
+    failures = []
+
+    def locked_once(last_id):
+        if not failures:
+            failures.append(last_id)
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+        return read_after(last_id)
+
+    flaky._read_after = locked_once
+    publisher = DatabasePubSub(factory, poll_interval=0.01)
+    publisher._read_after = read_after
+    received = fan_out([publisher, flaky], PUBLISHED)
+    assert failures
+    assert received[1] == expected_by_channel()
+    assert json.dumps(received[0], sort_keys=True) == json.dumps(received[1], sort_keys=True)
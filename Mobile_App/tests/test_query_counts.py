@@ -0,0 +1,95 @@
+"""Pin the hot read endpoints to a constant number of SQL statements.
+
+Each endpoint is called with a small and a large basket or page, and must run
+the same statements either way; a lazy load per line or row would show up as
+a count that grows with the size.
+"""
+import pytest
+from sqlalchemy import event
+
+PRODUCTS = 40
+SALES = 30
+
+
+@pytest.fixture(scope="module")
+def app(api, client):
+    product_ids = [
+        client.post("/products/", params={"name": f"Product {i}", "sku": f"QC-{i}", "cost_price": 1.0,
+                                          "base_price": 2.0, "stock_quantity": 1000}).json()["id"]
+        for i in range(PRODUCTS)
+    ]
+    store_id = client.post("/stores/", params={"name": "Second store"}).json()["id"]
+    sale_ids = [client.post("/sales/").json()["id"] for _ in range(SALES)]
+    # Basket sizes 1, 2, ... so sale i has i + 1 lines
+    for i, sale_id in enumerate(sale_ids):
+        for product_id in product_ids[:i + 1]:
+            client.post(f"/sales/{sale_id}/add-item", params={"product_id": product_id, "quantity": 1})
+    return client, api.engine, sale_ids, store_id
+
+
+def statements(engine, call):
+    """Run `call` and count the SQL statements its request sessions executed.
+
+    Background tasks share the engine, so only connections checked out by a
+    request's session are counted.
+    """
+    import api_backend
+
+    connections = set()
+    executed = []
+
+    def get_db():
+        db = api_backend.SessionLocal()
+        checked_out = []
+
+        @event.listens_for(db, "after_begin")
+        def track(session, transaction, conn):
+            checked_out.append(conn.connection.dbapi_connection)
+            connections.add(conn.connection.dbapi_connection)
+
+        try:
+            yield db
+        finally:
+            db.close()
+            # Back in the pool, the connection may serve a background task
+            connections.difference_update(checked_out)
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if conn.connection.dbapi_connection in connections:
+            executed.append(statement)
+
+    api_backend.app.dependency_overrides[api_backend.get_db] = get_db
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = call()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+        api_backend.app.dependency_overrides.clear()
+    assert response.status_code == 200
+    return len(executed), response.json()
+
+
+def test_sale_detail_is_constant_in_basket_size(app):
+    client, engine, sale_ids, _ = app
+    small, small_sale = statements(engine, lambda: client.get(f"/sales/{sale_ids[0]}"))
+    large, large_sale = statements(engine, lambda: client.get(f"/sales/{sale_ids[-1]}"))
+    assert (len(small_sale["items"]), len(large_sale["items"])) == (1, SALES)
+    assert small == large
+
+
+def test_sales_list_is_constant_in_page_size(app):
+    client, engine, _, _ = app
+    small, small_page = statements(engine, lambda: client.get("/sales/", params={"limit": 1}))
+    large, large_page = statements(engine, lambda: client.get("/sales/", params={"limit": SALES}))
+    assert (len(small_page), len(large_page)) == (1, SALES)
+    assert small == large
+
+
+@pytest.mark.parametrize("store", ["default", "other"])
+def test_products_list_is_constant_in_page_size(app, store):
+    client, engine, _, store_id = app
+    params = {} if store == "default" else {"store_id": store_id}
+    small, small_page = statements(engine, lambda: client.get("/products/", params={**params, "limit": 1}))
+    large, large_page = statements(engine, lambda: client.get("/products/", params={**params, "limit": PRODUCTS}))
+    assert (len(small_page), len(large_page)) == (1, PRODUCTS)
+    assert small == large
@@ -0,0 +1,22 @@
+"""Reprice timings recorded in pos_reprice_seconds."""
+import json
+
+
+def test_import_reprice_duration_is_a_duration(api, client, make_product):
+    product_id = make_product("IMPORT")
+    sku = client.get(f"/products/{product_id}").json()["sku"]
+    # A rule makes the import reprice the product in the batched reprice_store loop
+    response = client.post("/pricing-rules/", params={
+        "product_id": product_id, "rule_type": "stock_level",
+        "condition": json.dumps({"min_stock": 0, "max_stock": 100000}), "discount_percentage": 10
+    })
+    assert response.status_code == 200
+
+    before = list(api.REPRICE_SECONDS.values.get(("import",), [0.0, 0])[-2:])
+    body = json.dumps({"sku": sku, "name": "Imported", "cost_price": 1.0, "base_price": 3.0})
+    response = client.post("/products/import", params={"format": "ndjson"}, content=body.encode())
+    assert response.status_code == 200, response.text
+    total, count = api.REPRICE_SECONDS.values[("import",)][-2:]
+
+    assert count == before[1] + 1
+    assert 0 <= total - before[0] < 5
@@ -0,0 +1,123 @@
+"""The vectorized rule replay against the live pricing path."""
+import datetime
+import json
+import types
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from database_models import PricingRule, Product, SalesRollup, StoreStatus, StoreStatusHistory
+import rule_simulation
+
+RULES = [
+    ('time_of_day', {"start_hour": 9, "end_hour": 17}),
+    ('day_of_week', {"days": [0, 6]}),
+    ('stock_level', {"min_stock": 5, "max_stock": 20}),
+    ('line_length', {"min_length": 4}),
+    ('vacancy_rate', {"min_rate": 50}),
+    ('time_of_day', {"start_hour": 9}),  # Incomplete conditions never apply
+]
+
+
+@pytest.mark.parametrize("rule_type,condition", RULES)
+def test_rule_mask_matches_calculate_dynamic_price(api, client, make_product, monkeypatch, rule_type, condition):
+    store_id = client.post("/stores/", params={"name": "Mask store", "timezone": "America/New_York"}).json()["id"]
+    product_id = make_product("MASK", base_price=10.0, cost_price=1.0)
+
+    hours = pd.date_range("2026-03-06", periods=7 * 24, freq="h")  # Across the DST change
+    local = hours.tz_localize("UTC").tz_convert("America/New_York")
+    stock = np.arange(len(hours)) % 30
+    timeline = {"local_hour": local.hour.values, "weekday": local.dayofweek.values,
+                "vacancy_rate": (np.arange(len(hours)) * 7 % 100).astype(float),
+                "line_length": (np.arange(len(hours)) % 8).astype(float)}
+    mask = rule_simulation.rule_mask(rule_type, condition, timeline, stock)
+
+    status = types.SimpleNamespace()
+    monkeypatch.setattr(api, "latest_store_status", lambda db, store_id: status)
+    db = api.SessionLocal()
+    try:
+        db.add(PricingRule(product_id=product_id, rule_type=rule_type, condition=json.dumps(condition),
+                           discount_percentage=10))
+        db.flush()
+        product = db.get(Product, product_id)
+        discounted = []
+        for i, hour in enumerate(hours):
+            status.vacancy_rate, status.line_length = timeline["vacancy_rate"][i], timeline["line_length"][i]
+            price = api.calculate_dynamic_price(db, product, store_id, stock_quantity=int(stock[i]),
+                                                now=hour.tz_localize("UTC").to_pydatetime())
+            discounted.append(price < product.base_price)
+    finally:
+        db.rollback()
+        db.close()
+    assert mask.tolist() == discounted
+
+
+def test_status_timeline_carries_the_last_reading_into_the_window(api, client):
+    store_id = client.post("/stores/", params={"name": "Timeline store"}).json()["id"]
+    start = datetime.datetime(2026, 2, 1)
+    db = api.SessionLocal()
+    try:
+        db.add_all([
+            StoreStatus(store_id=store_id, line_length=1, vacancy_rate=10, timestamp=start - datetime.timedelta(days=30)),
+            StoreStatusHistory(store_id=store_id, resolution="hour", bucket_start=start - datetime.timedelta(days=2),
+                               samples=4, vacancy_avg=20, vacancy_max=30, line_avg=2, line_max=3),
+            StoreStatus(store_id=store_id, line_length=7, vacancy_rate=70, timestamp=start + datetime.timedelta(minutes=90)),
+            StoreStatus(store_id=store_id, line_length=9, vacancy_rate=90, timestamp=start + datetime.timedelta(hours=5)),
+        ])
+        db.flush()
+        hours = pd.date_range(start, periods=3, freq="h")
+        vacancy, line = rule_simulation.status_timeline(db, store_id, hours)
+    finally:
+        db.rollback()
+        db.close()
+    assert line.tolist() == [2, 2, 7]
+    assert vacancy.tolist() == [20, 20, 70]
+
+
+def test_stock_is_replayed_from_sales_since(api, make_product):
+    product_id = make_product("REPLAY", base_price=10.0, cost_price=1.0, stock_quantity=10)
+    day = datetime.date(2020, 1, 6)
+    db = api.SessionLocal()
+    try:
+        db.add_all([
+            SalesRollup(product_id=product_id, day=day, hour=5, quantity=3, revenue=30.0, cost=3.0),
+            SalesRollup(product_id=product_id, day=day + datetime.timedelta(days=1), hour=10, quantity=4,
+                        revenue=40.0, cost=4.0),
+            # Sold after the window, still counted back into its stock
+            SalesRollup(product_id=product_id, day=day + datetime.timedelta(days=5), hour=0, quantity=2,
+                        revenue=20.0, cost=2.0),
+        ])
+        db.flush()
+
+        def discounted_hours(stock):
+            rule_sets = [{"name": "at", "rules": [(product_id, 'stock_level', {"min_stock": stock, "max_stock": stock}, 10)],
+                          "replace_active": True}]
+            start = datetime.datetime.combine(day, datetime.time())
+            result = rule_simulation.simulate_rule_sets(db, rule_sets, api.DEFAULT_STORE_ID, ZoneInfo("UTC"),
+                                                        start, start + datetime.timedelta(days=2))
+            return result["rule_sets"][0]["products"][0]["discounted_hours"]
+
+        # 10 in stock now + 2 sold later, + 4 sold on the second day (through 10:00), + 3 on the first (through 5:00)
+        assert discounted_hours(19) == 6
+        assert discounted_hours(16) == 18 + 11
+        assert discounted_hours(12) == 13
+    finally:
+        db.rollback()
+        db.close()
+
+
+def test_elasticity_response(monkeypatch):
+    fits = {1: types.SimpleNamespace(elasticity=-2.0, observations=100),
+            2: types.SimpleNamespace(elasticity=-9.0, observations=100),  # Clipped to ELASTICITY_RANGE
+            3: types.SimpleNamespace(elasticity=-2.0, observations=5)}  # Too few to trust, and no forest
+    monkeypatch.setattr(rule_simulation.elasticity, "fits", lambda db, product_ids: fits)
+    row = np.array([0, 1, 2, 0])
+    actual = np.array([10.0, 10.0, 10.0, 0.0])
+    response = rule_simulation.demand_response(None, [1, 2, 3], None, row, np.zeros(4, dtype='datetime64[ns]'), actual)
+
+    assert response["models"] == {1: "elasticity", 2: "elasticity", 3: "none"}
+    factor = response["factor"](np.array([8.0, 8.0, 8.0, 8.0]))
+    # A sale without a price to compare against keeps its quantity
+    np.testing.assert_allclose(factor, [0.8 ** -2, 0.8 ** rule_simulation.ELASTICITY_RANGE[0], 1.0, 1.0])
@@ -0,0 +1,26 @@
+"""Sensor readings through the batch endpoint and the coalescer."""
+import datetime
+
+from schemas import StatusReading
+
+
+def test_offset_timestamps_become_naive_utc():
+    reading = StatusReading(timestamp="2026-03-01T12:00:00+02:00")
+    assert reading.timestamp == datetime.datetime(2026, 3, 1, 10, 0)
+    assert StatusReading(timestamp="2026-03-01T12:00:00").timestamp == datetime.datetime(2026, 3, 1, 12, 0)
+
+
+def test_mixed_naive_and_aware_batch(api, client):
+    store_id = client.post("/stores/", params={"name": "Sensor store"}).json()["id"]
+    response = client.post("/store-status/batch", json=[
+        {"store_id": store_id, "vacancy_rate": 40.0, "timestamp": "2026-03-01T10:00:00"},
+        {"store_id": store_id, "line_length": 4, "timestamp": "2026-03-01T12:30:00+02:00"},
+        {"store_id": store_id, "line_length": 5, "timestamp": "2026-03-01T10:15:00Z"},
+    ])
+    assert response.status_code == 202, response.text
+
+    api.apply_status_readings()
+    status = client.get("/store-status/latest", params={"store_id": store_id}).json()
+    assert (status["vacancy_rate"], status["line_length"]) == (40.0, 5)
+    # 12:30+02:00 is 10:30 UTC, the latest of the three
+    assert status["timestamp"] == "2026-03-01T10:30:00"
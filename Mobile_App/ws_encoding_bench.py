@@ -0,0 +1,50 @@
+# Compares WebSocket wire formats on encode cost and bytes on the wire
+
+import random
+import timeit
+import zlib
+
+import ws_protocol
+
+
+def stock_update(product_id):
+    return {"product_id": product_id, "product_name": f"Product {product_id}", "new_stock": random.randint(0, 200)}
+
+
+def price_update(num_products):
+    return {
+        "event": "price_update",
+        "products": [
+            {"id": i, "name": f"Product {i}", "current_price": round(random.uniform(1, 20), 2)}
+            for i in range(1, num_products + 1)
+        ]
+    }
+
+
+def deflated_size(frame):
+    """Approximate permessage-deflate size (raw deflate, no context takeover)."""
+    if isinstance(frame, str):
+        frame = frame.encode()
+    compressor = zlib.compressobj(wbits=-15)
+    return len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def measure(name, events, repeats=200):
+    print(f"\n{name} ({len(events)} events)")
+    print(f"{'format':<12}{'frames':>8}{'encode_us':>12}{'bytes':>10}{'deflated':>10}")
+    for fmt in ws_protocol.FORMATS:
+        if not ws_protocol.is_supported(fmt):
+            print(f"{fmt:<12} (not installed)")
+            continue
+        frames = ws_protocol.encode_frames(events, fmt)
+        seconds = timeit.timeit(lambda: ws_protocol.encode_frames(events, fmt), number=repeats) / repeats
+        raw = sum(len(f.encode() if isinstance(f, str) else f) for f in frames)
+        deflated = sum(deflated_size(f) for f in frames)
+        print(f"{fmt:<12}{len(frames):>8}{seconds * 1e6:>12.1f}{raw:>10}{deflated:>10}")
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    measure("Single stock update", [stock_update(1)])
+    measure("Checkout burst", [stock_update(i) for i in range(1, 21)])
+    measure("Store status price update, 500 products", [price_update(500)])
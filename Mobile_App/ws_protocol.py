@@ -0,0 +1,38 @@
+"""Wire formats for WebSocket broadcasts.
+
+Clients pick a format with the `format` query parameter when connecting to /ws:
+
+    json        One JSON text frame per event (the original protocol, default)
+    json-batch  One JSON text frame per batch window, holding an array of events
+    msgpack     One MessagePack binary frame per batch window, holding an array of events
+
+Compression is negotiated separately through the permessage-deflate extension,
+which uvicorn enables by default.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ("json", "json-batch", "msgpack")
+
+
+def is_supported(fmt):
+    return fmt in FORMATS and (fmt != "msgpack" or msgpack is not None)
+
+
+def encode_frames(events, fmt):
+    """Encode a batch of events into the frames for one format.
+
+    Returns:
+        List of str (text frames) or bytes (binary frames)
+    """
+    if fmt == "json":
+        return [json.dumps(event) for event in events]
+    if fmt == "json-batch":
+        return [json.dumps(events)]
+    if fmt == "msgpack":
+        return [msgpack.packb(events)]
+    raise ValueError(f"Unknown WebSocket format '{fmt}'")